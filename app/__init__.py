@@ -2,9 +2,24 @@ import os
 from flask import Flask
 import google.generativeai as genai
 from config import Config
-from .extensions import db, migrate
+from .extensions import db, migrate, task_pipeline, sock
 from .api import api_bp
+from .api.session_cache import session_user_cache
+from .api.turns import turn_sequencer
+from .api.admission import admission_controller
 from .frontend import frontend_bp
+from .data_transfer import data_cli
+from .analytics import analytics_cli
+from .maintenance import maintenance_cli
+from .simulation import simulate_cli
+from .sharding import configure_shards
+from .usage import usage_flusher
+from bot.router import ModelRouter, GeminiProvider
+from bot.usage import token_usage_counters
+from bot.memory_index import memory_index_cache
+from bot.memory_dedup import near_duplicate_cache
+from bot.events import configure_calendar
+from bot.prompts import configure_personas
 
 def create_app(config_class=Config):
     """
@@ -22,9 +37,15 @@ def create_app(config_class=Config):
     except OSError:
         pass
 
+    # ユーザー単位のシャード (DATABASE_SHARDS > 1 のとき追加の SQLite ファイルを bind として登録)
+    configure_shards(app)
+
     # 拡張機能の初期化
     db.init_app(app)
     migrate.init_app(app, db)
+    task_pipeline.init_app(app)
+    if sock is not None:
+        sock.init_app(app)
 
     # Google Gemini APIの設定
     try:
@@ -35,8 +56,52 @@ def create_app(config_class=Config):
         if not app.debug:
              raise RuntimeError(f"Could not configure Gemini API. Check your API key. Error: {e}")
 
+    # Gemini モデル階層間のルーター (ワーカーごとにレイテンシ/エラー率を追跡)
+    app.extensions['model_router'] = ModelRouter(
+        GeminiProvider(),
+        routes=app.config.get('MODEL_ROUTES'),
+        max_error_rate=app.config.get('MODEL_MAX_ERROR_RATE', 0.2),
+        probe_interval=app.config.get('MODEL_PROBE_INTERVAL', 30.0)
+    )
+
+    # 長期記憶検索インデックスのキャッシュ上限（ユーザー数）
+    memory_index_cache.max_users = app.config.get('MEMORY_INDEX_MAX_USERS', 1000)
+    near_duplicate_cache.max_users = app.config.get('MEMORY_INDEX_MAX_USERS', 1000)
+
+    # セッション -> ユーザー ID キャッシュ（ワーカーごと）
+    session_user_cache.max_entries = app.config.get('SESSION_CACHE_MAX_ENTRIES', 10000)
+    session_user_cache.ttl = app.config.get('SESSION_CACHE_TTL', 300)
+
+    # 同一ユーザーのターンを直列化するシーケンサー（ワーカーごと）
+    turn_sequencer.timeout = app.config.get('TURN_LOCK_TIMEOUT', 30.0)
+
+    # チャットターンの流入制御（LLM 呼び出しの同時実行数・待ち行列・締め切り）
+    admission_controller.max_concurrent = app.config.get('ADMISSION_MAX_CONCURRENT', 8)
+    admission_controller.queue_size = app.config.get('ADMISSION_QUEUE_SIZE', 16)
+    admission_controller.deadline = app.config.get('ADMISSION_DEADLINE', 10.0)
+
+    # トークン使用量カウンタ（ワーカーごと、一定間隔で token_usage_daily に書き出す）
+    token_usage_counters.flush_interval = app.config.get('TOKEN_USAGE_FLUSH_SECONDS', 30.0)
+    # 一定間隔と終了時の書き出し（アイドル中のワーカーの使用量も失わない）。テストでは明示的に flush する
+    if not app.testing:
+        usage_flusher.start(app)
+
+    # イベントカレンダーのデータファイル（変更はワーカー再起動なしで反映される）
+    if app.config.get('EVENTS_FILE'):
+        configure_calendar(app.config['EVENTS_FILE'])
+
+    # ペルソナパックのディレクトリ（編集はワーカー再起動なしで反映される）
+    if app.config.get('PERSONAS_DIR'):
+        configure_personas(app.config['PERSONAS_DIR'])
+
     # ブループリントの登録
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(frontend_bp)
 
+    # CLI コマンド (flask data export/import, flask analytics rebuild-gauges, flask maintenance ..., flask simulate evolution)
+    app.cli.add_command(data_cli)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(maintenance_cli)
+    app.cli.add_command(simulate_cli)
+
     return app
\ No newline at end of file
@@ -0,0 +1,142 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .extensions import db
+from .models import User, AnalyticsDaily, AnalyticsGauge
+from .sharding import iter_shards
+
+# Lower bounds of the affection histogram buckets (aligned with the prompt relationship tiers)
+AFFECTION_BUCKETS = [0, 10, 30, 60, 100, 200]
+
+# Gauge metrics
+PERSONA_USERS = 'persona_users'
+AFFECTION_USERS = 'affection_users'
+
+# Daily metrics
+MESSAGES = 'messages'
+TURNS_BY_PERSONA = 'turns_by_persona'
+NEW_USERS = 'new_users'
+EVOLUTIONS = 'evolutions'
+RE_EVOLUTIONS = 're_evolutions'
+
+analytics_cli = AppGroup('analytics', help='Analytics rollup maintenance.')
+
+
+def affection_bucket(affection: int) -> str:
+    """Histogram bucket label for an affection value"""
+    for lower, upper in zip(AFFECTION_BUCKETS, AFFECTION_BUCKETS[1:]):
+        if affection < upper:
+            return f"{lower}-{upper - 1}"
+    return f"{AFFECTION_BUCKETS[-1]}+"
+
+
+def _upsert_increment(model, keys: Dict[str, Any], column: str, delta: int) -> None:
+    """INSERT ... ON CONFLICT DO UPDATE column = column + delta (single statement, no read)"""
+    if delta == 0:
+        return
+    dialect = db.session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    stmt = insert(model.__table__).values(**keys, **{column: delta})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: getattr(model.__table__.c, column) + delta}
+    )
+    db.session.execute(stmt)
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def increment_daily(metric: str, key: str = 'all', delta: int = 1, day: Optional[date] = None) -> None:
+    _upsert_increment(AnalyticsDaily, {"day": day or _today(), "metric": metric, "key": key}, 'count', delta)
+
+
+def increment_gauge(metric: str, key: str, delta: int) -> None:
+    _upsert_increment(AnalyticsGauge, {"metric": metric, "key": key}, 'value', delta)
+
+
+def record_user_created(user: User) -> None:
+    """Turn event: a new user row was created"""
+    db.session.flush()  # apply column defaults (persona, affection)
+    increment_daily(NEW_USERS)
+    increment_gauge(PERSONA_USERS, user.personality_type, 1)
+    increment_gauge(AFFECTION_USERS, affection_bucket(user.affection), 1)
+
+
+def record_state_change(old_affection: int, old_persona: str, user: User,
+                        evolution_triggered: bool = False, was_evolved: bool = False) -> None:
+    """Turn event: affection and/or persona of an existing user changed"""
+    old_bucket, new_bucket = affection_bucket(old_affection), affection_bucket(user.affection)
+    if old_bucket != new_bucket:
+        increment_gauge(AFFECTION_USERS, old_bucket, -1)
+        increment_gauge(AFFECTION_USERS, new_bucket, 1)
+
+    if old_persona != user.personality_type:
+        increment_gauge(PERSONA_USERS, old_persona, -1)
+        increment_gauge(PERSONA_USERS, user.personality_type, 1)
+
+    if evolution_triggered:
+        increment_daily(RE_EVOLUTIONS if was_evolved else EVOLUTIONS, user.personality_type)
+
+
+def record_turn(old_affection: int, old_persona: str, user: User,
+                evolution_triggered: bool, was_evolved: bool, message_count: int = 2) -> None:
+    """Turn event: a chat turn (user message + AI reply) was scored"""
+    increment_daily(MESSAGES, delta=message_count)
+    increment_daily(TURNS_BY_PERSONA, old_persona)
+    record_state_change(old_affection, old_persona, user, evolution_triggered, was_evolved)
+
+
+def get_summary(days: int = 30) -> Dict[str, Any]:
+    """
+    Read the rollups for the dashboard.
+    Reads only gauge rows and `days` worth of daily rows, independent of the user count.
+    Each shard counts its own users; the counters are summed across shards.
+    """
+    since = _today() - timedelta(days=days - 1)
+
+    gauges: Dict[str, Dict[str, int]] = {}
+    daily: Dict[str, Dict[str, Dict[str, int]]] = {}
+    for _ in iter_shards(db.session):
+        for metric, key, value in db.session.execute(
+                db.select(AnalyticsGauge.metric, AnalyticsGauge.key, AnalyticsGauge.value)):
+            values = gauges.setdefault(metric, {})
+            values[key] = values.get(key, 0) + value
+
+        rows = db.session.execute(
+            db.select(AnalyticsDaily.day, AnalyticsDaily.metric, AnalyticsDaily.key, AnalyticsDaily.count)
+            .where(AnalyticsDaily.day >= since).order_by(AnalyticsDaily.day)
+        )
+        for day, metric, key, count in rows:
+            counts = daily.setdefault(metric, {}).setdefault(day.isoformat(), {})
+            counts[key] = counts.get(key, 0) + count
+
+    return {
+        "since": since.isoformat(),
+        "persona_distribution": gauges.get(PERSONA_USERS, {}),
+        "affection_histogram": gauges.get(AFFECTION_USERS, {}),
+        "daily": daily,
+    }
+
+
+@analytics_cli.command('rebuild-gauges')
+def rebuild_gauges_command():
+    """Recompute the gauge rollups from the users table (one-off, e.g. after deploying rollups)."""
+    for shard in iter_shards(db.session):
+        db.session.execute(db.delete(AnalyticsGauge))
+        counts: Dict[tuple, int] = {}
+        rows = db.session.execute(
+            db.select(User.personality_type, User.affection).execution_options(yield_per=1000)
+        )
+        for persona, affection in rows:
+            for key in ((PERSONA_USERS, persona), (AFFECTION_USERS, affection_bucket(affection))):
+                counts[key] = counts.get(key, 0) + 1
+        db.session.add_all(AnalyticsGauge(metric=metric, key=key, value=value)
+                           for (metric, key), value in counts.items())
+        db.session.commit()
+        click.echo(f"Shard {shard}: rebuilt {len(counts)} gauge rows.")
@@ -4,4 +4,4 @@ from flask import Blueprint
 api_bp = Blueprint('api', __name__)
 
 # Import and register route definitions with blueprint
-from . import routes
\ No newline at end of file
+from . import routes, websocket
@@ -0,0 +1,136 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Lower runs first: a conversation in progress outranks the first message of a new session
+PRIORITY_CONVERSATION = 0
+PRIORITY_NEW_SESSION = 1
+
+# Shed reasons
+QUEUE_FULL = 'queue_full'
+DEADLINE = 'deadline'
+TIMEOUT = 'timeout'
+
+
+class Overloaded(Exception):
+    """The request was shed; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Per-worker admission control for LLM-bound requests (chat turns).
+
+    At most `max_concurrent` requests hold a slot; the rest wait in a bounded priority
+    queue (FIFO within a priority). A request is shed with Overloaded instead of
+    queueing when the queue is full or its estimated wait (queue position x moving
+    average slot time / slots) exceeds `deadline` seconds, and a queued request gives
+    up once it has waited `deadline` seconds. Cheap endpoints never pass through here,
+    so with max_concurrent + queue_size below the worker's threads they stay responsive
+    while the model is slow.
+    """
+
+    def __init__(self, max_concurrent: int = 8, queue_size: int = 16, deadline: float = 10.0, alpha: float = 0.2):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.alpha = alpha
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._queue: List[List[int]] = []
+        self._sequence = itertools.count()
+        self._service_seconds: Optional[float] = None
+        self._metrics = {
+            "admitted": 0,
+            "queued": 0,
+            "total_queue_wait_seconds": 0.0,
+            "max_queue_wait_seconds": 0.0,
+            "shed": {QUEUE_FULL: 0, DEADLINE: 0, TIMEOUT: 0},
+        }
+
+    def _estimated_wait(self, priority: int) -> float:
+        """Expected queue wait of a new request at `priority` (call with the lock held)"""
+        if self._service_seconds is None:
+            return 0.0
+        ahead = sum(1 for entry in self._queue if entry[0] <= priority)
+        return (ahead + 1) * self._service_seconds / max(1, self.max_concurrent)
+
+    def _shed(self, reason: str, priority: int) -> Overloaded:
+        self._metrics["shed"][reason] += 1
+        estimate = max(self._estimated_wait(priority), self._service_seconds or 1.0)
+        return Overloaded(reason, max(1, math.ceil(estimate)))
+
+    @contextmanager
+    def admit(self, priority: int = PRIORITY_CONVERSATION) -> Iterator[None]:
+        """
+        Hold a slot for the body of the with-block.
+
+        Raises:
+            Overloaded: If the request is shed (queue full, estimated wait over the deadline, or timed out waiting).
+        """
+        started = time.monotonic()
+        with self._cond:
+            if self._in_flight < self.max_concurrent and not self._queue:
+                self._in_flight += 1
+            else:
+                if len(self._queue) >= self.queue_size:
+                    raise self._shed(QUEUE_FULL, priority)
+                if self._estimated_wait(priority) > self.deadline:
+                    raise self._shed(DEADLINE, priority)
+
+                entry = [priority, next(self._sequence)]
+                heapq.heappush(self._queue, entry)
+                self._metrics["queued"] += 1
+                give_up_at = started + self.deadline
+                while self._queue[0] is not entry or self._in_flight >= self.max_concurrent:
+                    remaining = give_up_at - time.monotonic()
+                    if remaining <= 0:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        self._cond.notify_all()  # the next request may now be at the head
+                        raise self._shed(TIMEOUT, priority)
+                    self._cond.wait(remaining)
+                heapq.heappop(self._queue)
+                self._in_flight += 1
+                self._cond.notify_all()
+
+                wait = time.monotonic() - started
+                self._metrics["total_queue_wait_seconds"] += wait
+                self._metrics["max_queue_wait_seconds"] = max(self._metrics["max_queue_wait_seconds"], wait)
+            self._metrics["admitted"] += 1
+
+        admitted_at = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                seconds = time.monotonic() - admitted_at
+                self._service_seconds = seconds if self._service_seconds is None else \
+                    self.alpha * seconds + (1 - self.alpha) * self._service_seconds
+                self._cond.notify_all()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            metrics = dict(self._metrics, shed=dict(self._metrics["shed"]))
+            metrics.update({
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "max_concurrent": self.max_concurrent,
+                "queue_size": self.queue_size,
+                "deadline_seconds": self.deadline,
+                "service_seconds": round(self._service_seconds, 3) if self._service_seconds is not None else None,
+                "estimated_wait_seconds": round(self._estimated_wait(PRIORITY_NEW_SESSION), 3),
+            })
+            return metrics
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,63 @@
+import gzip
+import zlib
+from typing import Iterable, Iterator
+from flask import Response, request, current_app
+
+# Only these payloads are worth compressing (images etc. are already compressed)
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/event-stream'}
+
+
+def _gzip_stream(chunks: Iterable[bytes], level: int) -> Iterator[bytes]:
+    """
+    Compress a streamed body chunk by chunk.
+    Each chunk is sync-flushed so the client receives it immediately instead of
+    waiting for the compressor's internal buffer to fill.
+    """
+    # wbits=31 -> gzip container
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush(zlib.Z_FINISH)
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Negotiated gzip compression for API responses.
+    Skipped for small bodies (below API_COMPRESSION_MIN_SIZE), error/partial
+    responses, already-encoded bodies and clients without gzip support.
+    """
+    config = current_app.config
+    if not config.get('API_COMPRESSION_ENABLED', True):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if ('gzip' not in request.accept_encodings
+            or response.status_code < 200 or response.status_code >= 300
+            or response.status_code == 204
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    level = config.get('API_COMPRESSION_LEVEL', 6)
+
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response, level)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    if response.direct_passthrough:
+        return response
+
+    body = response.get_data()
+    if len(body) < config.get('API_COMPRESSION_MIN_SIZE', 1024):
+        return response
+
+    response.set_data(gzip.compress(body, compresslevel=level, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -1,18 +1,35 @@
 import secrets
 import time
 import datetime
+from typing import Optional
 from flask import request, jsonify, session, current_app
-import google.generativeai as genai
 
 from . import api_bp
+from .admission import PRIORITY_CONVERSATION, PRIORITY_NEW_SESSION, Overloaded, admission_controller
+from .compression import compress_response
+from .session_cache import session_user_cache
+from .turns import TurnConflict, turn_sequencer
 from app.models import User, ChatMessage, LongTermMemory
-from app.extensions import db
+from app.extensions import db, task_pipeline
+from app.sharding import select_shard, shard_for_session, shard_for_user_id
+from app import analytics, history, usage
+from app.tasks import TaskQueueFull
 from bot import engine, evolution, memory, prompts
-from bot.events import EventManager
+from bot.events import EventManager, EventSnapshotCache, local_time, resolve_timezone
+from bot.router import CALL_REPLY, CALL_FALLBACK_REPLY, CALL_SCORE, CALL_ECONOMY_REPLY
+from bot.usage import token_usage_counters, usage_scope
+from bot.memory_index import memory_index_cache
+from bot.memory_dedup import near_duplicate_cache
 
 # Rate limiting cache
 request_timestamps = {}
 
+# Event snapshots shared by every request in this worker (per timezone)
+event_snapshot_cache = EventSnapshotCache()
+
+# Negotiated gzip compression for API payloads
+api_bp.after_request(compress_response)
+
 def check_rate_limit(identifier, max_requests, window_seconds=60):
     now = time.time()
     if identifier not in request_timestamps:
@@ -23,28 +40,206 @@ def check_rate_limit(identifier, max_requests, window_seconds=60):
     request_timestamps[identifier].append(now)
     return True
 
-def get_or_create_user() -> User:
+def get_or_create_user(tz_name: str = None) -> User:
     if 'session_id' not in session or 'security_token' not in session:
         session['session_id'] = secrets.token_hex(16)
         session['security_token'] = secrets.token_hex(32)
+        session['shard'] = shard_for_session(session['session_id'], current_app.config.get('DATABASE_SHARDS', 1))
         session.permanent = True
-    
-    user = db.session.scalar(db.select(User).where(User.session_id == session['session_id']))
-    
-    if not user:
-        user = User(session_id=session['session_id'], security_token=session['security_token'])
-        db.session.add(user)
-        db.session.commit()
-        current_app.logger.info(f"New user created: {user.session_id}")
-    else:
-        if user.security_token != session['security_token']:
-            new_token = user.refresh_security_token()
-            session['security_token'] = new_token
+
+    session_id, token = session['session_id'], session['security_token']
+    # Sessions created before sharding have no shard and live in shard 0
+    select_shard(db.session, session.get('shard', 0))
+    user = None
+    user_id = session_user_cache.get(session_id, token)
+    if user_id is not None:
+        # Cache hit: primary-key load (identity map / PK index) instead of the session_id lookup
+        user = db.session.get(User, user_id)
+        if user is None or user.session_id != session_id:
+            # Deleted (or replaced by an import) since it was cached
+            session_user_cache.invalidate(session_id)
+            user = None
+
+    if user is None:
+        user = db.session.scalar(db.select(User).where(User.session_id == session_id))
+
+        if not user:
+            user = User(session_id=session_id, security_token=token)
+            db.session.add(user)
+            analytics.record_user_created(user)
+            db.session.commit()
+            current_app.logger.info(f"New user created: {user.session_id}")
+        elif user.security_token != token:
+            token = user.refresh_security_token()
+            session['security_token'] = token
             db.session.commit()
+        session_user_cache.put(session_id, user.id, token)
+
+    # ブラウザのタイムゾーン (イベントはユーザーの現地時間で判定する)
+    tz_name = tz_name or request.headers.get('X-Timezone')
+    if tz_name and tz_name != user.timezone and resolve_timezone(tz_name) is not None:
+        user.timezone = tz_name
+        db.session.commit()
     return user
 
+@task_pipeline.task('post_turn')
+def post_turn(user_id, analysis_result, chat_history):
+    """Deferrable part of a chat turn: score/affection update, evolution check and retention."""
+    select_shard(db.session, shard_for_user_id(user_id))
+    user = db.session.get(User, user_id)
+    if user is None:
+        return False, None
+
+    # Atomic increments: concurrent turns of this user (other workers) cannot lose an update
+    deltas = evolution.score_deltas(user, analysis_result, chat_history)
+    evolution.apply_score_deltas(db.session, user, deltas)
+    old_affection, old_persona, was_evolved = user.affection - deltas['affection'], user.personality_type, user.evolved
+    evolution_triggered, new_personality = evolution.check_evolution(user)
+    if evolution_triggered and not evolution.save_evolution(db.session, user, old_persona, was_evolved):
+        evolution_triggered, new_personality = False, None
+    analytics.record_turn(old_affection, old_persona, user, evolution_triggered, was_evolved)
+    db.session.commit()
+
+    keep_last = current_app.config['MAX_CHAT_MESSAGES_PER_USER']
+    if current_app.config.get('CHAT_ARCHIVE_ENABLED', True):
+        history.archive_old_messages(user.id, keep_last=keep_last,
+                                     block_size=current_app.config.get('CHAT_ARCHIVE_BLOCK_SIZE', 50))
+    else:
+        ChatMessage.cleanup_old_messages(user.id, keep_last=keep_last)
+    usage.flush_if_due()
+    return evolution_triggered, new_personality
+
+def demo_evolve(user: User) -> dict:
+    """#evolve_now demo command: force an evolution and return the chat payload"""
+    old_affection, old_persona, was_evolved = user.affection, user.personality_type, user.evolved
+    user.affection = 100
+    user.tsundere_score = 50
+    user.state_seq = User.state_seq + 1
+    evolution_triggered, new_personality = evolution.check_evolution(user)
+    analytics.record_state_change(old_affection, old_persona, user, evolution_triggered, was_evolved)
+    db.session.commit()
+    return {
+        "ai_response": "⚡ Demo evolution triggered!",
+        "evolution_triggered": evolution_triggered,
+        "new_personality": new_personality,
+        "current_status": user.state_dict()
+    }
+
+def generate_reply(user: User, user_message: str):
+    """
+    Reply to one user message and store both messages (commits).
+    Returns (ai_response, analysis_result, chat_history, memory_added); the middle two are for post_turn.
+
+    Raises:
+        TurnConflict: If another worker stored a turn of this user after its history was read.
+    """
+    turn_seq = user.turn_seq
+    cleaned_msg, memory_added = memory.handle_long_term_memory(db.session, user, user_message)
+    
+    user_msg = ChatMessage(user_id=user.id, role='user', content=cleaned_msg)
+    db.session.add(user_msg)
+
+    # 今日のトークン予算を使い切ったユーザーは短いコンテキスト + 軽量モデルで応答する
+    economy = usage.over_budget(user.id)
+    if economy:
+        context = memory.get_context(user, cleaned_msg,
+                                     history_limit=current_app.config.get('TOKEN_BUDGET_HISTORY', 4),
+                                     top_k=current_app.config.get('TOKEN_BUDGET_MEMORY_TOP_K', 5))
+    else:
+        context = memory.get_context(user, cleaned_msg)
+    local_now = local_time(user.timezone)
+    event_manager = EventManager()
+    current_themes = event_manager.get_current_themes(local_now)
+    
+    # 【修正】親愛度(affection)をプロンプトに渡す
+    system_prompt = prompts.get_event_enhanced_prompt(
+        user.personality_type, 
+        user.evolved, 
+        themes=current_themes,
+        affection=user.affection  # 追加
+    ).format(
+        long_term_memories=context['long_term_memories'],
+        time_context=context['time_context']
+    )
+
+    router = current_app.extensions['model_router']
+    reply_model = router.model_for(CALL_ECONOMY_REPLY if economy else CALL_REPLY)
+    fallback_model = reply_model if economy else router.model_for(CALL_FALLBACK_REPLY)
+    with usage_scope(user.id, user.personality_type):
+        if current_app.config.get('PERSONALITY_SCORING') == engine.SCORING_LOCAL:
+            # 返答はプレーンテキスト、性格スコアはローカルで算出
+            ai_response_content, analysis_result = engine.generate_response_with_local_scores(
+                reply_model, system_prompt, context['chat_history'], cleaned_msg,
+                fallback_model=fallback_model,
+                now=local_now
+            )
+        else:
+            ai_response_content, analysis_result = engine.generate_response_with_analysis(
+                reply_model, system_prompt, context['chat_history'], cleaned_msg,
+                fallback_model=fallback_model,
+                score_model=router.model_for(CALL_SCORE),
+                now=local_now
+            )
+    
+    if not ai_response_content.strip():
+        ai_response_content = "..."
+
+    ai_msg = ChatMessage(user_id=user.id, role='ai', content=ai_response_content)
+    db.session.add(ai_msg)
+
+    # The reply is durable before any deferred work runs
+    turn_sequencer.claim(db.session, user, turn_seq)
+    db.session.commit()
+    return ai_response_content, analysis_result, context['chat_history'], memory_added
+
+def run_turn(user: User, user_message: str):
+    """
+    generate_reply in the user's turn slot: turns of one user run in arrival order, each
+    seeing the previous turn's messages. A turn that lost the race to another worker is
+    regenerated on fresh state (TURN_CONFLICT_RETRIES times). The LLM-bound part then
+    passes admission control.
+
+    Raises:
+        TurnConflict: Still conflicting after the retries, or TurnBusy on timeout.
+        Overloaded: Shed by admission control (answer 503 with Retry-After).
+    """
+    retries = current_app.config.get('TURN_CONFLICT_RETRIES', 1)
+    priority = PRIORITY_CONVERSATION if user.turn_seq else PRIORITY_NEW_SESSION
+    with turn_sequencer.turn(user.id) as waited, admission_controller.admit(priority):
+        if waited:
+            db.session.refresh(user)  # the previous turn changed it
+        for attempt in range(retries + 1):
+            try:
+                return generate_reply(user, user_message)
+            except TurnConflict:
+                if attempt == retries:
+                    raise
+                turn_sequencer.count_retry()
+                rollback_chat_turn(user, None)
+
+def rollback_chat_turn(user, e: Optional[Exception]) -> None:
+    db.session.rollback()
+    if user is not None:
+        # The indexes may hold a memory row (or merged content) that was just rolled back
+        memory_index_cache.invalidate(user.id)
+        near_duplicate_cache.invalidate(user.id)
+    if e is not None:
+        current_app.logger.error(f"Chat error: {e}", exc_info=True)
+
 @api_bp.route('/chat', methods=['POST'])
 def chat():
+    """
+    Chat turn endpoint.
+
+    When the task pipeline is enabled, post_turn runs after the response is sent and
+    the response carries "status_pending": true. In that case these fields are
+    eventually consistent (they reflect the state BEFORE this turn; read
+    /api/status?memories=0 for the updated values):
+      - current_status.affection, current_status.scores, current_status.personality
+      - evolution_triggered / new_personality (always false/null)
+    current_status is User.state_dict(): no memory list, so the payload does not grow
+    with the user's memories. "memories_changed" tells the client to reload /api/memories.
+    """
     client_ip = request.remote_addr
     if not check_rate_limit(client_ip, current_app.config['MAX_REQUESTS_PER_MINUTE']):
         return jsonify({"error": "Rate limit exceeded"}), 429
@@ -57,99 +252,157 @@ def chat():
     if not user_message:
         return jsonify({"error": "Message cannot be empty"}), 400
     
+    user = None
     try:
         user = get_or_create_user()
 
         # Demo command
         if user_message == '#evolve_now' and current_app.config.get('DEMO_MODE'):
-            user.affection = 100
-            user.tsundere_score = 50
-            evolution_triggered, new_personality = evolution.check_evolution(user)
-            return jsonify({
-                "ai_response": "⚡ Demo evolution triggered!",
-                "evolution_triggered": evolution_triggered,
-                "new_personality": new_personality,
-                "current_status": user.to_dict()
-            })
-
-        cleaned_msg, _ = memory.handle_long_term_memory(db.session, user, user_message)
-        
-        user_msg = ChatMessage(user_id=user.id, role='user', content=cleaned_msg)
-        db.session.add(user_msg)
-
-        context = memory.get_context(user)
-        event_manager = EventManager()
-        current_themes = event_manager.get_current_themes()
-        
-        # 【修正】親愛度(affection)をプロンプトに渡す
-        system_prompt = prompts.get_event_enhanced_prompt(
-            user.personality_type, 
-            user.evolved, 
-            themes=current_themes,
-            affection=user.affection  # 追加
-        ).format(
-            long_term_memories=context['long_term_memories'],
-            time_context=context['time_context']
-        )
-
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        ai_response_content, analysis_result = engine.generate_response_with_analysis(
-            model, system_prompt, context['chat_history'], cleaned_msg
-        )
-        
-        if not ai_response_content.strip():
-            ai_response_content = "..."
-
-        ai_msg = ChatMessage(user_id=user.id, role='ai', content=ai_response_content)
-        db.session.add(ai_msg)
-
-        evolution.update_scores_and_affection(user, analysis_result, context['chat_history'])
-        evolution_triggered, new_personality = evolution.check_evolution(user)
-        
-        ChatMessage.cleanup_old_messages(user.id, keep_last=100)
-        db.session.commit()
+            return jsonify(demo_evolve(user))
+
+        ai_response_content, analysis_result, chat_history, memory_added = run_turn(user, user_message)
+
+        status_pending = task_pipeline.enabled
+        if status_pending:
+            try:
+                task_pipeline.enqueue('post_turn', user.id, user_id=user.id,
+                                      analysis_result=analysis_result, chat_history=chat_history)
+            except TaskQueueFull as e:
+                # Backpressure: do the work inline rather than dropping it
+                current_app.logger.warning(f"Running post-turn work inline: {e}")
+                status_pending = False
+
+        if status_pending:
+            evolution_triggered, new_personality = False, None
+        else:
+            evolution_triggered, new_personality = post_turn(user.id, analysis_result, chat_history)
 
         return jsonify({
             "ai_response": ai_response_content,
             "evolution_triggered": evolution_triggered,
             "new_personality": new_personality,
-            "current_status": user.to_dict()
+            "status_pending": status_pending,
+            "memories_changed": memory_added,
+            "current_status": user.state_dict()
         })
 
+    except TurnConflict as e:
+        rollback_chat_turn(user, None)
+        current_app.logger.warning(f"Chat turn rejected: {e}")
+        return jsonify({"error": "Another message from this session is still being processed"}), 409
+    except Overloaded as e:
+        # Fail fast while the model is slow instead of tying up the worker
+        rollback_chat_turn(user, None)
+        current_app.logger.warning(f"Chat turn shed: {e}")
+        response = jsonify({"error": "Server is busy, please retry", "retry_after": e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
     except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Chat error: {e}", exc_info=True)
+        rollback_chat_turn(user, e)
         return jsonify({"error": "Internal error"}), 500
 
 @api_bp.route('/status', methods=['GET'])
 def get_status():
     try:
         user = get_or_create_user()
+        # ?memories=0 skips the memory list (page it with /api/memories instead)
+        if request.args.get('memories') == '0':
+            return jsonify({"user_id": user.session_id, **user.state_dict()})
         return jsonify(user.to_dict())
     except Exception as e:
         current_app.logger.error(f"Status error: {e}", exc_info=True)
         return jsonify({"error": "Internal error"}), 500
 
+@api_bp.route('/history', methods=['GET'])
+def get_chat_history():
+    try:
+        # ?before=<message id> pages back through the hot table and then the archived blocks
+        user = get_or_create_user()
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        messages, next_before = history.get_history(user.id, before=request.args.get('before', type=int), limit=limit)
+        return jsonify({"messages": messages, "next_before": next_before})
+    except Exception as e:
+        current_app.logger.error(f"History error: {e}", exc_info=True)
+        return jsonify({"error": "Failed to get history"}), 500
+
+@api_bp.route('/memories', methods=['GET'])
+def get_memories():
+    try:
+        # ?before=<memory id> pages back from the newest memories
+        user = get_or_create_user()
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        memories, next_before = history.get_memories(user.id, before=request.args.get('before', type=int), limit=limit)
+        return jsonify({"memories": memories, "next_before": next_before})
+    except Exception as e:
+        current_app.logger.error(f"Memories error: {e}", exc_info=True)
+        return jsonify({"error": "Failed to get memories"}), 500
+
 @api_bp.route('/events/current', methods=['GET'])
 def get_current_events():
     try:
-        event_manager = EventManager()
-        return jsonify({
-            "active_events": event_manager.get_active_events(),
-            "current_themes": event_manager.get_current_themes(),
-            "affection_bonus": event_manager.get_affection_bonus(),
-            "event_icons": event_manager.get_event_icons(),
-            "welcome_message": event_manager.get_welcome_message(),
-            "server_time": datetime.datetime.now().isoformat()
-        })
+        # ?tz=<IANA name> resolves events in the user's timezone (one cached snapshot per timezone)
+        snapshot, expires_at = event_snapshot_cache.get(request.args.get('tz'))
+        max_age = max(0, int((expires_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()))
+
+        response = jsonify(snapshot)
+        # Cacheable by browsers, the service worker and CDNs until the next event transition
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.expires = expires_at.astimezone(datetime.timezone.utc)
+        return response
     except Exception as e:
         current_app.logger.error(f"Event error: {e}")
         return jsonify({"error": "Failed to get event data"}), 500
 
+@api_bp.route('/metrics/tasks', methods=['GET'])
+def get_task_metrics():
+    return jsonify(task_pipeline.metrics())
+
+@api_bp.route('/analytics/summary', methods=['GET'])
+def get_analytics_summary():
+    try:
+        days = min(max(request.args.get('days', 30, type=int), 1), 366)
+        return jsonify(analytics.get_summary(days))
+    except Exception as e:
+        current_app.logger.error(f"Analytics error: {e}", exc_info=True)
+        return jsonify({"error": "Failed to get analytics"}), 500
+
+@api_bp.route('/metrics/sessions', methods=['GET'])
+def get_session_metrics():
+    return jsonify(session_user_cache.metrics())
+
+@api_bp.route('/metrics/admission', methods=['GET'])
+def get_admission_metrics():
+    return jsonify(admission_controller.metrics())
+
+@api_bp.route('/metrics/tokens', methods=['GET'])
+def get_token_metrics():
+    try:
+        days = min(max(request.args.get('days', 1, type=int), 1), 90)
+        summary = usage.get_usage_summary(days)
+        summary["pending"] = token_usage_counters.metrics()
+        return jsonify(summary)
+    except Exception as e:
+        current_app.logger.error(f"Token usage error: {e}", exc_info=True)
+        return jsonify({"error": "Failed to get token usage"}), 500
+
+@api_bp.route('/metrics/turns', methods=['GET'])
+def get_turn_metrics():
+    return jsonify(turn_sequencer.metrics())
+
+@api_bp.route('/metrics/personas', methods=['GET'])
+def get_persona_metrics():
+    return jsonify(prompts.persona_packs.metrics())
+
+@api_bp.route('/metrics/models', methods=['GET'])
+def get_model_metrics():
+    return jsonify(current_app.extensions['model_router'].snapshot())
+
 @api_bp.route('/reset', methods=['POST'])
 def reset_user():
     try:
+        if 'session_id' in session:
+            session_user_cache.invalidate(session['session_id'])
         session.clear()
         new_user = get_or_create_user()
         db.session.commit()
@@ -162,13 +415,16 @@ def reset_user():
 def demo_quick_start():
     try:
         user = get_or_create_user()
+        old_affection, old_persona = user.affection, user.personality_type
         user.affection = 28
         user.tsundere_score = 25
         user.yandere_score = 10
+        user.state_seq = User.state_seq + 1
+        analytics.record_state_change(old_affection, old_persona, user)
         db.session.commit()
         return jsonify({
             "message": "Demo mode initialized!",
-            "current_status": user.to_dict()
+            "current_status": user.state_dict()
         })
     except Exception as e:
         return jsonify({"error": "Demo failed"}), 500
\ No newline at end of file
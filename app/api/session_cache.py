@@ -0,0 +1,76 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def token_hash(token: str) -> str:
+    """The cache keeps a digest, never the session's security token itself"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class SessionUserCache:
+    """
+    Per-worker LRU/TTL map of session_id -> (user id, security token hash).
+
+    A session always maps to the same user, so on a hit get_or_create_user only
+    needs a primary-key load instead of the session_id lookup. Entries are
+    dropped on /api/reset and replaced on token refresh; token changes made by
+    another worker are picked up after at most `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[int, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def get(self, session_id: str, token: str) -> Optional[int]:
+        """User id for the session, or None on a miss (unknown, expired or token mismatch)"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and now >= entry[2]:
+                del self._entries[session_id]
+                self._expirations += 1
+                entry = None
+            if entry is None or entry[1] != token_hash(token):
+                self._misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, session_id: str, user_id: int, token: str) -> None:
+        with self._lock:
+            self._entries[session_id] = (user_id, token_hash(token), self.clock() + self.ttl)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, session_id: Optional[str] = None) -> None:
+        with self._lock:
+            if session_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(session_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+session_user_cache = SessionUserCache()
@@ -0,0 +1,131 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Set
+
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models import User
+
+
+class TurnConflict(Exception):
+    """Another turn of the same user was stored first (users.turn_seq changed since it was read)."""
+
+
+class TurnBusy(TurnConflict):
+    """Waited longer than the sequencer timeout for the user's previous turn."""
+
+
+class _Lane:
+    __slots__ = ('condition', 'next_ticket', 'serving', 'abandoned')
+
+    def __init__(self, condition: threading.Condition):
+        self.condition = condition
+        self.next_ticket = 0
+        self.serving = 0
+        self.abandoned: Set[int] = set()
+
+
+class TurnSequencer:
+    """
+    Runs chat turns of the same user one at a time, in arrival order, while turns of
+    different users run fully in parallel (no global lock is held during a turn).
+
+    - In this worker: a FIFO ticket lane per user with turns in flight (dropped when
+      idle). A turn that waits longer than `timeout` seconds raises TurnBusy.
+    - Across workers: optimistic version check. claim() bumps users.turn_seq with a
+      conditional UPDATE in the transaction that stores the turn's messages (a row
+      lock where the database has them); if another worker stored a turn of the
+      user since its history was read, the turn raises TurnConflict instead.
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._lanes: Dict[Any, _Lane] = {}
+        self._metrics = {
+            "turns": 0,
+            "contended": 0,
+            "busy": 0,
+            "conflicts": 0,
+            "retries": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    @contextmanager
+    def turn(self, user_id: Any) -> Iterator[bool]:
+        """
+        Hold the user's turn for the body of the with-block.
+        Yields True when the turn had to wait for an earlier one (the caller's view of the user may be stale).
+
+        Raises:
+            TurnBusy: If the previous turn did not finish within `timeout` seconds.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            lane = self._lanes.get(user_id)
+            if lane is None:
+                lane = self._lanes[user_id] = _Lane(threading.Condition(self._lock))
+            ticket = lane.next_ticket
+            lane.next_ticket += 1
+            self._metrics["turns"] += 1
+            waited = lane.serving != ticket
+            if waited:
+                self._metrics["contended"] += 1
+                if not lane.condition.wait_for(lambda: lane.serving == ticket, self.timeout):
+                    lane.abandoned.add(ticket)
+                    self._metrics["busy"] += 1
+                    raise TurnBusy(f"Previous turn of user {user_id} still running after {self.timeout}s")
+                wait = time.perf_counter() - started
+                self._metrics["total_wait_seconds"] += wait
+                self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], wait)
+        try:
+            yield waited
+        finally:
+            with self._lock:
+                lane.serving += 1
+                while lane.serving in lane.abandoned:
+                    lane.abandoned.discard(lane.serving)
+                    lane.serving += 1
+                if lane.serving == lane.next_ticket:
+                    del self._lanes[user_id]
+                else:
+                    lane.condition.notify_all()
+
+    def claim(self, session, user: User, expected_seq: int) -> None:
+        """
+        Advance the user's turn sequence number from `expected_seq` (read with the turn's history).
+        Run in the transaction that stores the turn.
+
+        Raises:
+            TurnConflict: If another turn of the user was stored in the meantime.
+        """
+        claimed = session.execute(
+            update(User).where(User.id == user.id, User.turn_seq == expected_seq)
+            .values(turn_seq=User.turn_seq + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            with self._lock:
+                self._metrics["conflicts"] += 1
+            raise TurnConflict(f"Turn {expected_seq} of user {user.id} was already taken")
+        set_committed_value(user, 'turn_seq', expected_seq + 1)
+
+    def count_retry(self) -> None:
+        with self._lock:
+            self._metrics["retries"] += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["active_users"] = len(self._lanes)
+            metrics["waiting_turns"] = sum(lane.next_ticket - lane.serving - len(lane.abandoned) - 1
+                                           for lane in self._lanes.values())
+            contended = metrics["contended"] - metrics["busy"]
+            metrics["avg_wait_seconds"] = metrics["total_wait_seconds"] / contended if contended else 0.0
+            return metrics
+
+
+turn_sequencer = TurnSequencer()
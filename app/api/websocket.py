@@ -0,0 +1,106 @@
+import json
+
+from flask import current_app, request, session
+
+from . import api_bp
+from .routes import (check_rate_limit, demo_evolve, get_or_create_user, post_turn, rollback_chat_turn,
+                     run_turn)
+from .admission import Overloaded
+from .turns import TurnConflict
+from app.extensions import db, sock
+from app.models import User
+
+
+def _frame(frame_type: str, **payload) -> str:
+    return json.dumps({"type": frame_type, **payload})
+
+
+def _status_frame(user: User, evolution_triggered: bool = False, new_personality: str = None) -> str:
+    return _frame("status", evolution_triggered=evolution_triggered, new_personality=new_personality,
+                  current_status=user.state_dict())
+
+
+def chat_socket(ws):
+    """
+    Persistent chat channel for one browser session.
+
+    The session cookie is checked once at connect; the user then stays resident for
+    the connection's lifetime (primary-key reloads only). Frames are JSON:
+      client -> {"type": "chat", "message": "..."} | {"type": "status"}
+      server -> "ready" (current_status: User.state_dict()), "reply" (same fields as POST /api/chat),
+                "status" (after scoring/evolution of the turn), "error"
+    The reply is sent as soon as it is stored; post_turn then runs on this
+    connection and its result is pushed as a "status" frame, so no polling is needed.
+    """
+    if 'session_id' not in session or 'security_token' not in session:
+        # Cookies cannot be set on a WebSocket handshake; the client falls back to HTTP
+        ws.send(_frame("error", error="No session", status=401))
+        return
+
+    user = get_or_create_user(request.args.get('tz'))
+    user_id = user.id
+    ws.send(_frame("ready", current_status=user.state_dict()))
+    client_ip = request.remote_addr
+
+    while True:
+        # Do not hold a pooled connection (or an open SQLite read transaction) while idle
+        db.session.close()
+        try:
+            frame = json.loads(ws.receive())
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            ws.send(_frame("error", error="Invalid frame", status=400))
+            continue
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            ws.send(_frame("error", error="User not found", status=410))
+            return
+
+        if frame.get("type") == "status":
+            ws.send(_status_frame(user))
+            continue
+
+        user_message = str(frame.get("message", "")).strip()
+        if not user_message:
+            ws.send(_frame("error", error="Message cannot be empty", status=400))
+            continue
+        if not check_rate_limit(client_ip, current_app.config['MAX_REQUESTS_PER_MINUTE']):
+            ws.send(_frame("error", error="Rate limit exceeded", status=429))
+            continue
+
+        try:
+            if user_message == '#evolve_now' and current_app.config.get('DEMO_MODE'):
+                ws.send(_frame("reply", status_pending=False, **demo_evolve(user)))
+                continue
+            ai_response, analysis_result, chat_history, memory_added = run_turn(user, user_message)
+        except TurnConflict as e:
+            rollback_chat_turn(user, None)
+            current_app.logger.warning(f"Chat turn rejected: {e}")
+            ws.send(_frame("error", error="Another message from this session is still being processed", status=409))
+            continue
+        except Overloaded as e:
+            rollback_chat_turn(user, None)
+            current_app.logger.warning(f"Chat turn shed: {e}")
+            ws.send(_frame("error", error="Server is busy, please retry", status=503, retry_after=e.retry_after))
+            continue
+        except Exception as e:
+            rollback_chat_turn(user, e)
+            ws.send(_frame("error", error="Internal error", status=500))
+            continue
+
+        ws.send(_frame("reply", ai_response=ai_response, evolution_triggered=False, new_personality=None,
+                       status_pending=True, memories_changed=memory_added, current_status=user.state_dict()))
+
+        try:
+            evolution_triggered, new_personality = post_turn(user_id, analysis_result, chat_history)
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Post-turn error: {e}", exc_info=True)
+            continue
+        ws.send(_status_frame(db.session.get(User, user_id), evolution_triggered, new_personality))
+
+
+if sock is not None:
+    sock.route('/ws/chat', bp=api_bp)(chat_socket)
@@ -0,0 +1,230 @@
+import base64
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Table, insert, select, text
+
+from .extensions import db
+from .models import User, LongTermMemory, ChatMessage, ChatArchiveBlock
+from .sharding import select_shard
+
+# Parent tables first so foreign keys resolve on import
+TABLES: List[Table] = [User.__table__, LongTermMemory.__table__, ChatMessage.__table__, ChatArchiveBlock.__table__]
+
+DEFAULT_CHUNK_SIZE = 1000
+
+data_cli = AppGroup('data', help='Bulk export/import of user state as JSONL.')
+
+
+def _open_text(path: str) -> TextIO:
+    """Open a JSONL file for reading, transparently gunzipping .gz files"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def _read_checkpoint(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        # Archived history blocks (already compressed)
+        return base64.b64encode(value).decode('ascii')
+    return value
+
+
+def _encode_row(row) -> Dict[str, Any]:
+    return {key: _encode_value(value) for key, value in row._mapping.items()}
+
+
+def _decode_row(table: Table, row: Dict[str, Any]) -> Dict[str, Any]:
+    for column in table.columns:
+        value = row.get(column.name)
+        if isinstance(value, str) and isinstance(column.type, db.DateTime):
+            row[column.name] = datetime.fromisoformat(value)
+        elif isinstance(value, str) and isinstance(column.type, db.LargeBinary):
+            row[column.name] = base64.b64decode(value)
+    return row
+
+
+def iter_table_rows(table: Table, after_id: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Stream rows of `table` in primary key order using a server-side cursor.
+    Only one chunk of rows is held in memory at a time.
+    """
+    connection = db.session.connection().execution_options(stream_results=True, yield_per=chunk_size)
+    result = connection.execute(select(table).where(table.c.id > after_id).order_by(table.c.id))
+    for row in result:
+        yield _encode_row(row)
+
+
+def export_jsonl(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, resume: bool = False) -> Dict[str, Tuple[int, float]]:
+    """
+    Export all user state to a JSONL file, one {"table": ..., "row": ...} object per line.
+
+    Rows are written one chunk at a time (each chunk is a separate gzip member for
+    .gz files). After every chunk the file offset and last exported id per table are
+    checkpointed; with `resume` the file is truncated back to the checkpoint and the
+    export continues from there.
+
+    Returns:
+        {table_name: (row_count, seconds)}
+    """
+    checkpoint_path = path + '.checkpoint'
+    state = _read_checkpoint(checkpoint_path) if resume else {}
+    compress = path.endswith('.gz')
+    stats = {}
+
+    with open(path, 'r+b' if state else 'wb') as out:
+        out.truncate(state.get('offset', 0))
+        out.seek(0, os.SEEK_END)
+
+        def write_chunk(lines: List[str], table_name: str, last_id: Optional[int]) -> None:
+            data = "".join(lines).encode('utf-8')
+            out.write(gzip.compress(data, mtime=0) if compress else data)
+            out.flush()
+            state[table_name] = last_id
+            state['offset'] = out.tell()
+            _write_checkpoint(checkpoint_path, state)
+
+        for table in TABLES:
+            last_id = state.get(table.name, 0)
+            if last_id is None:
+                continue  # table finished in a previous run
+
+            started = time.perf_counter()
+            count = 0
+            lines: List[str] = []
+            for row in iter_table_rows(table, after_id=last_id, chunk_size=chunk_size):
+                lines.append(json.dumps({"table": table.name, "row": row}, ensure_ascii=False) + "\n")
+                count += 1
+                if len(lines) >= chunk_size:
+                    write_chunk(lines, table.name, row['id'])
+                    lines = []
+
+            write_chunk(lines, table.name, None)
+            stats[table.name] = (count, time.perf_counter() - started)
+
+    os.remove(checkpoint_path)
+    return stats
+
+
+def iter_jsonl_batches(path: str, chunk_size: int, skip_lines: int = 0) -> Iterator[Tuple[Table, List[Dict[str, Any]], int]]:
+    """
+    Stream (table, rows, line_number) batches from an export file.
+    A batch never spans two tables and holds at most `chunk_size` rows.
+    """
+    tables = {table.name: table for table in TABLES}
+    batch: List[Dict[str, Any]] = []
+    batch_table: Optional[Table] = None
+    line_number = 0
+
+    with _open_text(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if line_number <= skip_lines or not line.strip():
+                continue
+            record = json.loads(line)
+            table = tables[record['table']]
+            if batch and (table is not batch_table or len(batch) >= chunk_size):
+                yield batch_table, batch, line_number - 1
+                batch = []
+            batch_table = table
+            batch.append(_decode_row(table, record['row']))
+
+    if batch:
+        yield batch_table, batch, line_number
+
+
+def _reset_sequences() -> None:
+    """After inserting explicit ids, move PostgreSQL sequences past the imported rows"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+        ))
+    db.session.commit()
+
+
+def import_jsonl(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, resume: bool = False) -> Dict[str, Tuple[int, float]]:
+    """
+    Import an export file with batched multi-row INSERTs (one transaction per batch).
+    The number of committed lines is checkpointed so an interrupted import can resume.
+
+    Returns:
+        {table_name: (row_count, seconds)}
+    """
+    checkpoint_path = path + '.checkpoint'
+    skip_lines = _read_checkpoint(checkpoint_path).get('line', 0) if resume else 0
+    stats: Dict[str, Tuple[int, float]] = {}
+
+    # Elapsed time includes reading/decoding the batch, not just the INSERT
+    mark = time.perf_counter()
+    for table, rows, line_number in iter_jsonl_batches(path, chunk_size, skip_lines=skip_lines):
+        db.session.execute(insert(table), rows)
+        db.session.commit()
+        _write_checkpoint(checkpoint_path, {"line": line_number})
+
+        now = time.perf_counter()
+        count, seconds = stats.get(table.name, (0, 0.0))
+        stats[table.name] = (count + len(rows), seconds + now - mark)
+        mark = now
+
+    _reset_sequences()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return stats
+
+
+def _report(stats: Dict[str, Tuple[int, float]]) -> None:
+    total_rows = total_seconds = 0
+    for table_name, (count, seconds) in stats.items():
+        rate = count / seconds if seconds else 0
+        click.echo(f"{table_name}: {count} rows in {seconds:.2f}s ({rate:,.0f} rows/sec)")
+        total_rows += count
+        total_seconds += seconds
+    rate = total_rows / total_seconds if total_seconds else 0
+    click.echo(f"Total: {total_rows} rows in {total_seconds:.2f}s ({rate:,.0f} rows/sec)")
+
+
+@data_cli.command('export')
+@click.argument('path')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows fetched per cursor round trip.')
+@click.option('--resume', is_flag=True, help='Continue an interrupted export from its checkpoint.')
+@click.option('--shard', default=0, show_default=True, help='Shard to export (with DATABASE_SHARDS > 1, one file per shard).')
+def export_command(path, chunk_size, resume, shard):
+    """Export users, memories, messages and archived history to PATH (.jsonl or .jsonl.gz)."""
+    select_shard(db.session, shard)
+    _report(export_jsonl(path, chunk_size=chunk_size, resume=resume))
+
+
+@data_cli.command('import')
+@click.argument('path')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows per INSERT batch.')
+@click.option('--resume', is_flag=True, help='Skip lines committed by an interrupted import.')
+@click.option('--shard', default=0, show_default=True, help='Shard to import into (ids keep their shard range).')
+def import_command(path, chunk_size, resume, shard):
+    """Import an export file produced by 'flask data export'."""
+    select_shard(db.session, shard)
+    _report(import_jsonl(path, chunk_size=chunk_size, resume=resume))
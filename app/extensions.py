@@ -1,6 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from .tasks import TaskPipeline
+from .sharding import ShardedSession
+
+try:
+    from flask_sock import Sock
+except ImportError:  # optional: without flask-sock the frontend stays on the HTTP chat endpoint
+    Sock = None
 
 # Centralize extension instances in this file to avoid circular imports
-db = SQLAlchemy()
-migrate = Migrate()
\ No newline at end of file
+db = SQLAlchemy(session_options={'class_': ShardedSession})
+migrate = Migrate()
+task_pipeline = TaskPipeline()
+sock = Sock() if Sock is not None else None
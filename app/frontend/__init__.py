@@ -1,8 +1,8 @@
 from flask import Blueprint
 
 # Create blueprint for frontend
+# Static files are served by routes.serve_static (fingerprinted assets need custom caching headers)
 frontend_bp = Blueprint('frontend', __name__,
-                       template_folder='templates',
-                       static_folder='static')
+                       template_folder='templates')
 
 from . import routes
\ No newline at end of file
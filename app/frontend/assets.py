@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import Dict, Optional
+
+# Assets that are fingerprinted by the build step (paths relative to the static folder)
+BUILD_ASSETS = ['css/style.css', 'js/script.js']
+
+# Build output directory (relative to the static folder) and manifest name
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+HASH_LENGTH = 12
+GZIP_LEVEL = 9
+
+_CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.DOTALL)
+_CSS_SPACE_PATTERN = re.compile(r'\s+')
+_CSS_PUNCTUATION_PATTERN = re.compile(r'\s*([{};:,>])\s*')
+_JS_LINE_COMMENT_PATTERN = re.compile(r'^\s*//')
+
+
+def minify_css(source: str) -> str:
+    """Remove comments and redundant whitespace from a stylesheet"""
+    source = _CSS_COMMENT_PATTERN.sub('', source)
+    source = _CSS_SPACE_PATTERN.sub(' ', source)
+    source = _CSS_PUNCTUATION_PATTERN.sub(r'\1', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def minify_js(source: str) -> str:
+    """
+    Conservative JavaScript minification.
+    Drops indentation, blank lines and full-line comments but keeps line breaks,
+    so automatic semicolon insertion behaves exactly as in the source.
+    """
+    lines = []
+    for line in source.splitlines():
+        stripped = line.strip()
+        if not stripped or _JS_LINE_COMMENT_PATTERN.match(stripped):
+            continue
+        lines.append(stripped)
+    return '\n'.join(lines) + '\n'
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def fingerprint(content: bytes) -> str:
+    """Content hash used in asset file names"""
+    return hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+
+
+def build_assets(static_dir: str) -> Dict[str, str]:
+    """
+    Minify, fingerprint and gzip the frontend assets.
+
+    Args:
+        static_dir: Absolute path of the blueprint's static folder.
+
+    Returns:
+        Manifest mapping each logical asset path to its hashed path.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    manifest = {}
+
+    for asset in BUILD_ASSETS:
+        with open(os.path.join(static_dir, asset), 'r', encoding='utf-8') as f:
+            source = f.read()
+
+        root, ext = os.path.splitext(asset)
+        minifier = MINIFIERS.get(ext)
+        content = (minifier(source) if minifier else source).encode('utf-8')
+
+        hashed_path = f"{DIST_DIR}/{root}.{fingerprint(content)}{ext}"
+        output_path = os.path.join(static_dir, hashed_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        with open(output_path, 'wb') as f:
+            f.write(content)
+        # mtime=0 keeps the .gz output byte-identical across builds
+        with open(output_path + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0))
+
+        manifest[asset] = hashed_path
+
+    # Write the manifest atomically so running workers never read a partial file
+    manifest_path = os.path.join(dist_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    return manifest
+
+
+class AssetManifest:
+    """
+    Lazily loaded build manifest, reloaded when the manifest file changes.
+    Missing manifest (e.g. during development) means assets are served unhashed.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, str] = {}
+        self._mtime: Optional[float] = None
+
+    def lookup(self, static_dir: str, filename: str) -> str:
+        manifest_path = os.path.join(static_dir, DIST_DIR, MANIFEST_NAME)
+        try:
+            mtime = os.path.getmtime(manifest_path)
+        except OSError:
+            return filename
+
+        if mtime != self._mtime:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            self._mtime = mtime
+
+        return self._entries.get(filename, filename)
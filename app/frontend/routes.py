@@ -1,6 +1,24 @@
-from flask import render_template, send_from_directory, current_app
+from flask import render_template, send_from_directory, current_app, request, url_for
+import mimetypes
 import os
+import click
 from . import frontend_bp
+from .assets import AssetManifest, DIST_DIR, build_assets
+
+# Hashed assets never change, so they can be cached for a year
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+asset_manifest = AssetManifest()
+
+def _static_dir():
+    return os.path.join(current_app.root_path, 'frontend', 'static')
+
+@frontend_bp.app_context_processor
+def inject_asset_url():
+    def asset_url(filename):
+        """URL of the fingerprinted build of `filename` (falls back to the source file)"""
+        return url_for('frontend.serve_static', filename=asset_manifest.lookup(_static_dir(), filename))
+    return {'asset_url': asset_url}
 
 @frontend_bp.route('/')
 def index():
@@ -8,8 +26,21 @@ def index():
 
 @frontend_bp.route('/static/<path:filename>')
 def serve_static(filename):
-    static_dir = os.path.join(current_app.root_path, 'frontend', 'static')
-    return send_from_directory(static_dir, filename)
+    static_dir = _static_dir()
+    if not filename.startswith(DIST_DIR + '/'):
+        return send_from_directory(static_dir, filename)
+
+    # Fingerprinted build output: serve the precompressed variant when accepted
+    if 'gzip' in request.accept_encodings and os.path.isfile(os.path.join(static_dir, filename + '.gz')):
+        response = send_from_directory(static_dir, filename + '.gz', max_age=IMMUTABLE_MAX_AGE,
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(static_dir, filename, max_age=IMMUTABLE_MAX_AGE)
+
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
 
 @frontend_bp.route('/favicon.ico')
 def favicon():
@@ -21,4 +52,11 @@ def favicon():
 def service_worker():
     # static フォルダの中の 'js' フォルダを参照するように修正
     static_dir = os.path.join(current_app.root_path, 'frontend', 'static', 'js')
-    return send_from_directory(static_dir, 'sw.js', mimetype='application/javascript')
\ No newline at end of file
+    return send_from_directory(static_dir, 'sw.js', mimetype='application/javascript')
+
+@frontend_bp.cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and gzip frontend assets (flask frontend build-assets)."""
+    manifest = build_assets(_static_dir())
+    for source, hashed in sorted(manifest.items()):
+        click.echo(f"{source} -> {hashed}")
@@ -1,3 +1,9 @@
+// ブラウザのタイムゾーン（イベントをユーザーの現地時間で判定するためサーバーへ送る）
+const USER_TIMEZONE = Intl.DateTimeFormat().resolvedOptions().timeZone || '';
+
+// Long-term memories are paged from /api/memories (newest page first)
+const MEMORIES_PAGE_SIZE = 20;
+
 // Event System Class - Handles real-time events and themes
 class EventSystem {
     constructor(uiController) {
@@ -17,7 +23,7 @@ class EventSystem {
 
     async loadCurrentEvents() {
         try {
-            const response = await fetch('/api/events/current');
+            const response = await fetch(`/api/events/current?tz=${encodeURIComponent(USER_TIMEZONE)}`);
             if (response.ok) {
                 const eventData = await response.json();
                 this.currentEvents = eventData.active_events || [];
@@ -108,13 +114,99 @@ class EventSystem {
     }
 }
 
+// WebSocket chat channel - one connection per page instead of one HTTP request per message.
+// Falls back to POST /api/chat whenever the socket is not open (no server support, proxy, reconnecting).
+class ChatChannel {
+    constructor(onStatus) {
+        this.onStatus = onStatus;
+        this.socket = null;
+        this.ready = false;
+        this.pending = null;
+        this.retryDelay = 1000;
+        this.enabled = 'WebSocket' in window;
+    }
+
+    get isOpen() {
+        return this.socket !== null && this.socket.readyState === WebSocket.OPEN && this.ready;
+    }
+
+    connect() {
+        if (!this.enabled) return;
+        const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+        const socket = new WebSocket(`${scheme}://${location.host}/api/ws/chat?tz=${encodeURIComponent(USER_TIMEZONE)}`);
+        this.socket = socket;
+        this.ready = false;
+
+        socket.addEventListener('message', (event) => {
+            const frame = JSON.parse(event.data);
+            if (frame.type === 'ready') {
+                this.ready = true;
+                this.retryDelay = 1000;
+            } else if (frame.type === 'reply') {
+                this.settle(frame, null);
+            } else if (frame.type === 'status') {
+                this.onStatus(frame);
+            } else if (frame.type === 'error') {
+                this.settle(null, Object.assign(new Error(frame.error), { retryAfter: frame.retry_after }));
+                if (frame.status === 401 || frame.status === 410) {
+                    // Session not established / replaced: stay on HTTP until reconnect() is called
+                    this.close();
+                }
+            }
+        });
+
+        socket.addEventListener('close', () => {
+            const wasReady = this.ready;
+            this.ready = false;
+            this.settle(null, new Error('WebSocket closed'));
+            if (this.socket !== socket) return;
+            this.socket = null;
+            // Endpoint unavailable (e.g. server without flask-sock): keep using HTTP
+            if (!wasReady) return;
+            setTimeout(() => this.connect(), this.retryDelay);
+            this.retryDelay = Math.min(this.retryDelay * 2, 30000);
+        });
+    }
+
+    close() {
+        const socket = this.socket;
+        this.socket = null;
+        this.ready = false;
+        if (socket) socket.close();
+    }
+
+    reconnect() {
+        this.close();
+        this.connect();
+    }
+
+    settle(frame, error) {
+        const pending = this.pending;
+        this.pending = null;
+        if (!pending) return;
+        if (error) pending.reject(error);
+        else pending.resolve(frame);
+    }
+
+    send(message) {
+        return new Promise((resolve, reject) => {
+            this.pending = { resolve, reject };
+            this.socket.send(JSON.stringify({ type: 'chat', message: message }));
+        });
+    }
+}
+
 // Main UI Controller Class
 class EvolvingPersonaUI {
     constructor() {
         this.currentTheme = 'natural';
         this.currentStatus = null;
+        this.stateVersion = -1;
+        this.loadedMemories = [];
+        this.memoriesNextBefore = null;
         this.radarChart = null;
         this.isStatusOpen = false;
+        this.chatChannel = new ChatChannel((frame) => this.handleStatusFrame(frame));
         
         this.initializeApp();
         this.bindEvents();
@@ -235,10 +327,13 @@ class EvolvingPersonaUI {
 
     async loadInitialStatus() {
         try {
-            const response = await fetch('/api/status');
+            const response = await fetch('/api/status?memories=0', { headers: { 'X-Timezone': USER_TIMEZONE } });
             if (response.ok) {
                 const status = await response.json();
                 this.updateUI(status);
+                // The session cookie exists now, so the chat socket can be opened
+                this.chatChannel.connect();
+                this.loadMemories();
             }
         } catch (error) {
             console.error('Failed to load status:', error);
@@ -265,19 +360,9 @@ class EvolvingPersonaUI {
         this.showTypingIndicator();
 
         try {
-            const response = await fetch('/api/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ message: message })
-            });
-
-            if (!response.ok) {
-                throw new Error('API request failed');
-            }
-
-            const data = await response.json();
+            const data = this.chatChannel.isOpen
+                ? await this.chatChannel.send(message)
+                : await this.postMessage(message);
             
             // Hide typing indicator
             this.hideTypingIndicator();
@@ -287,22 +372,77 @@ class EvolvingPersonaUI {
             
             // Update UI
             this.updateUI(data.current_status);
+            if (data.memories_changed) {
+                this.loadMemories();
+            }
             
             // Handle evolution if triggered
             if (data.evolution_triggered && data.new_personality) {
                 await this.showEvolutionEffect(data.new_personality);
+            } else if (data.status_pending && data.type !== 'reply') {
+                // Scores/evolution are updated in the background after the response
+                // (socket replies are followed by a status frame instead)
+                this.refreshPendingStatus(data.current_status.personality);
             }
 
         } catch (error) {
             console.error('Message send error:', error);
             this.hideTypingIndicator();
-            this.addMessage('Sorry, an error occurred. Please try again.', 'ai');
+            if (error.retryAfter) {
+                // Shed by admission control (503): the server is busy, not broken
+                this.addMessage(`I'm a little overwhelmed right now... please try again in ${error.retryAfter}s.`, 'ai');
+            } else {
+                this.addMessage('Sorry, an error occurred. Please try again.', 'ai');
+            }
         } finally {
             this.setInputEnabled(true);
             input.focus();
         }
     }
 
+    async postMessage(message) {
+        const response = await fetch('/api/chat', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Timezone': USER_TIMEZONE,
+            },
+            body: JSON.stringify({ message: message })
+        });
+
+        if (response.status === 503) {
+            const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 5;
+            throw Object.assign(new Error('Server busy'), { retryAfter: retryAfter });
+        }
+        if (!response.ok) {
+            throw new Error('API request failed');
+        }
+        return response.json();
+    }
+
+    async handleStatusFrame(frame) {
+        this.updateUI(frame.current_status);
+        if (frame.evolution_triggered && frame.new_personality) {
+            await this.showEvolutionEffect(frame.new_personality);
+        }
+    }
+
+    async refreshPendingStatus(previousPersonality) {
+        await this.delay(1500);
+        try {
+            const response = await fetch('/api/status?memories=0', { headers: { 'X-Timezone': USER_TIMEZONE } });
+            if (response.ok) {
+                const status = await response.json();
+                this.updateUI(status);
+                if (status.personality !== previousPersonality) {
+                    await this.showEvolutionEffect(status.personality);
+                }
+            }
+        } catch (error) {
+            console.error('Failed to refresh status:', error);
+        }
+    }
+
     addMessage(content, role) {
         const messagesContainer = document.getElementById('chatMessages');
         const messageElement = document.createElement('div');
@@ -341,6 +481,11 @@ class EvolvingPersonaUI {
     }
 
     updateUI(status) {
+        // Socket frames and HTTP refreshes can arrive out of order: never go back to an older state
+        if (status.state_version !== undefined) {
+            if (status.state_version < this.stateVersion) return;
+            this.stateVersion = status.state_version;
+        }
         this.currentStatus = status;
         
         // Update theme
@@ -359,8 +504,31 @@ class EvolvingPersonaUI {
         // Update radar chart
         this.updateRadarChart(status.scores);
         
-        // Update long-term memories
-        this.updateMemoriesList(status.long_term_memories);
+        // Full status payloads (reset) carry the memory list; chat responses do not
+        if (status.long_term_memories) {
+            this.loadedMemories = status.long_term_memories;
+            this.memoriesNextBefore = null;
+            this.updateMemoriesList(this.loadedMemories);
+        }
+    }
+
+    async loadMemories(before = null) {
+        try {
+            const params = new URLSearchParams({ limit: MEMORIES_PAGE_SIZE });
+            if (before !== null) {
+                params.set('before', before);
+            }
+            const response = await fetch(`/api/memories?${params}`);
+            if (!response.ok) return;
+            const page = await response.json();
+            const contents = page.memories.map(memory => memory.content);
+            // Older pages go above the ones already shown
+            this.loadedMemories = before === null ? contents : contents.concat(this.loadedMemories);
+            this.memoriesNextBefore = page.next_before;
+            this.updateMemoriesList(this.loadedMemories);
+        } catch (error) {
+            console.error('Failed to load memories:', error);
+        }
     }
 
     applyTheme(personality) {
@@ -472,9 +640,16 @@ class EvolvingPersonaUI {
         const container = document.getElementById('longTermMemories');
         
         if (memories && memories.length > 0) {
-            container.innerHTML = memories.map(memory => 
+            const olderButton = this.memoriesNextBefore !== null
+                ? '<button class="load-older-memories">Show older memories</button>'
+                : '';
+            container.innerHTML = olderButton + memories.map(memory => 
                 `<div class="memory-item">${this.escapeHtml(memory)}</div>`
             ).join('');
+            const button = container.querySelector('.load-older-memories');
+            if (button) {
+                button.addEventListener('click', () => this.loadMemories(this.memoriesNextBefore));
+            }
         } else {
             container.innerHTML = '<div class="no-memories">No memories yet</div>';
         }
@@ -501,8 +676,12 @@ class EvolvingPersonaUI {
             if (response.ok) {
                 const newStatus = await response.json();
                 this.resetChat();
+                // A new user starts again at state version 0
+                this.stateVersion = -1;
                 this.updateUI(newStatus);
                 this.applyTheme('natural');
+                // The socket is bound to the previous session's user
+                this.chatChannel.reconnect();
             }
         } catch (error) {
             console.error('Reset error:', error);
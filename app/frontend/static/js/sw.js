@@ -14,9 +14,58 @@ self.addEventListener('install', event => {
   );
 });
 
+// イベント情報は次のイベント切り替え時刻（Expires）まで同じタイムゾーン（?tz=）の全ユーザー共通なので、期限内はキャッシュを返す
+const EVENTS_URL = '/api/events/current';
+
+function isFresh(response) {
+  const expires = response && response.headers.get('Expires');
+  return Boolean(expires) && Date.parse(expires) > Date.now();
+}
+
+function eventsFromCache(request) {
+  return caches.open(CACHE_NAME).then(cache =>
+    cache.match(request).then(cached => {
+      if (isFresh(cached)) {
+        return cached;
+      }
+      return fetch(request)
+        .then(response => {
+          if (response && response.status === 200) {
+            cache.put(request, response.clone());
+          }
+          return response;
+        })
+        .catch(() => cached);
+    })
+  );
+}
+
+// ビルド済みアセット（/static/dist/）はファイル名にハッシュを含み不変なので Cache First
+const DIST_PREFIX = '/static/dist/';
+
+function distFromCache(request) {
+  return caches.open(CACHE_NAME).then(cache =>
+    cache.match(request).then(cached => cached || fetch(request).then(response => {
+      if (response && response.status === 200) {
+        cache.put(request, response.clone());
+      }
+      return response;
+    }))
+  );
+}
+
 // 【修正】Network First 戦略に変更
 // まずネットワーク（サーバー）に最新を取りに行き、失敗したら（オフラインなど）キャッシュを使う
 self.addEventListener('fetch', event => {
+  if (new URL(event.request.url).pathname === EVENTS_URL) {
+    event.respondWith(eventsFromCache(event.request));
+    return;
+  }
+  if (new URL(event.request.url).pathname.startsWith(DIST_PREFIX)) {
+    event.respondWith(distFromCache(event.request));
+    return;
+  }
+
   event.respondWith(
     fetch(event.request)
       .then(response => {
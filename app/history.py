@@ -0,0 +1,167 @@
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from flask import current_app
+
+from .extensions import db
+from .models import ChatMessage, ChatArchiveBlock, LongTermMemory
+
+# Messages per cold block; retention waits for a full block so blocks compress well
+DEFAULT_BLOCK_SIZE = 50
+
+# Archiving runs in the background task, so spend the CPU on a smaller block
+COMPRESSION_LEVEL = 9
+
+# Keeps the IN (...) lists well below SQLite's bound parameter limit
+IN_CHUNK_SIZE = 500
+
+
+def encode_block(messages: List[Dict[str, Any]]) -> bytes:
+    """Messages (oldest first) as a zlib-compressed JSON array of [id, role, content, created_at]"""
+    rows = [[m['id'], m['role'], m['content'], m['created_at']] for m in messages]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                         COMPRESSION_LEVEL)
+
+
+def decode_block(data: bytes) -> List[Dict[str, Any]]:
+    return [{"id": message_id, "role": role, "content": content, "created_at": created_at}
+            for message_id, role, content, created_at in json.loads(zlib.decompress(data))]
+
+
+def _message_dict(message_id: int, role: str, content: str, created_at: datetime) -> Dict[str, Any]:
+    return {"id": message_id, "role": role, "content": content, "created_at": created_at.isoformat()}
+
+
+def archive_old_messages(user_id: int, keep_last: int = 100, block_size: int = DEFAULT_BLOCK_SIZE,
+                         partial: bool = False) -> int:
+    """
+    Move a user's messages beyond the latest `keep_last` from chat_messages into
+    compressed ChatArchiveBlock rows of `block_size` messages, in one transaction.
+
+    Only whole blocks are archived unless `partial`, so the hot table holds between
+    keep_last and keep_last + block_size - 1 messages per user. If another worker
+    archived the same messages first, nothing is written.
+
+    Returns:
+        Number of archived messages
+    """
+    try:
+        # Cheap check first: is there a full block beyond the hot window?
+        threshold = keep_last if partial else keep_last + block_size - 1
+        overflow = db.session.scalar(
+            db.select(ChatMessage.id).where(ChatMessage.user_id == user_id)
+            .order_by(ChatMessage.id.desc()).offset(threshold).limit(1)
+        )
+        if overflow is None:
+            return 0
+
+        rows = db.session.execute(
+            db.select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at)
+            .where(ChatMessage.user_id == user_id)
+            .order_by(ChatMessage.id.desc()).offset(keep_last)
+        ).all()
+        rows.reverse()
+        if not partial:
+            rows = rows[:len(rows) // block_size * block_size]
+
+        for i in range(0, len(rows), block_size):
+            block = [_message_dict(*row) for row in rows[i:i + block_size]]
+            db.session.add(ChatArchiveBlock(
+                user_id=user_id,
+                first_message_id=block[0]['id'],
+                last_message_id=block[-1]['id'],
+                message_count=len(block),
+                data=encode_block(block)
+            ))
+
+        ids = [row[0] for row in rows]
+        deleted = 0
+        for i in range(0, len(ids), IN_CHUNK_SIZE):
+            deleted += db.session.execute(
+                db.delete(ChatMessage).where(ChatMessage.id.in_(ids[i:i + IN_CHUNK_SIZE]))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        if deleted != len(ids):
+            # A concurrent run archived (some of) these rows already
+            db.session.rollback()
+            return 0
+
+        db.session.commit()
+        return len(ids)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to archive old messages for user {user_id}: {e}")
+        return 0
+
+
+def get_history(user_id: int, before: Optional[int] = None, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    One page of a user's history across the hot table and the cold blocks, oldest first.
+
+    `before` is a message id (keyset pagination): the page holds the `limit` messages
+    preceding it. Cold blocks are only read when the hot table runs out.
+
+    Returns:
+        (messages, `before` of the next older page or None at the beginning)
+    """
+    query = db.select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at)\
+        .where(ChatMessage.user_id == user_id)
+    if before is not None:
+        query = query.where(ChatMessage.id < before)
+    messages = [_message_dict(*row) for row in db.session.execute(query.order_by(ChatMessage.id.desc()).limit(limit))]
+
+    if len(messages) < limit:
+        cold_before = messages[-1]['id'] if messages else before
+        blocks = db.select(ChatArchiveBlock.data).where(ChatArchiveBlock.user_id == user_id)
+        if cold_before is not None:
+            blocks = blocks.where(ChatArchiveBlock.first_message_id < cold_before)
+        # Every block holds at least one message, so limit + 1 blocks always fill the page
+        for data in db.session.scalars(blocks.order_by(ChatArchiveBlock.last_message_id.desc()).limit(limit + 1)):
+            for message in reversed(decode_block(data)):
+                if cold_before is None or message['id'] < cold_before:
+                    messages.append(message)
+                    if len(messages) == limit:
+                        break
+            if len(messages) == limit:
+                break
+
+    messages.reverse()
+    next_before = messages[0]['id'] if messages and len(messages) == limit else None
+    return messages, next_before
+
+
+def get_memories(user_id: int, before: Optional[int] = None, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    One page of a user's long-term memories, oldest first, keyset-paginated like get_history
+    (`before` is a memory id; the first page holds the newest memories).
+
+    Returns:
+        (memories, `before` of the next older page or None at the beginning)
+    """
+    query = db.select(LongTermMemory.id, LongTermMemory.content, LongTermMemory.created_at)\
+        .where(LongTermMemory.user_id == user_id)
+    if before is not None:
+        query = query.where(LongTermMemory.id < before)
+    # One row more than the page tells whether an older page exists
+    rows = db.session.execute(query.order_by(LongTermMemory.id.desc()).limit(limit + 1)).all()
+    memories = [{"id": memory_id, "content": content, "created_at": created_at.isoformat()}
+                for memory_id, content, created_at in reversed(rows[:limit])]
+    next_before = memories[0]['id'] if len(rows) > limit else None
+    return memories, next_before
+
+
+def iter_archived_messages(user_id: int) -> Iterator[Dict[str, Any]]:
+    """All archived messages of a user, oldest first, one block in memory at a time (e.g. for summarization)"""
+    last_message_id = 0
+    while True:
+        block = db.session.execute(
+            db.select(ChatArchiveBlock.last_message_id, ChatArchiveBlock.data)
+            .where(ChatArchiveBlock.user_id == user_id, ChatArchiveBlock.last_message_id > last_message_id)
+            .order_by(ChatArchiveBlock.last_message_id).limit(1)
+        ).first()
+        if block is None:
+            return
+        last_message_id = block[0]
+        yield from decode_block(block[1])
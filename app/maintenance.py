@@ -0,0 +1,165 @@
+from collections import defaultdict
+from itertools import groupby
+from typing import Dict, List, Tuple
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from . import analytics
+from .extensions import db
+from .models import User, LongTermMemory
+from .sharding import iter_shards
+from bot import evolution, memory
+from bot.memory_dedup import DEFAULT_THRESHOLD, near_duplicate_cache
+from bot.memory_index import memory_index_cache
+
+# Keeps the IN (...) lists well below SQLite's bound parameter limit
+IN_CHUNK_SIZE = 500
+
+maintenance_cli = AppGroup('maintenance', help='Batch maintenance jobs over all users.')
+
+
+def compact_memories(batch_size: int = 200, threshold: float = DEFAULT_THRESHOLD,
+                     dry_run: bool = False) -> Dict[str, int]:
+    """
+    Merge near-duplicate long-term memories of every user, keeping the newest phrasing.
+
+    Users are processed shard by shard in id order, `batch_size` users per query and
+    transaction, so the job can run against a live database and be interrupted at any batch.
+
+    Returns:
+        {"users": scanned users, "memories": scanned memories, "removed": removed memories}
+    """
+    stats = {"users": 0, "memories": 0, "removed": 0}
+    for _ in iter_shards(db.session):
+        last_user_id = 0
+        while True:
+            user_ids = db.session.scalars(
+                db.select(User.id).where(User.id > last_user_id).order_by(User.id).limit(batch_size)
+            ).all()
+            if not user_ids:
+                break
+            last_user_id = user_ids[-1]
+            stats["users"] += len(user_ids)
+
+            rows = db.session.execute(
+                db.select(LongTermMemory.user_id, LongTermMemory.id, LongTermMemory.content)
+                .where(LongTermMemory.user_id.in_(user_ids))
+                .order_by(LongTermMemory.user_id, LongTermMemory.id)
+                .execution_options(yield_per=1000)
+            )
+            superseded: Dict[int, List[int]] = {}
+            for user_id, user_rows in groupby(rows, key=lambda row: row[0]):
+                user_rows = [(memory_id, content) for _, memory_id, content in user_rows]
+                stats["memories"] += len(user_rows)
+                memory_ids = memory.find_near_duplicates(user_rows, threshold)
+                if memory_ids:
+                    superseded[user_id] = memory_ids
+
+            removed = [memory_id for memory_ids in superseded.values() for memory_id in memory_ids]
+            stats["removed"] += len(removed)
+            if dry_run or not removed:
+                continue
+
+            for i in range(0, len(removed), IN_CHUNK_SIZE):
+                db.session.execute(
+                    db.delete(LongTermMemory).where(LongTermMemory.id.in_(removed[i:i + IN_CHUNK_SIZE]))
+                )
+            db.session.commit()
+            for user_id, memory_ids in superseded.items():
+                memory_index_cache.on_delete(user_id, memory_ids)
+                near_duplicate_cache.on_delete(user_id, memory_ids)
+
+    return stats
+
+
+def reevaluate_evolution(chunk_size: int = 10000, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Apply check_evolution's rule with the current config to every user at once.
+
+    Reads only the decision columns, `chunk_size` users at a time in id order (shard by
+    shard; evolution analytics go to the users' shard like live turns), decides
+    a whole chunk with decide_evolution_batch and writes the changes with one UPDATE
+    per (old persona, new persona, evolved) group. Each UPDATE only matches users still
+    in the state that was read, so a concurrent chat turn is never overwritten; the
+    evolution analytics events are recorded from the matched row counts.
+
+    Returns:
+        {"users": scanned users, "evolutions": initial evolutions, "re_evolutions": re-evolutions}
+    """
+    params = evolution.evolution_parameters(current_app.config)
+    stats = {"users": 0, "evolutions": 0, "re_evolutions": 0}
+    columns = (User.id, User.affection, User.tsundere_score, User.yandere_score, User.kuudere_score,
+               User.dandere_score, User.evolved, User.personality_type)
+    for _ in iter_shards(db.session):
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(*columns).where(User.id > last_id).order_by(User.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            stats["users"] += len(rows)
+
+            ids, affection, scores, evolved, personalities = [], [], [], [], []
+            for user_id, user_affection, t, y, k, d, user_evolved, personality in rows:
+                ids.append(user_id)
+                affection.append(user_affection)
+                scores.append((t, y, k, d))
+                evolved.append(user_evolved)
+                personalities.append(personality)
+            decisions = evolution.decide_evolution_batch(affection, scores, evolved, personalities, *params)
+
+            groups: Dict[Tuple[str, str, bool], List[int]] = defaultdict(list)
+            for user_id, new_personality, old_personality, was_evolved in zip(ids, decisions, personalities, evolved):
+                if new_personality is not None:
+                    groups[(old_personality, new_personality, was_evolved)].append(user_id)
+
+            for (old_personality, new_personality, was_evolved), user_ids in groups.items():
+                changed = len(user_ids)
+                if not dry_run:
+                    changed = 0
+                    for i in range(0, len(user_ids), IN_CHUNK_SIZE):
+                        changed += db.session.execute(
+                            db.update(User)
+                            .where(User.id.in_(user_ids[i:i + IN_CHUNK_SIZE]),
+                                   User.personality_type == old_personality, User.evolved == was_evolved)
+                            .values(personality_type=new_personality, evolved=True, state_seq=User.state_seq + 1)
+                            .execution_options(synchronize_session=False)
+                        ).rowcount
+                    analytics.increment_gauge(analytics.PERSONA_USERS, old_personality, -changed)
+                    analytics.increment_gauge(analytics.PERSONA_USERS, new_personality, changed)
+                    analytics.increment_daily(analytics.RE_EVOLUTIONS if was_evolved else analytics.EVOLUTIONS,
+                                              new_personality, changed)
+                stats["re_evolutions" if was_evolved else "evolutions"] += changed
+            db.session.commit()
+
+    return stats
+
+
+@maintenance_cli.command('compact-memories')
+@click.option('--batch-size', default=200, show_default=True, help='Users per query and transaction.')
+@click.option('--threshold', type=float, default=None,
+              help='Shingle Jaccard similarity for near-duplicates (default: MEMORY_DEDUP_THRESHOLD).')
+@click.option('--dry-run', is_flag=True, help='Only count the memories that would be merged.')
+def compact_memories_command(batch_size, threshold, dry_run):
+    """Merge near-duplicate long-term memories of all users."""
+    if threshold is None:
+        threshold = current_app.config.get('MEMORY_DEDUP_THRESHOLD', DEFAULT_THRESHOLD)
+    stats = compact_memories(batch_size=batch_size, threshold=threshold, dry_run=dry_run)
+    verb = "Would remove" if dry_run else "Removed"
+    click.echo(f"Scanned {stats['memories']} memories of {stats['users']} users. "
+               f"{verb} {stats['removed']} near-duplicates.")
+
+
+@maintenance_cli.command('reevaluate-evolution')
+@click.option('--chunk-size', default=10000, show_default=True, help='Users per read/decide/update round.')
+@click.option('--dry-run', is_flag=True, help='Only count the users that would evolve.')
+def reevaluate_evolution_command(chunk_size, dry_run):
+    """Re-run the evolution check for all users (e.g. after changing evolution thresholds)."""
+    stats = reevaluate_evolution(chunk_size=chunk_size, dry_run=dry_run)
+    verb = "Would evolve" if dry_run else "Evolved"
+    click.echo(f"Scanned {stats['users']} users. {verb} {stats['evolutions']} users, "
+               f"re-evolved {stats['re_evolutions']}.")
@@ -1,6 +1,9 @@
 import secrets
 from datetime import datetime, timezone
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 from .extensions import db
+from .sharding import reserve_id_range
 
 class User(db.Model):
     """
@@ -8,6 +11,8 @@ class User(db.Model):
     Identified by session ID, stores AI personality, affection, and personality scores.
     """
     __tablename__ = 'users'
+    # Ids are never reused, and each shard allocates from its own range (see app/sharding.py)
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(128), unique=True, nullable=False)
@@ -19,6 +24,9 @@ class User(db.Model):
     personality_type = db.Column(db.String(50), nullable=False, default='Natural')
     evolved = db.Column(db.Boolean, nullable=False, default=False)
 
+    # IANA timezone reported by the browser; events are resolved in this timezone
+    timezone = db.Column(db.String(64), nullable=True)
+
     # Affection level
     affection = db.Column(db.Integer, nullable=False, default=0)
 
@@ -28,16 +36,26 @@ class User(db.Model):
     kuudere_score = db.Column(db.Integer, nullable=False, default=0)
     dandere_score = db.Column(db.Integer, nullable=False, default=0)
 
+    # Number of stored chat turns; the optimistic version checked by the turn sequencer (app/api/turns.py)
+    turn_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Bumped by every write of affection, scores or personality (post-turn updates included);
+    # sent as state_version so clients can discard out-of-order status updates
+    state_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
     long_term_memories = db.relationship('LongTermMemory', backref='user', lazy=True, cascade="all, delete-orphan")
     chat_messages = db.relationship('ChatMessage', backref='user', lazy=True, cascade="all, delete-orphan")
+    chat_archive_blocks = db.relationship('ChatArchiveBlock', backref='user', lazy=True, cascade="all, delete-orphan")
 
-    def to_dict(self):
-        """Return user data as dictionary."""
+    def state_dict(self):
+        """
+        Per-turn state without the memory list (chat responses and socket frames).
+        state_version (state_seq) grows with every state change; memories are paged via /api/memories.
+        """
         return {
-            "user_id": self.session_id,
             "personality": self.personality_type,
             "affection": self.affection,
             "scores": {
@@ -46,6 +64,14 @@ class User(db.Model):
                 "kuudere": self.kuudere_score,
                 "dandere": self.dandere_score
             },
+            "state_version": self.state_seq or 0
+        }
+
+    def to_dict(self):
+        """Return user data as dictionary."""
+        return {
+            "user_id": self.session_id,
+            **self.state_dict(),
             "long_term_memories": [mem.content for mem in self.long_term_memories]
         }
     
@@ -54,11 +80,16 @@ class User(db.Model):
         self.security_token = secrets.token_hex(32)
         return self.security_token
 
+@event.listens_for(User, 'before_insert')
+def _reserve_shard_id_range(mapper, connection, target):
+    reserve_id_range(connection, User.__tablename__, object_session(target).info.get('shard', 0))
+
 class LongTermMemory(db.Model):
     """
     Model for storing long-term memories associated with users.
     """
     __tablename__ = 'long_term_memories'
+    __table_args__ = (db.Index('ix_long_term_memories_user_id_id', 'user_id', 'id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -70,6 +101,7 @@ class ChatMessage(db.Model):
     Model for storing conversation history.
     """
     __tablename__ = 'chat_messages'
+    __table_args__ = (db.Index('ix_chat_messages_user_id_id', 'user_id', 'id'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -104,4 +136,61 @@ class ChatMessage(db.Model):
             db.session.rollback()
             from flask import current_app
             current_app.logger.error(f"Failed to cleanup old messages for user {user_id}: {e}")
-            return False
\ No newline at end of file
+            return False
+
+class ChatArchiveBlock(db.Model):
+    """
+    Cold storage for chat history: a run of one user's older messages, moved out of
+    chat_messages as a zlib-compressed JSON array (see app/history.py).
+    Blocks are only read on demand (history pages, export), never on a chat turn.
+    """
+    __tablename__ = 'chat_archive_blocks'
+    __table_args__ = (db.Index('ix_chat_archive_blocks_user_last', 'user_id', 'last_message_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Message id range of the block (keyset pagination across hot and cold history)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+class AnalyticsDaily(db.Model):
+    """
+    Incremental daily rollup counters (e.g. messages per day, turns per persona, evolutions).
+    Maintained from turn events by app.analytics, never rebuilt from table scans.
+    """
+    __tablename__ = 'analytics_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    metric = db.Column(db.String(32), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class AnalyticsGauge(db.Model):
+    """
+    Incremental point-in-time counters (users per persona, users per affection bucket).
+    """
+    __tablename__ = 'analytics_gauges'
+
+    metric = db.Column(db.String(32), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class TokenUsageDaily(db.Model):
+    """
+    Daily model token usage per user, persona, stage (router call type) and model.
+    Flushed periodically from the per-worker counters in bot/usage.py (app/usage.py).
+    """
+    __tablename__ = 'token_usage_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)  # 0 = calls outside a chat turn
+    persona = db.Column(db.String(50), primary_key=True)
+    stage = db.Column(db.String(32), primary_key=True)
+    model = db.Column(db.String(64), primary_key=True)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    candidate_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cached_tokens = db.Column(db.Integer, nullable=False, default=0)
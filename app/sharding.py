@@ -0,0 +1,107 @@
+import re
+import zlib
+from typing import Any, Dict, Iterator, List
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+
+# User ids of shard n start at n << SHARD_ID_BITS, so a user id alone names its shard
+# and ids stay unique across shards (caches and the task pipeline are keyed by user id)
+SHARD_ID_BITS = 40
+
+
+def shard_bind_key(shard: int):
+    """Flask-SQLAlchemy bind key of a shard (shard 0 is the default database)"""
+    return f'shard{shard}' if shard else None
+
+
+def shard_for_session(session_id: str, shards: int) -> int:
+    """Shard of a new user, by a stable hash of its session id"""
+    return zlib.crc32(session_id.encode('utf-8')) % shards
+
+
+def shard_for_user_id(user_id: int) -> int:
+    return user_id >> SHARD_ID_BITS
+
+
+def shard_id_base(shard: int) -> int:
+    return shard << SHARD_ID_BITS
+
+
+def shard_urls(config: Dict[str, Any]) -> List[str]:
+    """
+    Database URL of every shard.
+    Shard 0 is SQLALCHEMY_DATABASE_URI; shard n uses DATABASE_SHARD_URL.format(n=n),
+    by default a "-shard{n}" file next to the main SQLite database.
+    """
+    base_url = config['SQLALCHEMY_DATABASE_URI']
+    template = config.get('DATABASE_SHARD_URL') or re.sub(r'(\.db)?$', r'-shard{n}\1', base_url, count=1)
+    return [base_url] + [template.format(n=n) for n in range(1, config.get('DATABASE_SHARDS', 1))]
+
+
+def configure_shards(app) -> None:
+    """Register shards 1..N-1 as binds (call before db.init_app)"""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for shard, url in enumerate(shard_urls(app.config)):
+        if shard:
+            binds[shard_bind_key(shard)] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+class ShardedSession(Session):
+    """
+    db.session that sends every statement to the shard selected with select_shard.
+
+    All tables (users, their messages and memories, and the analytics rollups of
+    those users) live in every shard; a request only ever touches its user's shard,
+    so turns of users on different shards never wait on the same SQLite write lock.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = self.info.get('shard', 0)
+        if bind is None and shard:
+            return self._db.engines[shard_bind_key(shard)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def select_shard(session, shard: int) -> None:
+    """
+    Point the session at a shard.
+    Switching shards ends the session's transaction, so pending changes must be committed first.
+    """
+    if session.info.get('shard', 0) == shard:
+        return
+    if session.new or session.dirty or session.deleted:
+        raise RuntimeError(f"Uncommitted changes while switching to shard {shard}")
+    session.close()
+    session.info['shard'] = shard
+
+
+def iter_shards(session) -> Iterator[int]:
+    """Cross-shard iteration for batch jobs: selects each shard in turn (commit before the next one)"""
+    for shard in range(current_app.config.get('DATABASE_SHARDS', 1)):
+        select_shard(session, shard)
+        yield shard
+    select_shard(session, 0)
+
+
+def create_all_shards(db) -> None:
+    """db.create_all() for every shard (development and tests; use `flask db upgrade` otherwise)"""
+    for shard in range(current_app.config.get('DATABASE_SHARDS', 1)):
+        db.metadata.create_all(bind=db.engines[shard_bind_key(shard)])
+
+
+def reserve_id_range(connection, table_name: str, shard: int) -> None:
+    """Start the AUTOINCREMENT ids of `table_name` in this shard's database at the shard's id base"""
+    if not shard or connection.dialect.name != 'sqlite':
+        return
+    params = {"name": table_name, "base": shard_id_base(shard)}
+    updated = connection.execute(
+        text("UPDATE sqlite_sequence SET seq = :base WHERE name = :name AND seq < :base"), params
+    ).rowcount
+    if not updated:
+        connection.execute(text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :base "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+        ), params)
@@ -0,0 +1,100 @@
+import json
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+
+simulate_cli = AppGroup('simulate', help='Offline replays of recorded conversations (no LLM calls).')
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')] if value else None
+
+
+def _float_list(value):
+    return [float(v) for v in value.split(',')] if value else None
+
+
+@simulate_cli.command('evolution')
+@click.argument('path')
+@click.option('--thresholds', help='Comma-separated affection thresholds (default: current config).')
+@click.option('--score-diffs', help='Comma-separated base score differences (default: current config).')
+@click.option('--hysteresis', help='Comma-separated re-evolution factors (default: current config).')
+@click.option('--local-scores', is_flag=True, help='Ignore recorded scores and score every message locally.')
+@click.option('--workers', type=int, default=None, help='Process pool size (default: CPU count).')
+@click.option('--json', 'as_json', is_flag=True, help='Print one JSON report per configuration.')
+def simulate_evolution_command(path, thresholds, score_diffs, hysteresis, local_scores, workers, as_json):
+    """
+    Replay conversations in PATH (a 'flask data export' file or transcript JSONL)
+    through the scoring and evolution rules for every parameter combination.
+    """
+    # bot.simulator imports app.models; import lazily to keep app <-> bot imports acyclic
+    from bot import evolution, simulator
+
+    threshold, base_score_diff, is_demo, hysteresis_factor = evolution.evolution_parameters(current_app.config)
+    configs = simulator.parameter_grid(_int_list(thresholds) or [threshold],
+                                       _int_list(score_diffs) or [base_score_diff],
+                                       _float_list(hysteresis) or [hysteresis_factor],
+                                       is_demo=is_demo)
+
+    started = time.perf_counter()
+    messages, memories, timezones = simulator.read_transcripts(path)
+    transcripts = simulator.compile_transcripts(messages, memories, use_recorded_scores=not local_scores,
+                                               workers=workers, timezones=timezones)
+    click.echo(f"Compiled {len(transcripts)} conversations in {time.perf_counter() - started:.2f}s", err=True)
+
+    for report in simulator.run_sweep(transcripts, configs, workers=workers):
+        if as_json:
+            click.echo(json.dumps(report))
+            continue
+        params, timing = report["params"], report["first_evolution_turn"]
+        click.echo(
+            f"threshold={params['threshold']} score_diff={params['base_score_diff']} "
+            f"hysteresis={params['hysteresis_factor']}: "
+            f"evolved {report['evolved_users']}/{report['users']} users, "
+            f"first evolution turn p10={timing['p10']} p50={timing['p50']} p90={timing['p90']} "
+            f"mean={timing['mean']}, re-evolutions={report['re_evolutions']}, "
+            f"personalities={report['personalities']}"
+        )
+    click.echo(f"Throughput: {report['turns_per_second']:,} simulated turns/sec", err=True)
+
+
+@simulate_cli.command('scoring-agreement')
+@click.argument('path')
+@click.option('--label', type=int, default=0,
+              help='First score up to N user messages without recorded scores with the LLM (score route).')
+@click.option('--json', 'as_json', is_flag=True, help='Print the report as JSON.')
+def scoring_agreement_command(path, label, as_json):
+    """
+    Compare the local personality scorer (PERSONALITY_SCORING=local) with the LLM scores
+    recorded in PATH (transcript JSONL "scores"), e.g. before switching scoring modes.
+    """
+    from bot import engine, simulator
+    from bot.memory import MEMORY_TAG_PATTERN
+    from bot.router import CALL_SCORE
+
+    messages = simulator.read_transcripts(path)[0]
+    if label:
+        model = current_app.extensions['model_router'].model_for(CALL_SCORE)
+        unlabeled = [message for user_messages in messages.values() for message in user_messages
+                     if message['role'] == 'user' and not message.get('scores')]
+        for message in unlabeled[:label]:
+            content = MEMORY_TAG_PATTERN.sub('', message['content']).strip()
+            message['scores'] = engine.analyze_personality_scores_fallback(model, content)
+        click.echo(f"Labeled {min(label, len(unlabeled))} messages with LLM scores", err=True)
+
+    report = simulator.scoring_agreement(messages)
+    if as_json:
+        click.echo(json.dumps(report))
+        return
+    if not report['samples']:
+        click.echo("No user messages with recorded scores.")
+        return
+    click.echo(f"{report['samples']} scored messages, dominant trait agreement "
+               f"{report['dominant_trait_agreement']} ({report['dominant_trait_samples']} messages), "
+               f"{report['local_scores_per_second'] or 0:,} local scores/sec")
+    for persona, trait in report['traits'].items():
+        click.echo(f"  {persona:9s} mae={trait['mae']} within_1={trait['within_1']} pearson={trait['pearson']} "
+                   f"mean llm={trait['llm_mean']} local={trait['local_mean']}")
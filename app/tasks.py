@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TaskQueueFull(Exception):
+    """Raised when the pipeline refuses new work (backpressure)."""
+
+
+class TaskPipeline:
+    """
+    In-process background task pipeline for work that can run after the response is sent.
+
+    - Bounded thread pool (TASK_WORKERS) with a bounded backlog (TASK_QUEUE_MAX_SIZE);
+      enqueue raises TaskQueueFull when the backlog is full so the caller can run inline.
+    - Durable: every task is written to a SQLite queue (TASK_QUEUE_PATH) before it is
+      scheduled and deleted once it has run. Tasks left behind by a crashed worker are
+      re-run once their lease (TASK_LEASE_SECONDS) expires. A live worker renews the
+      leases of the tasks it holds (queued or running) every third of the lease, so a
+      long backlog or a slow handler is never picked up a second time.
+    - Per-user ordering: tasks for the same user run one at a time, in enqueue order,
+      while different users run in parallel. Ordering is per process; requests for one
+      user that land on different workers are not ordered against each other.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._handlers: Dict[str, Callable[..., Any]] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lanes: Dict[Any, deque] = {}
+        self._live: Set[int] = set()  # task ids scheduled in this process and not finished
+        self._heartbeat: Optional[threading.Thread] = None
+        self._pending = 0
+        self._owner = uuid.uuid4().hex
+        self._last_recovery = 0.0
+        self._metrics = {
+            "enqueued": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "recovered": 0,
+            "total_latency_seconds": 0.0,
+            "max_latency_seconds": 0.0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('TASK_PIPELINE_ENABLED', True)
+        self.max_queue_size = app.config.get('TASK_QUEUE_MAX_SIZE', 1000)
+        self.lease_seconds = app.config.get('TASK_LEASE_SECONDS', 300)
+        app.extensions['task_pipeline'] = self
+        if not self.enabled:
+            return
+
+        queue_path = app.config.get('TASK_QUEUE_PATH', os.path.join(app.instance_path, 'task_queue.db'))
+        self._conn = sqlite3.connect(queue_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                user_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                lease_until REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._executor = ThreadPoolExecutor(max_workers=app.config.get('TASK_WORKERS', 4),
+                                            thread_name_prefix='task-pipeline')
+        self.recover()
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew_leases, name='task-pipeline-lease', daemon=True)
+            self._heartbeat.start()
+
+    def task(self, name: str):
+        """Register a task handler. Handlers run inside an application context."""
+        def decorator(func):
+            self._handlers[name] = func
+            return func
+        return decorator
+
+    def enqueue(self, name: str, user_key: Any, **payload) -> None:
+        """
+        Persist and schedule a task. Payload must be JSON serializable.
+
+        Raises:
+            TaskQueueFull: If the backlog is at TASK_QUEUE_MAX_SIZE.
+        """
+        if name not in self._handlers:
+            raise KeyError(f"Unknown task: {name}")
+
+        now = time.time()
+        with self._lock:
+            if self._pending >= self.max_queue_size:
+                self._metrics["rejected"] += 1
+                raise TaskQueueFull(f"Task backlog is full ({self._pending} pending)")
+            cursor = self._conn.execute(
+                "INSERT INTO tasks (name, user_key, payload, owner, lease_until, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, str(user_key), json.dumps(payload), self._owner, now + self.lease_seconds, now)
+            )
+            self._pending += 1
+            self._metrics["enqueued"] += 1
+            self._schedule_locked(cursor.lastrowid, name, str(user_key), payload, now)
+
+        if now - self._last_recovery > self.lease_seconds:
+            self.recover()
+
+    def recover(self) -> int:
+        """Claim and re-schedule tasks whose lease has expired (left behind by a crashed worker)."""
+        now = time.time()
+        self._last_recovery = now
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = [row for row in self._conn.execute(
+                    "SELECT id, name, user_key, payload, created_at FROM tasks WHERE lease_until < ? ORDER BY id",
+                    (now,)
+                ).fetchall() if row[0] not in self._live]
+                self._conn.executemany(
+                    "UPDATE tasks SET owner = ?, lease_until = ? WHERE id = ?",
+                    [(self._owner, now + self.lease_seconds, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            for task_id, name, user_key, payload, created_at in rows:
+                if name not in self._handlers:
+                    logger.error(f"Dropping recovered task {task_id}: no handler for '{name}'")
+                    self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+                    continue
+                self._pending += 1
+                self._metrics["recovered"] += 1
+                self._schedule_locked(task_id, name, user_key, json.loads(payload), created_at)
+
+        if rows:
+            logger.warning(f"Recovered {len(rows)} background task(s) from the durable queue")
+        return len(rows)
+
+    def _renew_leases(self) -> None:
+        """Heartbeat thread: extend the leases of every task this worker holds"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._lock:
+                if not self._live:
+                    continue
+                try:
+                    self._conn.execute(
+                        "UPDATE tasks SET lease_until = ? WHERE owner = ?",
+                        (time.time() + self.lease_seconds, self._owner)
+                    )
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to renew background task leases: {e}")
+
+    def _schedule_locked(self, task_id, name, user_key, payload, created_at):
+        self._live.add(task_id)
+        lane = self._lanes.get(user_key)
+        if lane is None:
+            # No task running for this user: start immediately
+            self._lanes[user_key] = deque()
+            self._executor.submit(self._run, task_id, name, user_key, payload, created_at)
+        else:
+            lane.append((task_id, name, user_key, payload, created_at))
+
+    def _run(self, task_id, name, user_key, payload, created_at):
+        with self._lock:
+            self._conn.execute("UPDATE tasks SET lease_until = ? WHERE id = ?",
+                               (time.time() + self.lease_seconds, task_id))
+        try:
+            with self.app.app_context():
+                self._handlers[name](**payload)
+            succeeded = True
+        except Exception as e:
+            succeeded = False
+            logger.error(f"Background task {name} ({task_id}) for {user_key} failed: {e}", exc_info=True)
+
+        latency = time.time() - created_at
+        with self._lock:
+            # Failed tasks are not retried: handlers are not idempotent (score increments)
+            self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            self._live.discard(task_id)
+            self._pending -= 1
+            self._metrics["completed" if succeeded else "failed"] += 1
+            self._metrics["total_latency_seconds"] += latency
+            self._metrics["max_latency_seconds"] = max(self._metrics["max_latency_seconds"], latency)
+
+            lane = self._lanes[user_key]
+            if lane:
+                self._executor.submit(self._run, *lane.popleft())
+            else:
+                del self._lanes[user_key]
+
+    def drain(self, timeout: float = 10.0) -> bool:
+        """Wait until every scheduled task has run. Returns False on timeout."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if self._pending == 0:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of pipeline counters"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["enabled"] = self.enabled
+            metrics["pending"] = self._pending
+            metrics["active_users"] = len(self._lanes)
+            metrics["max_queue_size"] = self.max_queue_size
+        finished = metrics["completed"] + metrics["failed"]
+        metrics["avg_latency_seconds"] = metrics["total_latency_seconds"] / finished if finished else 0.0
+        return metrics
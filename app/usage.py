@@ -0,0 +1,167 @@
+import atexit
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from bot.usage import UsageKey, token_usage_counters
+from .extensions import db
+from .models import TokenUsageDaily
+from .sharding import iter_shards, shard_bind_key, shard_for_user_id
+
+# Summed by the upsert; the key columns are the primary key
+COUNT_COLUMNS = ('calls', 'prompt_tokens', 'candidate_tokens', 'cached_tokens')
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def _upsert_counts(connection, rows: List[Dict[str, Any]]) -> None:
+    """INSERT ... ON CONFLICT DO UPDATE count = count + excluded.count for every counter column"""
+    insert = postgresql.insert if connection.dialect.name == 'postgresql' else sqlite.insert
+    table = TokenUsageDaily.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={column: table.c[column] + stmt.excluded[column] for column in COUNT_COLUMNS}
+    )
+    connection.execute(stmt, rows)
+
+
+def flush_token_usage() -> int:
+    """
+    Write this worker's pending token counters to token_usage_daily, one upsert per
+    (day, user, persona, stage, model), each user's rows in the user's shard.
+    Uses its own connections, so it never touches db.session's transaction or shard.
+    On failure the counters are put back for the next flush.
+
+    Returns:
+        Number of upserted rows
+    """
+    counts = token_usage_counters.drain()
+    if not counts:
+        return 0
+
+    by_shard: Dict[int, List[Dict[str, Any]]] = {}
+    for (day, user_id, persona, stage, model), values in counts.items():
+        row = {"day": day, "user_id": user_id, "persona": persona, "stage": stage, "model": model}
+        row.update(zip(COUNT_COLUMNS, values))
+        by_shard.setdefault(shard_for_user_id(user_id), []).append(row)
+
+    pending: Dict[UsageKey, List[int]] = dict(counts)
+    try:
+        for shard, rows in by_shard.items():
+            with db.engines[shard_bind_key(shard)].begin() as connection:
+                _upsert_counts(connection, rows)
+            for row in rows:
+                del pending[(row["day"], row["user_id"], row["persona"], row["stage"], row["model"])]
+    except Exception as e:
+        token_usage_counters.restore(pending)
+        current_app.logger.error(f"Failed to flush token usage: {e}")
+        return 0
+    return len(counts)
+
+
+def flush_if_due() -> int:
+    """Flush when the counters are older than TOKEN_USAGE_FLUSH_SECONDS (called after every turn)"""
+    if token_usage_counters.flush_due():
+        return flush_token_usage()
+    return 0
+
+
+class UsageFlusher:
+    """
+    Flushes this worker's token counters from a daemon thread every TOKEN_USAGE_FLUSH_SECONDS,
+    and once more at interpreter exit, so usage of a worker that goes idle (or is restarted)
+    still reaches token_usage_daily and the other workers' budget checks.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self, app) -> None:
+        self.app = app
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='token-usage-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self) -> None:
+        while not self._stop.wait(max(token_usage_counters.flush_interval, 0.01)):
+            self.flush(if_due=True)
+
+    def flush(self, if_due: bool = False) -> int:
+        with self.app.app_context():
+            return flush_if_due() if if_due else flush_token_usage()
+
+    def stop(self) -> None:
+        """Stop the thread and flush what is left"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        atexit.unregister(self.stop)
+        self.flush()
+
+
+usage_flusher = UsageFlusher()
+
+
+def tokens_today(user_id: int) -> int:
+    """Prompt + candidate tokens a user has spent today (flushed rows + this worker's pending counters)"""
+    today = _today()
+    flushed = db.session.scalar(
+        db.select(func.coalesce(func.sum(TokenUsageDaily.prompt_tokens + TokenUsageDaily.candidate_tokens), 0))
+        .where(TokenUsageDaily.day == today, TokenUsageDaily.user_id == user_id)
+    )
+    return flushed + token_usage_counters.pending_tokens(user_id, today)
+
+
+def over_budget(user_id: int) -> bool:
+    """Whether the user has used up TOKEN_BUDGET_DAILY (0 = no budget)"""
+    budget = current_app.config.get('TOKEN_BUDGET_DAILY', 0)
+    return bool(budget) and tokens_today(user_id) >= budget
+
+
+def get_usage_summary(days: int = 1, top_users: int = 10) -> Dict[str, Any]:
+    """Flushed token usage of the last `days` days across shards, by stage, persona, model and top users"""
+    since = _today() - timedelta(days=days - 1)
+    totals = dict.fromkeys(COUNT_COLUMNS, 0)
+    breakdown: Dict[str, Dict[str, Dict[str, int]]] = {"stage": {}, "persona": {}, "model": {}}
+    users: Dict[int, int] = {}
+
+    columns = [getattr(TokenUsageDaily, column) for column in COUNT_COLUMNS]
+    for _ in iter_shards(db.session):
+        rows = db.session.execute(
+            db.select(TokenUsageDaily.user_id, TokenUsageDaily.persona, TokenUsageDaily.stage,
+                      TokenUsageDaily.model, *columns)
+            .where(TokenUsageDaily.day >= since)
+        )
+        for user_id, persona, stage, model, *values in rows:
+            for column, value in zip(COUNT_COLUMNS, values):
+                totals[column] += value
+            for dimension, key in (("stage", stage), ("persona", persona or 'none'), ("model", model)):
+                bucket = breakdown[dimension].setdefault(key, dict.fromkeys(COUNT_COLUMNS, 0))
+                for column, value in zip(COUNT_COLUMNS, values):
+                    bucket[column] += value
+            if user_id:
+                users[user_id] = users.get(user_id, 0) + values[1] + values[2]
+
+    top = sorted(users.items(), key=lambda item: item[1], reverse=True)[:top_users]
+    return {
+        "since": since.isoformat(),
+        "totals": totals,
+        "by_stage": breakdown["stage"],
+        "by_persona": breakdown["persona"],
+        "by_model": breakdown["model"],
+        "top_users": [{"user_id": user_id, "tokens": tokens} for user_id, tokens in top],
+    }
@@ -0,0 +1,71 @@
+"""
+Benchmark: bytes-on-wire and CPU cost of gzip for /api/chat and /api/status payloads.
+
+Builds `current_status` payloads (same shape as User.to_dict()) for users with
+growing long-term memory lists and reports, per compression level, the
+compressed size and CPU time spent compressing one response.
+
+Usage:
+    python benchmarks/bench_api_compression.py [--memories 0,100,1000,5000] [--levels 1,6,9]
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+WORDS = ("I love reading books about space and I always drink coffee before work "
+         "my cat is called Mochi and my sister lives in Osaka we went hiking together "
+         "last summer I get nervous before presentations please remember my birthday").split()
+
+
+def make_payload(memory_count: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    memories = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))) for _ in range(memory_count)]
+    payload = {
+        "ai_response": "Hmph, it's not like I remembered that for you or anything...",
+        "evolution_triggered": False,
+        "new_personality": None,
+        "current_status": {
+            "user_id": "f" * 32,
+            "personality": "Tsundere",
+            "affection": 142,
+            "scores": {"tsundere": 310, "yandere": 120, "kuudere": 95, "dandere": 88},
+            "long_term_memories": memories,
+        },
+    }
+    return json.dumps(payload).encode('utf-8')
+
+
+def cpu_time_per_call(func, min_seconds: float = 0.2) -> float:
+    iterations = 0
+    start = time.process_time()
+    while True:
+        func()
+        iterations += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_seconds:
+            return elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memories', default='0,10,100,1000,5000')
+    parser.add_argument('--levels', default='1,6,9')
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.levels.split(',')]
+    print(f"{'memories':>8} {'raw bytes':>10} " + " ".join(f"{'L' + str(l) + ' bytes':>10} {'ratio':>6} {'cpu us':>8}" for l in levels))
+
+    for count in (int(x) for x in args.memories.split(',')):
+        body = make_payload(count)
+        columns = []
+        for level in levels:
+            compressed = gzip.compress(body, compresslevel=level, mtime=0)
+            cost = cpu_time_per_call(lambda: gzip.compress(body, compresslevel=level, mtime=0))
+            columns.append(f"{len(compressed):>10} {len(body) / len(compressed):>6.1f} {cost * 1e6:>8.1f}")
+        print(f"{count:>8} {len(body):>10} " + " ".join(columns))
+
+
+if __name__ == '__main__':
+    main()
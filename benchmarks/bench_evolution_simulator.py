@@ -0,0 +1,62 @@
+"""
+Benchmark: offline evolution simulator throughput.
+
+Generates synthetic transcripts (random user messages scored locally), compiles
+them once and replays a parameter sweep on the process pool, reporting compile
+rate and simulated turns per second.
+
+Usage:
+    python benchmarks/bench_evolution_simulator.py [--users 20000] [--turns 100] [--configs 9] [--workers N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark')  # config.py requires a key at import time
+
+from bot.simulator import TranscriptCompiler, parameter_grid, run_sweep  # noqa: E402
+
+MESSAGES = ["I feel so lonely today", "haha that was fun!", "shut up, you're annoying!!",
+            "can you explain the theory?", "I love you, stay together forever", "sorry... I'm nervous",
+            "ok", "what do you think about books and study?", "I'm scared, help", "good morning"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--turns', type=int, default=100)
+    parser.add_argument('--configs', type=int, default=9, help='Sweep size (thresholds x score diffs)')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    compiler = TranscriptCompiler()
+    # Compile a pool of distinct conversations and reuse them to reach the user count quickly
+    started = time.perf_counter()
+    pool = []
+    for _ in range(min(args.users, 200)):
+        messages = []
+        for _ in range(args.turns):
+            messages.append({"role": "user", "content": rng.choice(MESSAGES)})
+            messages.append({"role": "ai", "content": "..."})
+        pool.append(compiler.compile_user(messages))
+    compile_seconds = time.perf_counter() - started
+    transcripts = [pool[i % len(pool)] for i in range(args.users)]
+
+    side = max(1, round(args.configs ** 0.5))
+    configs = parameter_grid(range(20, 20 + 10 * side, 10), range(3, 3 + 2 * side, 2), [2.0])
+    started = time.perf_counter()
+    reports = list(run_sweep(transcripts, configs, workers=args.workers))
+    seconds = time.perf_counter() - started
+
+    simulated = sum(report["turns"] for report in reports)
+    print(f"compile: {len(pool) * args.turns / compile_seconds:,.0f} turns/sec")
+    print(f"sweep: {len(configs)} configs x {args.users} users x {args.turns} turns = {simulated:,} turns "
+          f"in {seconds:.2f}s ({simulated / seconds * 60:,.0f} turns/min)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Microbenchmarks for the bot/ hot paths with stored baselines and a regression gate.
+
+Cases use generated but realistic inputs: short and long messages, 0-5k memories,
+every persona (plain and evolved) across all affection tiers, event lookups
+through a year of timestamps, fenced and plain model JSON, and evolution checks
+in every state. Each case reports the best per-call time over several repeats.
+
+Each case is normalized by a pure-Python calibration loop timed right before it,
+so a baseline taken on one machine stays usable on a faster or slower (or busy) one.
+
+Usage:
+    python benchmarks/bench_hot_paths.py run [--filter memories] [--save]      # print (and store as baseline)
+    python benchmarks/bench_hot_paths.py compare [--tolerance 1.0]              # exit 1 on regressions
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark')  # config.py requires a key at import time
+
+from flask import Flask  # noqa: E402
+
+from app.models import User  # noqa: E402
+from bot import evolution, prompts  # noqa: E402
+from bot.engine import parse_combined_response  # noqa: E402
+from bot.events import EventManager  # noqa: E402
+from bot.memory_analyzer import MemoryAnalyzer  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'hot_paths.json')
+
+# Minimum wall time of one timing round, and rounds per case (the best round is kept)
+MIN_ROUND_SECONDS = 0.05
+REPEATS = 7
+
+PERSONAS = ('Natural',) + evolution.PERSONALITIES
+AFFECTION_TIERS = (0, 15, 45, 80, 150, 250)
+WORDS = ("i feel so lonely today haha that was fun shut up you're annoying can you explain the theory "
+         "love you stay together forever sorry i'm nervous ok what do you think about books and study "
+         "scared help good morning cat coffee osaka exam work boss piano movie ramen rain summer").split()
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text + rng.choice(("", "!", "!!", "...", "?"))
+
+
+def calibration() -> None:
+    """Fixed pure-Python workload used to normalize timings across machines"""
+    total = 0
+    for i in range(20000):
+        total += i * i % 7
+    "-".join(str(i) for i in range(2000)).split("-")
+
+
+def build_cases() -> List[Tuple[str, Callable[[], None]]]:
+    rng = random.Random(0)
+    analyzer = MemoryAnalyzer()
+    cases: List[Tuple[str, Callable[[], None]]] = []
+
+    for count in (0, 100, 1000, 5000):
+        memories = [make_text(rng, rng.randint(3, 30)) for _ in range(count)]
+        cases.append((f"memory_analyzer.analyze_memories[{count}]", lambda m=memories: analyzer.analyze_memories(m)))
+
+    for label, words in (("short", 3), ("long", 300)):
+        history = [{'role': 'user' if i % 2 == 0 else 'model', 'parts': [make_text(rng, words)]} for i in range(10)]
+        cases.append((f"memory_analyzer.analyze_conversation_context[{label}]",
+                      lambda h=history: analyzer.analyze_conversation_context(h)))
+        message = make_text(rng, words)
+        cases.append((f"memory_analyzer.score_message[{label}]", lambda m=message: analyzer.score_message(m)))
+
+    themes = ['winter', 'night', 'weekend']
+    variants = [(persona, evolved, affection) for persona in PERSONAS for evolved in (False, True)
+                for affection in AFFECTION_TIERS]
+
+    def all_prompts():
+        for persona, evolved, affection in variants:
+            prompts.get_event_enhanced_prompt(persona, evolved, themes=themes, affection=affection)
+    cases.append((f"prompts.get_event_enhanced_prompt[x{len(variants)}]", all_prompts))
+
+    manager = EventManager()
+    start = datetime.datetime(2026, 1, 1)
+    moments = [start + datetime.timedelta(minutes=rng.randrange(366 * 24 * 60)) for _ in range(200)]
+
+    def event_lookups():
+        for now in moments:
+            manager.get_current_themes(now)
+            manager.get_affection_bonus(now)
+    cases.append((f"events.themes_and_bonus[x{len(moments)}]", event_lookups))
+
+    def event_prompts():
+        for now in moments:
+            manager.get_event_prompt_modifiers(now)
+    cases.append((f"events.get_event_prompt_modifiers[x{len(moments)}]", event_prompts))
+
+    for label, words in (("short", 5), ("long", 400)):
+        payload = json.dumps({"response": make_text(rng, words),
+                              "personality_scores": {"tsundere": 3, "yandere": 12, "kuudere": 4, "dandere": 0}})
+        for fence, text in (("plain", payload), ("fenced", f"Here you go:\n```json\n{payload}\n```\n")):
+            cases.append((f"engine.parse_combined_response[{label},{fence}]",
+                          lambda t=text: parse_combined_response(t)))
+
+    app = Flask('bench')
+    app.config.update(EVOLUTION_AFFECTION_THRESHOLD=30, EVOLUTION_SCORE_DIFFERENCE=5, EVOLUTION_HYSTERESIS_FACTOR=2)
+    states = [dict(affection=affection, personality_type=persona, evolved=persona != 'Natural',
+                   tsundere_score=rng.randint(0, 60), yandere_score=rng.randint(0, 60),
+                   kuudere_score=rng.randint(0, 60), dandere_score=rng.randint(0, 60))
+              for persona in PERSONAS for affection in AFFECTION_TIERS for _ in range(4)]
+    users = [User(session_id='bench', security_token='x', **state) for state in states]
+
+    def check_all():
+        with app.app_context():
+            for user, state in zip(users, states):
+                user.personality_type, user.evolved = state['personality_type'], state['evolved']
+                evolution.check_evolution(user)
+    cases.append((f"evolution.check_evolution[x{len(users)}]", check_all))
+
+    return cases
+
+
+def measure(func: Callable[[], None]) -> float:
+    """Best seconds per call over REPEATS rounds of at least MIN_ROUND_SECONDS each"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_ROUND_SECONDS:
+            break
+        loops *= 2 if elapsed * 4 >= MIN_ROUND_SECONDS else 10
+
+    best = elapsed / loops
+    for _ in range(REPEATS - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - started) / loops)
+    return best
+
+
+def run(name_filter: str = "", suite_rounds: int = 3) -> Dict:
+    """Run the suite `suite_rounds` times, keeping the best time of each case (damps machine noise)"""
+    cases = [(name, func) for name, func in build_cases() if name_filter in name]
+    results: Dict[str, Dict[str, float]] = {}
+    for _ in range(suite_rounds):
+        for name, func in cases:
+            result = results.setdefault(name, {"seconds": float('inf'), "calibration_seconds": float('inf')})
+            result["calibration_seconds"] = min(result["calibration_seconds"], measure(calibration))
+            result["seconds"] = min(result["seconds"], measure(func))
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Names of the benchmarks slower than baseline * (1 + tolerance) after normalization"""
+    regressions = []
+    for name, result in report["results"].items():
+        seconds = result["seconds"]
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"  {name:60s} {format_seconds(seconds):>10s}   (no baseline)")
+            continue
+        speed = result["calibration_seconds"] / base["calibration_seconds"]
+        ratio = seconds / (base["seconds"] * speed)
+        failed = ratio > 1 + tolerance
+        if failed:
+            regressions.append(name)
+        print(f"  {name:60s} {format_seconds(seconds):>10s}   {ratio:5.2f}x{'  REGRESSION' if failed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--filter', default='', help='Only benchmarks whose name contains this text')
+    run_parser.add_argument('--rounds', type=int, default=3, help='Suite repetitions (best time per case is kept)')
+    run_parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, default=None,
+                            help='Store the results as the baseline (default path: benchmarks/baselines/hot_paths.json)')
+    compare_parser = sub.add_parser('compare', help='Run and compare against the baseline')
+    compare_parser.add_argument('--filter', default='')
+    compare_parser.add_argument('--rounds', type=int, default=3)
+    compare_parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    compare_parser.add_argument('--tolerance', type=float, default=float(os.getenv('BENCH_TOLERANCE', '1.0')),
+                                help='Allowed slowdown before failing, e.g. 1.0 = 2x (env BENCH_TOLERANCE)')
+    args = parser.parse_args()
+
+    report = run(args.filter, args.rounds)
+    if args.command == 'run':
+        for name, result in report["results"].items():
+            print(f"  {name:60s} {format_seconds(result['seconds']):>10s}")
+        if args.save:
+            os.makedirs(os.path.dirname(args.save), exist_ok=True)
+            with open(args.save, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+                f.write("\n")
+            print(f"Baseline saved to {args.save}")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
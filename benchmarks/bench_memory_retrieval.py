@@ -0,0 +1,64 @@
+"""
+Benchmark: long-term memory retrieval latency with the per-user BM25 index.
+
+Builds an index over N generated memories for one user and reports build time,
+index memory footprint and top-k query latency percentiles.
+
+Usage:
+    python benchmarks/bench_memory_retrieval.py [--memories 10000] [--top-k 20] [--queries 500]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.memory_index import MemoryIndex  # noqa: E402
+
+VOCABULARY = ("cat dog coffee tea sister brother osaka tokyo hiking reading book birthday exam "
+              "work boss project piano guitar movie anime ramen sushi rain summer winter lonely happy "
+              "nervous presentation friend family train bicycle garden flower ocean mountain star").split()
+
+
+def make_memory(rng: random.Random) -> str:
+    return "I " + " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(4, 20)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memories', type=int, default=10000)
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    memories = [make_memory(rng) for _ in range(args.memories)]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = MemoryIndex()
+    for memory_id, content in enumerate(memories, start=1):
+        index.add(memory_id, content)
+    build_seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queries = [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 30))) for _ in range(args.queries)]
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, args.top_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+
+    print(f"memories={args.memories} build={build_seconds * 1000:.1f}ms index_peak_mem={peak / 1e6:.1f}MB")
+    print(f"top-{args.top_k} query latency: p50={statistics.median(latencies):.2f}ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1]:.2f}ms max={latencies[-1]:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark: concurrent chat-turn writes with 1..N SQLite shards.
+
+Each writer process runs chat turns for random users: insert the user and AI
+messages, update the user's scores and analytics rollups, and apply retention,
+then commit (the write pattern of /api/chat plus post_turn). With one shard all
+writers serialize on one database write lock; with N shards turns of users on
+different shards commit in parallel.
+
+Usage:
+    python benchmarks/bench_sharded_writes.py [--shards 1,2,4,8] [--writers 8] [--turns 300] [--users 400] [--dir DIR]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark')  # config.py requires a key at import time
+
+from app import analytics, create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import ChatMessage, User  # noqa: E402
+from app.sharding import create_all_shards, select_shard, shard_for_session, shard_for_user_id  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def make_app(directory: str, shards: int):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(directory, 'project.db')
+        DATABASE_SHARDS = shards
+        TASK_PIPELINE_ENABLED = False
+        TASK_QUEUE_PATH = ':memory:'
+        # Writers queue on the lock instead of failing
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 60}}
+
+    return create_app(BenchConfig)
+
+
+def setup(directory: str, shards: int, users: int):
+    app = make_app(directory, shards)
+    user_ids = []
+    with app.app_context():
+        create_all_shards(db)
+        for i in range(users):
+            session_id = f'bench-{i}'
+            select_shard(db.session, shard_for_session(session_id, shards))
+            user = User(session_id=session_id, security_token='x')
+            db.session.add(user)
+            db.session.commit()
+            user_ids.append(user.id)
+    return user_ids
+
+
+def writer(directory: str, shards: int, user_ids, turns: int, seed: int, start_event) -> None:
+    app = make_app(directory, shards)
+    rng = random.Random(seed)
+    with app.app_context():
+        start_event.wait()
+        for _ in range(turns):
+            user_id = rng.choice(user_ids)
+            select_shard(db.session, shard_for_user_id(user_id))
+            user = db.session.get(User, user_id)
+            db.session.add(ChatMessage(user_id=user_id, role='user', content='hello ' * 20))
+            db.session.add(ChatMessage(user_id=user_id, role='ai', content='hi ' * 40))
+            old_affection, old_persona = user.affection, user.personality_type
+            user.affection += 1
+            user.tsundere_score += rng.randint(0, 3)
+            analytics.record_turn(old_affection, old_persona, user, False, False)
+            db.session.commit()
+            ChatMessage.cleanup_old_messages(user_id, keep_last=20)
+
+
+def run(shards: int, writers: int, turns: int, users: int, base_dir: str) -> float:
+    directory = tempfile.mkdtemp(prefix=f'shards{shards}-', dir=base_dir)
+    try:
+        user_ids = setup(directory, shards, users)
+        start_event = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=writer, args=(directory, shards, user_ids, turns, i, start_event))
+                     for i in range(writers)]
+        for process in processes:
+            process.start()
+        time.sleep(1.0)  # let every writer finish importing and connecting
+        started = time.perf_counter()
+        start_event.set()
+        for process in processes:
+            process.join()
+        seconds = time.perf_counter() - started
+        if any(process.exitcode for process in processes):
+            raise RuntimeError("a writer failed")
+        return writers * turns / seconds
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', default='1,2,4,8')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=300, help='Turns per writer')
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--dir', default=None, help='Where to create the databases (use a real disk, not tmpfs)')
+    args = parser.parse_args()
+
+    baseline = None
+    for shards in (int(value) for value in args.shards.split(',')):
+        rate = run(shards, args.writers, args.turns, args.users, args.dir)
+        baseline = baseline or rate
+        print(f"{shards} shard(s): {rate:,.0f} turns/sec ({rate / baseline:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
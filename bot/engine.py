@@ -1,13 +1,124 @@
 import json
 import logging
-from typing import Dict, List, Any, Tuple
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
 from tenacity import retry, stop_after_attempt, wait_exponential
 import google.generativeai as genai
 from .events import EventManager
+from .memory_analyzer import MemoryAnalyzer
+from .prompts import split_per_turn
+from .router import RoutedModel
 
 # Logger setup
 logger = logging.getLogger(__name__)
 
+# Rough bytes-per-token ratio used for prompt size estimates (no tokenizer call)
+BYTES_PER_TOKEN = 4
+
+# Personality scoring modes (PERSONALITY_SCORING)
+SCORING_LLM = 'llm'      # combined call: the model returns the reply and personality_scores as JSON
+SCORING_LOCAL = 'local'  # the model returns plain text; scores come from MemoryAnalyzer.score_message
+
+# Stateless apart from its precompiled patterns, so one instance serves every thread
+local_analyzer = MemoryAnalyzer()
+
+# Output contract of the combined call. Static text, so it stays part of the cacheable prefix.
+COMBINED_RESPONSE_FORMAT = """
+# Response Format
+Respond to the user's latest message and perform personality analysis simultaneously.
+
+Response format must strictly follow this JSON format:
+{
+    "response": "Your response message here",
+    "personality_scores": {
+        "tsundere": 0-10 integer,
+        "yandere": 0-10 integer,
+        "kuudere": 0-10 integer,
+        "dandere": 0-10 integer
+    }
+}
+
+Important:
+- Response message should be natural based on your personality and current context
+- personality_scores should analyze the personality tendencies in the user message
+- Do not output any text outside the JSON format
+"""
+
+def build_system_instruction(system_prompt: str, event_prompt: str, response_format: str = "") -> str:
+    """
+    Persona + context sent once per request through the system-instruction channel.
+    Ordered from most to least stable so providers can reuse the cached prefix:
+    persona and relationship tier, response format, events (hourly), then the
+    per-turn tail of `system_prompt` (affection, memories, time).
+    """
+    stable, per_turn = split_per_turn(system_prompt)
+    parts = [stable.rstrip()]
+    if response_format:
+        parts.append(response_format.strip())
+    if event_prompt:
+        parts.append(f"# Current Context and Events\n{event_prompt}")
+    if per_turn.strip():
+        parts.append(per_turn.strip())
+    return "\n\n".join(parts) + "\n"
+
+def with_system_instruction(model: Any, system_instruction: str) -> Any:
+    """Return `model` configured to send `system_instruction` natively"""
+    if isinstance(model, RoutedModel):
+        return model.with_model_kwargs(system_instruction=system_instruction)
+    if isinstance(model, genai.GenerativeModel):
+        return genai.GenerativeModel(model.model_name, system_instruction=system_instruction)
+    return model
+
+def log_prompt_sizes(call: str, sections: Dict[str, Any]) -> Dict[str, int]:
+    """Log prompt bytes and estimated tokens per section"""
+    sizes = {}
+    for name, value in sections.items():
+        text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        sizes[name] = len(text.encode('utf-8'))
+    total = sum(sizes.values())
+    logger.info(
+        f"Prompt sizes ({call}): " +
+        ", ".join(f"{name}={size}B/~{size // BYTES_PER_TOKEN}t" for name, size in sizes.items()) +
+        f", total={total}B/~{total // BYTES_PER_TOKEN}t"
+    )
+    return sizes
+
+def parse_combined_response(text: str) -> Tuple[str, Dict[str, int]]:
+    """
+    Extract (response, personality_scores) from the combined call's JSON output.
+    Code fences are stripped and scores are clipped to 0-10.
+
+    Raises:
+        json.JSONDecodeError: If the text is not JSON.
+    """
+    json_text = text.strip()
+    
+    # Remove code blocks
+    if '```json' in json_text:
+        json_text = json_text.split('```json')[1].split('```')[0]
+    elif '```' in json_text:
+        json_text = json_text.split('```')[1].split('```')[0]
+    
+    result = json.loads(json_text)
+    
+    # Validate required fields
+    if 'response' not in result or 'personality_scores' not in result:
+        logger.warning(f"Missing required fields in response: {result}")
+        return "Response format is incorrect.", {"tsundere": 0, "yandere": 0, "kuudere": 0, "dandere": 0}
+    
+    # Score validation and defaults
+    default_scores = {"tsundere": 0, "yandere": 0, "kuudere": 0, "dandere": 0}
+    scores = result['personality_scores']
+    
+    for key in default_scores:
+        if key not in scores or not isinstance(scores[key], int):
+            logger.warning(f"Invalid score for '{key}': {scores.get(key)}")
+            scores[key] = default_scores[key]
+        # Clip scores to 0-10 range
+        scores[key] = max(0, min(10, scores[key]))
+    
+    return result['response'], scores
+
 @retry(
     wait=wait_exponential(multiplier=1, min=4, max=10),
     stop=stop_after_attempt(3),
@@ -17,7 +128,10 @@ def generate_response_with_analysis(
     model: genai.GenerativeModel,
     system_prompt: str,
     chat_history: List[Dict[str, str]],
-    user_message: str
+    user_message: str,
+    fallback_model: Optional[genai.GenerativeModel] = None,
+    score_model: Optional[genai.GenerativeModel] = None,
+    now: Optional[datetime] = None
 ) -> Tuple[str, Dict[str, int]]:
     """
     Get AI response and personality analysis in a single API call.
@@ -28,6 +142,9 @@ def generate_response_with_analysis(
         system_prompt: System prompt defining AI's role and personality.
         chat_history: List of previous conversation history.
         user_message: User's latest message.
+        fallback_model: Model for the fallback reply (defaults to `model`).
+        score_model: Model for the fallback score-only analysis (defaults to `model`).
+        now: User's local time for event lookups (defaults to server local time).
 
     Returns:
         Tuple (ai_response, analysis_scores).
@@ -41,92 +158,107 @@ def generate_response_with_analysis(
     
     # Event manager for context
     event_manager = EventManager()
-    event_prompt = event_manager.get_event_prompt_modifiers()
+    event_prompt = event_manager.get_event_prompt_modifiers(now)
     
-    # Combined prompt with event context
-    combined_prompt = f"""
-    {system_prompt}
-
-    # Current Context and Events
-    {event_prompt}
-
-    Respond to the following user message and perform personality analysis simultaneously.
-
-    User message: "{user_message}"
-
-    Response format must strictly follow this JSON format:
-    {{
-        "response": "Your response message here",
-        "personality_scores": {{
-            "tsundere": 0-10 integer,
-            "yandere": 0-10 integer,
-            "kuudere": 0-10 integer,
-            "dandere": 0-10 integer
-        }}
-    }}
-
-    Important:
-    - Response message should be natural based on your personality and current context
-    - personality_scores should analyze the personality tendencies in the user message
-    - Do not output any text outside the JSON format
-    """
+    # Persona, memories, events and the output contract go through the native
+    # system-instruction channel once; the contents only carry the conversation.
+    system_instruction = build_system_instruction(system_prompt, event_prompt, COMBINED_RESPONSE_FORMAT)
+    user_turn = f'User message: "{user_message}"'
+    log_prompt_sizes("combined", {
+        "system_prompt": system_prompt,
+        "events": event_prompt,
+        "format": COMBINED_RESPONSE_FORMAT,
+        "history": chat_history,
+        "message": user_turn,
+    })
     
     try:
-        # Combine conversation history with combined prompt
-        full_prompt = [
-            {'role': 'user', 'parts': [system_prompt]},
-            {'role': 'model', 'parts': ["Yes, I understand. I will respond with these settings."]}
-        ] + chat_history + [{'role': 'user', 'parts': [combined_prompt]}]
+        full_prompt = chat_history + [{'role': 'user', 'parts': [user_turn]}]
+        combined_model = with_system_instruction(model, system_instruction)
 
-        response = model.generate_content(full_prompt)
+        response = combined_model.generate_content(full_prompt)
         
         if not response.text:
             logger.error("Empty response from Gemini API")
             return "Sorry, I couldn't generate a response.", {"tsundere": 0, "yandere": 0, "kuudere": 0, "dandere": 0}
         
-        # Parse JSON response
-        json_text = response.text.strip()
-        
-        # Remove code blocks
-        if '```json' in json_text:
-            json_text = json_text.split('```json')[1].split('```')[0]
-        elif '```' in json_text:
-            json_text = json_text.split('```')[1].split('```')[0]
-        
-        result = json.loads(json_text)
-        
-        # Validate required fields
-        if 'response' not in result or 'personality_scores' not in result:
-            logger.warning(f"Missing required fields in response: {result}")
-            return "Response format is incorrect.", {"tsundere": 0, "yandere": 0, "kuudere": 0, "dandere": 0}
-        
-        # Score validation and defaults
-        default_scores = {"tsundere": 0, "yandere": 0, "kuudere": 0, "dandere": 0}
-        scores = result['personality_scores']
-        
-        for key in default_scores:
-            if key not in scores or not isinstance(scores[key], int):
-                logger.warning(f"Invalid score for '{key}': {scores.get(key)}")
-                scores[key] = default_scores[key]
-            # Clip scores to 0-10 range
-            scores[key] = max(0, min(10, scores[key]))
-        
-        return result['response'], scores
+        return parse_combined_response(response.text)
 
     except json.JSONDecodeError as e:
         logger.error(f"Failed to decode JSON from combined response: {e}. Response text: {response.text}")
         # Fallback: normal response generation
-        return generate_response_fallback(model, system_prompt, chat_history, user_message)
+        return generate_response_fallback(fallback_model or model, system_prompt, chat_history, user_message,
+                                          score_model=score_model, now=now)
     except Exception as e:
         logger.error(f"Error during combined API call: {e}", exc_info=True)
         # Fallback
-        return generate_response_fallback(model, system_prompt, chat_history, user_message)
+        return generate_response_fallback(fallback_model or model, system_prompt, chat_history, user_message,
+                                          score_model=score_model, now=now)
+
+def generate_plain_response(
+    model: genai.GenerativeModel,
+    system_prompt: str,
+    chat_history: List[Dict[str, str]],
+    user_message: str,
+    now: Optional[datetime] = None,
+    call: str = "plain"
+) -> str:
+    """
+    Reply as plain text: persona and events via the system instruction, no output contract.
+
+    Raises:
+        Exception: If the API call fails.
+    """
+    event_manager = EventManager()
+    event_prompt = event_manager.get_event_prompt_modifiers(now)
+
+    system_instruction = build_system_instruction(system_prompt, event_prompt)
+    log_prompt_sizes(call, {
+        "system_prompt": system_prompt,
+        "events": event_prompt,
+        "history": chat_history,
+        "message": user_message,
+    })
+    full_prompt = chat_history + [{'role': 'user', 'parts': [user_message]}]
+
+    response = with_system_instruction(model, system_instruction).generate_content(full_prompt)
+    return response.text if response.text else "Sorry, I couldn't generate a response."
+
+def generate_response_with_local_scores(
+    model: genai.GenerativeModel,
+    system_prompt: str,
+    chat_history: List[Dict[str, str]],
+    user_message: str,
+    fallback_model: Optional[genai.GenerativeModel] = None,
+    now: Optional[datetime] = None
+) -> Tuple[str, Dict[str, int]]:
+    """
+    PERSONALITY_SCORING=local: one plain-text model call for the reply, personality scores
+    computed locally from the user message. No JSON envelope, so no parse failures and
+    fewer output tokens. A failed call is retried once on `fallback_model`.
+
+    Returns:
+        Tuple (ai_response, analysis_scores) like generate_response_with_analysis.
+    """
+    scores = local_analyzer.score_message(user_message)
+    try:
+        return generate_plain_response(model, system_prompt, chat_history, user_message, now), scores
+    except Exception as e:
+        logger.error(f"Error during plain API call: {e}", exc_info=True)
+    try:
+        return generate_plain_response(fallback_model or model, system_prompt, chat_history, user_message, now,
+                                       call="fallback"), scores
+    except Exception as e:
+        logger.error(f"Fallback plain call also failed: {e}")
+        return "An error occurred. Please try again later.", scores
 
 def generate_response_fallback(
     model: genai.GenerativeModel,
     system_prompt: str,
     chat_history: List[Dict[str, str]],
-    user_message: str
+    user_message: str,
+    score_model: Optional[genai.GenerativeModel] = None,
+    now: Optional[datetime] = None
 ) -> Tuple[str, Dict[str, int]]:
     """
     Fallback function when combined API call fails.
@@ -135,24 +267,12 @@ def generate_response_fallback(
     logger.warning("Using fallback method (two API calls)")
     
     try:
-        # Event manager for context
-        event_manager = EventManager()
-        event_prompt = event_manager.get_event_prompt_modifiers()
-        
-        # Enhanced system prompt with events
-        enhanced_system_prompt = f"{system_prompt}\n\n# Current Context\n{event_prompt}" if event_prompt else system_prompt
-        
-        # Normal response generation
-        full_prompt = [
-            {'role': 'user', 'parts': [enhanced_system_prompt]},
-            {'role': 'model', 'parts': ["Yes, I understand. I will respond with these settings."]}
-        ] + chat_history + [{'role': 'user', 'parts': [user_message]}]
-
-        response = model.generate_content(full_prompt)
-        ai_response = response.text if response.text else "Sorry, I couldn't generate a response."
+        # Normal response generation (persona and events via system instruction)
+        ai_response = generate_plain_response(model, system_prompt, chat_history, user_message, now,
+                                              call="fallback")
         
         # Personality analysis
-        analysis_result = analyze_personality_scores_fallback(model, user_message)
+        analysis_result = analyze_personality_scores_fallback(score_model or model, user_message)
         
         return ai_response, analysis_result
         
@@ -1,7 +1,32 @@
 import datetime
-import random
-from typing import Dict, List, Optional
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
 from enum import Enum
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'events.json')
+
+# Seconds between mtime checks of the events file (hot reload)
+RELOAD_CHECK_INTERVAL = 2.0
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# Yearly rules are placed on a leap-year calendar so that 02-29 has a slot
+_LEAP_YEAR = 2000
+MINUTES_PER_LEAP_YEAR = 366 * MINUTES_PER_DAY
+
+# Fields that describe when an event is active rather than the event itself
+_SCHEDULE_FIELDS = ('recurrence', 'welcome_message')
+
+DEFAULT_WELCOME_MESSAGE = "Welcome back! How are you today?"
 
 class EventType(Enum):
     DAILY = "daily"
@@ -9,224 +34,371 @@ class EventType(Enum):
     SEASONAL = "seasonal"
     SPECIAL = "special"
 
+
+def _minute_of_day(value: str) -> int:
+    """'HH:MM' -> minutes since midnight ('24:00' is the end of the day)"""
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def _minute_of_year(value: str) -> int:
+    """'MM-DD' -> minutes since Jan 1 on the leap-year calendar"""
+    month, day = value.split('-')
+    return (datetime.date(_LEAP_YEAR, int(month), int(day)) - datetime.date(_LEAP_YEAR, 1, 1)).days * MINUTES_PER_DAY
+
+
+def _wrapped(start: int, end: int, period: int) -> List[Tuple[int, int]]:
+    """Half-open [start, end) within a period; an end at or before the start wraps around"""
+    if end > start:
+        return [(start, end)]
+    return [(start, period), (0, end)] if end else [(start, period)]
+
+
+class _BoundaryIndex:
+    """
+    Sorted boundaries with the active event ordinals of each segment.
+    Lookup is a binary search over the boundaries: O(log n) in the number of boundaries.
+    """
+
+    def __init__(self, intervals: Sequence[Tuple[float, float, int]], origin: float = 0):
+        deltas: Dict[float, List[Tuple[int, int]]] = {origin: []}
+        for start, end, ordinal in intervals:
+            deltas.setdefault(start, []).append((ordinal, 1))
+            deltas.setdefault(end, []).append((ordinal, -1))
+
+        self.boundaries: List[float] = []
+        self.segments: List[Tuple[int, ...]] = []
+        counts: Dict[int, int] = {}
+        for point in sorted(deltas):
+            for ordinal, delta in deltas[point]:
+                counts[ordinal] = counts.get(ordinal, 0) + delta
+            active = tuple(sorted(ordinal for ordinal, count in counts.items() if count > 0))
+            if self.segments and self.segments[-1] == active:
+                continue  # not a change point
+            self.boundaries.append(point)
+            self.segments.append(active)
+
+    def lookup(self, position: float) -> Tuple[int, ...]:
+        i = bisect_right(self.boundaries, position) - 1
+        return self.segments[i] if i >= 0 else ()
+
+    def next_boundary(self, position: float) -> Optional[float]:
+        i = bisect_right(self.boundaries, position)
+        return self.boundaries[i] if i < len(self.boundaries) else None
+
+
+class _PeriodicIndex(_BoundaryIndex):
+    """Boundary index over one repeating period (day, week or year)."""
+
+    def __init__(self, intervals: Sequence[Tuple[int, int, int]], period: int):
+        super().__init__(intervals)
+        self.period = period
+        # An interval ending at the period end continues in the next period if it wraps
+        while self.boundaries and self.boundaries[-1] >= period:
+            self.boundaries.pop()
+            self.segments.pop()
+        # The boundary at 0 only changes the active set if the end of the period differs
+        self.wraps = len(self.segments) > 1 and self.segments[0] != self.segments[-1]
+
+    def next_change(self, position: float) -> Optional[float]:
+        """Minutes from the period start to the next change after `position` (may exceed the period)"""
+        boundary = self.next_boundary(position)
+        if boundary is not None:
+            return boundary
+        if self.wraps:
+            return self.period
+        if len(self.boundaries) > 1:
+            return self.period + self.boundaries[1]
+        return None
+
+
+class EventCalendar:
+    """
+    Events compiled from data into boundary indexes, one per recurrence period.
+
+    Recurrence rules (times are the user's local wall-clock time, ranges are half-open):
+        {"freq": "daily", "start": "22:00", "end": "05:00"}
+        {"freq": "weekly", "weekdays": [5, 6]}                  (optional "start"/"end" times)
+        {"freq": "yearly", "start": "12-20", "end": "12-27"}    (MM-DD)
+        {"freq": "once", "start": "2026-11-01T00:00", "end": "2026-11-08T00:00"}
+    """
+
+    def __init__(self, events: List[Dict]):
+        self.events: List[Dict] = []
+        daily, weekly, yearly, once = [], [], [], []
+        for ordinal, event in enumerate(events):
+            event = dict(event)
+            event_id = event.get('id')
+            try:
+                event['type'] = EventType(event['type'])
+                rule = event['recurrence']
+                freq = rule['freq']
+                if freq == 'daily':
+                    for start, end in _wrapped(_minute_of_day(rule['start']), _minute_of_day(rule['end']),
+                                               MINUTES_PER_DAY):
+                        daily.append((start, end, ordinal))
+                elif freq == 'weekly':
+                    start = _minute_of_day(rule.get('start', '00:00'))
+                    end = _minute_of_day(rule.get('end', '24:00'))
+                    for weekday in rule['weekdays']:
+                        offset = int(weekday) * MINUTES_PER_DAY
+                        length = end - start if end > start else end - start + MINUTES_PER_DAY
+                        week_end = (offset + start + length) % MINUTES_PER_WEEK
+                        for interval in _wrapped(offset + start, week_end, MINUTES_PER_WEEK):
+                            weekly.append((*interval, ordinal))
+                elif freq == 'yearly':
+                    for start, end in _wrapped(_minute_of_year(rule['start']), _minute_of_year(rule['end']),
+                                               MINUTES_PER_LEAP_YEAR):
+                        yearly.append((start, end, ordinal))
+                elif freq == 'once':
+                    once.append((self._once_position(datetime.datetime.fromisoformat(rule['start'])),
+                                 self._once_position(datetime.datetime.fromisoformat(rule['end'])), ordinal))
+                else:
+                    raise ValueError(f"unknown freq {freq!r}")
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Invalid event {event_id!r}: {e}") from e
+            self.events.append(event)
+
+        self.events_by_id = {event['id']: event for event in self.events}
+        self._daily = _PeriodicIndex(daily, MINUTES_PER_DAY)
+        self._weekly = _PeriodicIndex(weekly, MINUTES_PER_WEEK)
+        self._yearly = _PeriodicIndex(yearly, MINUTES_PER_LEAP_YEAR)
+        # One-off events use naive wall-clock timestamps (interpreted as UTC so they are DST-free)
+        self._once = _BoundaryIndex(once, origin=float('-inf'))
+
+    @classmethod
+    def from_file(cls, path: str) -> 'EventCalendar':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def _positions(now: datetime.datetime) -> Tuple[datetime.datetime, float, datetime.datetime, float,
+                                                     datetime.datetime, float]:
+        """(period start, minutes into period) for the day, week and year of a naive wall-clock time"""
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        minute_of_day = (now - day_start).total_seconds() / 60
+        week_start = day_start - datetime.timedelta(days=now.weekday())
+        year_start = day_start.replace(month=1, day=1)
+        leap_day = (datetime.date(_LEAP_YEAR, now.month, now.day) - datetime.date(_LEAP_YEAR, 1, 1)).days
+        return (day_start, minute_of_day,
+                week_start, now.weekday() * MINUTES_PER_DAY + minute_of_day,
+                year_start, leap_day * MINUTES_PER_DAY + minute_of_day)
+
+    @staticmethod
+    def _once_position(now: datetime.datetime) -> float:
+        return now.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+    def active(self, now: datetime.datetime) -> List[Dict]:
+        """Events active at the wall-clock time of `now`, in file order"""
+        now = now.replace(tzinfo=None)
+        _, day_pos, _, week_pos, _, year_pos = self._positions(now)
+        ordinals = set(self._daily.lookup(day_pos))
+        ordinals.update(self._weekly.lookup(week_pos))
+        ordinals.update(self._yearly.lookup(year_pos))
+        ordinals.update(self._once.lookup(self._once_position(now)))
+        return [self.events[ordinal] for ordinal in sorted(ordinals)]
+
+    def next_transition(self, now: datetime.datetime) -> Optional[datetime.datetime]:
+        """Next wall-clock time after `now` at which the active set changes (keeps now's tzinfo)"""
+        tzinfo, now = now.tzinfo, now.replace(tzinfo=None)
+        day_start, day_pos, week_start, week_pos, year_start, year_pos = self._positions(now)
+        candidates = []
+
+        change = self._daily.next_change(day_pos)
+        if change is not None:
+            candidates.append(day_start + datetime.timedelta(minutes=change))
+        change = self._weekly.next_change(week_pos)
+        if change is not None:
+            candidates.append(week_start + datetime.timedelta(minutes=change))
+        change = self._yearly.next_change(year_pos)
+        if change is not None:
+            years, minutes = divmod(change, MINUTES_PER_LEAP_YEAR)
+            leap_date = datetime.date(_LEAP_YEAR, 1, 1) + datetime.timedelta(minutes=minutes)
+            year = year_start.year + int(years)
+            try:
+                boundary = datetime.datetime(year, leap_date.month, leap_date.day)
+            except ValueError:  # 02-29 in a common year starts together with 03-01
+                boundary = datetime.datetime(year, 3, 1)
+            candidates.append(boundary + datetime.timedelta(minutes=minutes % MINUTES_PER_DAY))
+        change = self._once.next_boundary(self._once_position(now))
+        if change is not None:
+            candidates.append(datetime.datetime.fromtimestamp(change, datetime.timezone.utc).replace(tzinfo=None))
+
+        candidates = [candidate for candidate in candidates if candidate > now]
+        if not candidates:
+            return None
+        return min(candidates).replace(tzinfo=tzinfo)
+
+
+class CalendarSource:
+    """
+    Hot-reloadable calendar: the events file is re-read when its mtime changes
+    (checked at most every RELOAD_CHECK_INTERVAL seconds). A file that fails to
+    parse is logged and the previous calendar stays in use.
+    """
+
+    def __init__(self, path: str = DEFAULT_EVENTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._calendar: Optional[EventCalendar] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def get(self) -> EventCalendar:
+        now = time.monotonic()
+        if self._calendar is not None and now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return self._calendar
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+                if self._calendar is None or mtime != self._mtime:
+                    self._calendar = EventCalendar.from_file(self.path)
+                    self._mtime = mtime
+                    logger.info(f"Loaded {len(self._calendar.events)} events from {self.path}")
+            except (OSError, ValueError) as e:
+                if self._calendar is None:
+                    raise
+                logger.error(f"Keeping previous event calendar, failed to reload {self.path}: {e}")
+            return self._calendar
+
+
+_calendar_source = CalendarSource()
+
+
+def configure_calendar(path: str) -> None:
+    """Use another events file (EVENTS_FILE)"""
+    global _calendar_source
+    if path != _calendar_source.path:
+        _calendar_source = CalendarSource(path)
+
+
+def get_calendar() -> EventCalendar:
+    return _calendar_source.get()
+
+
+@lru_cache(maxsize=1024)
+def resolve_timezone(name: Optional[str]) -> Optional[ZoneInfo]:
+    """ZoneInfo for an IANA timezone name, or None when unknown"""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def local_time(tz_name: Optional[str] = None, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """Aware current time in the user's timezone (the server's local timezone when unknown)"""
+    now = now if now is not None else datetime.datetime.now(datetime.timezone.utc)
+    return now.astimezone(resolve_timezone(tz_name))
+
+
 class EventManager:
-    def __init__(self):
+    """
+    Event lookups against the shared calendar. Every `now` is evaluated at its
+    wall-clock time, so pass local_time(user.timezone) to resolve events for a user.
+    """
+
+    def __init__(self, calendar: Optional[EventCalendar] = None):
         self.current_events = {}
+        self.calendar = calendar
         self.load_events()
-    
+
     def load_events(self):
-        """Load event data"""
-        self.events = {
-            # Daily events
-            "monday_motivation": {
-                "type": EventType.DAILY,
-                "condition": lambda: datetime.datetime.now().weekday() == 0,
-                "name": "Monday Motivation",
-                "theme": "motivation",
-                "affection_bonus": 2,
-                "prompt_modifier": "It's Monday! Let's start the week with positive energy and motivation.",
-                "icon": "🚀"
-            },
-            "friday_excitement": {
-                "type": EventType.DAILY,
-                "condition": lambda: datetime.datetime.now().weekday() == 4,
-                "name": "Friday Excitement",
-                "theme": "weekend",
-                "affection_bonus": 1,
-                "prompt_modifier": "It's Friday! The weekend is almost here. Any exciting plans?",
-                "icon": "🎉"
-            },
-            "weekend_chill": {
-                "type": EventType.DAILY,
-                "condition": lambda: datetime.datetime.now().weekday() in [5, 6],
-                "name": "Weekend Chill",
-                "theme": "relaxation",
-                "affection_bonus": 1,
-                "prompt_modifier": "It's the weekend! Time to relax and enjoy some quiet moments.",
-                "icon": "😌"
-            },
-            
-            # Seasonal events
-            "spring": {
-                "type": EventType.SEASONAL,
-                "condition": lambda: 3 <= datetime.datetime.now().month <= 5,
-                "name": "Spring Festival",
-                "theme": "spring",
-                "affection_bonus": 1,
-                "prompt_modifier": "Spring is here! The flowers are blooming and everything feels fresh and new.",
-                "icon": "🌸"
-            },
-            "summer": {
-                "type": EventType.SEASONAL,
-                "condition": lambda: 6 <= datetime.datetime.now().month <= 8,
-                "name": "Summer Adventure",
-                "theme": "summer",
-                "affection_bonus": 1,
-                "prompt_modifier": "Summer vibes! Perfect time for adventures and making memories.",
-                "icon": "☀️"
-            },
-            "autumn": {
-                "type": EventType.SEASONAL,
-                "condition": lambda: 9 <= datetime.datetime.now().month <= 11,
-                "name": "Autumn Colors",
-                "theme": "autumn",
-                "affection_bonus": 1,
-                "prompt_modifier": "Autumn leaves are falling. There's something nostalgic about this season.",
-                "icon": "🍂"
-            },
-            "winter": {
-                "type": EventType.SEASONAL,
-                "condition": lambda: datetime.datetime.now().month in [12, 1, 2],
-                "name": "Winter Wonderland",
-                "theme": "winter",
-                "affection_bonus": 1,
-                "prompt_modifier": "Winter is here! Cozy days and warm conversations.",
-                "icon": "⛄"
-            },
-            
-            # Special events
-            "new_year": {
-                "type": EventType.SPECIAL,
-                "condition": lambda: datetime.datetime.now().month == 1 and datetime.datetime.now().day <= 7,
-                "name": "New Year Celebration",
-                "theme": "celebration",
-                "affection_bonus": 2,
-                "prompt_modifier": "Happy New Year! This is a time for new beginnings and fresh starts.",
-                "icon": "🎊"
-            },
-            "christmas": {
-                "type": EventType.SPECIAL,
-                "condition": lambda: datetime.datetime.now().month == 12 and 20 <= datetime.datetime.now().day <= 26,
-                "name": "Christmas Season",
-                "theme": "holiday",
-                "affection_bonus": 2,
-                "prompt_modifier": "Merry Christmas! The most wonderful time of the year for sharing joy.",
-                "icon": "🎄"
-            },
-            
-            # Time-based events
-            "morning": {
-                "type": EventType.DAILY,
-                "condition": lambda: 5 <= datetime.datetime.now().hour < 12,
-                "name": "Good Morning",
-                "theme": "morning",
-                "affection_bonus": 1,
-                "prompt_modifier": "Good morning! A new day is full of possibilities.",
-                "icon": "🌅"
-            },
-            "evening": {
-                "type": EventType.DAILY,
-                "condition": lambda: 18 <= datetime.datetime.now().hour < 22,
-                "name": "Evening Relaxation",
-                "theme": "evening",
-                "affection_bonus": 1,
-                "prompt_modifier": "Evening time... perfect for relaxing conversations.",
-                "icon": "🌙"
-            },
-            "night": {
-                "type": EventType.DAILY,
-                "condition": lambda: 22 <= datetime.datetime.now().hour or datetime.datetime.now().hour < 5,
-                "name": "Late Night",
-                "theme": "night",
-                "affection_bonus": 1,
-                "prompt_modifier": "Late night hours... time for deep and meaningful talks.",
-                "icon": "🌃"
-            }
-        }
-    
-    def get_active_events(self) -> List[Dict]:
+        """Load event data (the compiled calendar, hot-reloaded from the events file)"""
+        if self.calendar is None:
+            self.calendar = get_calendar()
+        self.events = self.calendar.events_by_id
+
+    def _now(self, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+        """Resolve the timestamp used to evaluate events (server local time by default)"""
+        return now if now is not None else local_time()
+
+    def _active_event_items(self, now: Optional[datetime.datetime] = None) -> List[Tuple[str, Dict]]:
+        """Get (event_id, raw event data) pairs active at `now`"""
+        return [(event["id"], event) for event in self.calendar.active(self._now(now))]
+
+    def get_active_events(self, now: Optional[datetime.datetime] = None) -> List[Dict]:
         """Get currently active events"""
         active_events = []
-        for event_id, event_data in self.events.items():
-            if event_data["condition"]():
-                # Create a copy of event data without the condition function
-                # Functions are not JSON serializable
-                event_info = event_data.copy()
-                if 'condition' in event_info:
-                    del event_info['condition']
-                
-                # Enum is also not JSON serializable by default, convert to value
-                if 'type' in event_info and hasattr(event_info['type'], 'value'):
-                    event_info['type'] = event_info['type'].value
-                    
-                active_events.append({
-                    "id": event_id,
-                    **event_info
-                })
+        for event_id, event_data in self._active_event_items(now):
+            event_info = {key: value for key, value in event_data.items() if key not in _SCHEDULE_FIELDS}
+            # Enum is not JSON serializable by default, convert to value
+            event_info['type'] = event_info['type'].value
+            active_events.append(event_info)
         return active_events
-    
-    def get_event_prompt_modifiers(self) -> str:
+
+    def get_event_prompt_modifiers(self, now: Optional[datetime.datetime] = None) -> str:
         """Get prompt modifiers based on active events"""
-        # Re-implement logic to access raw events since get_active_events strips conditions
-        active_events = []
-        for event_id, event_data in self.events.items():
-            if event_data["condition"]():
-                active_events.append(event_data)
-                
-        modifiers = []
-        for event in active_events:
-            modifiers.append(event["prompt_modifier"])
-            
+        modifiers = [event["prompt_modifier"] for _, event in self._active_event_items(now)]
         return " ".join(modifiers) if modifiers else ""
-    
-    def get_affection_bonus(self) -> int:
+
+    def get_affection_bonus(self, now: Optional[datetime.datetime] = None) -> int:
         """Calculate affection bonus from events"""
-        # Re-implement logic to access raw events
-        active_events = []
-        for event_id, event_data in self.events.items():
-            if event_data["condition"]():
-                active_events.append(event_data)
-                
-        bonus = 0
-        for event in active_events:
-            bonus += event["affection_bonus"]
-            
+        bonus = sum(event["affection_bonus"] for _, event in self._active_event_items(now))
         return min(bonus, 10)  # Cap bonus at 10
-    
-    def get_current_themes(self) -> List[str]:
+
+    def get_current_themes(self, now: Optional[datetime.datetime] = None) -> List[str]:
         """Get current themes"""
-        # Re-implement logic to access raw events
-        active_events = []
-        for event_id, event_data in self.events.items():
-            if event_data["condition"]():
-                active_events.append(event_data)
-                
-        return [event["theme"] for event in active_events]
-    
-    def get_event_icons(self) -> List[str]:
+        return [event["theme"] for _, event in self._active_event_items(now)]
+
+    def get_event_icons(self, now: Optional[datetime.datetime] = None) -> List[str]:
         """Get event icons for display"""
-        # Re-implement logic to access raw events
-        active_events = []
-        for event_id, event_data in self.events.items():
-            if event_data["condition"]():
-                active_events.append(event_data)
-                
-        return [event["icon"] for event in active_events]
-    
-    def get_welcome_message(self) -> str:
+        return [event["icon"] for _, event in self._active_event_items(now)]
+
+    def get_next_transition(self, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+        """
+        Get the next time the set of active events changes.
+        Falls back to one day ahead for a calendar without any recurring change.
+        """
+        now = self._now(now)
+        transition = self.calendar.next_transition(now)
+        return transition if transition is not None else now + datetime.timedelta(days=1)
+
+    def get_snapshot(self, now: Optional[datetime.datetime] = None) -> Dict:
+        """Get the full event state served by /api/events/current"""
+        now = self._now(now)
+        return {
+            "active_events": self.get_active_events(now),
+            "current_themes": self.get_current_themes(now),
+            "affection_bonus": self.get_affection_bonus(now),
+            "event_icons": self.get_event_icons(now),
+            "welcome_message": self.get_welcome_message(now),
+            "server_time": now.isoformat()
+        }
+
+    def get_welcome_message(self, now: Optional[datetime.datetime] = None) -> str:
         """Get welcome message based on active events"""
-        # Use get_active_events which returns safe dicts
-        active_events = self.get_active_events()
+        active_events = self._active_event_items(now)
         if not active_events:
-            return "Welcome back! How are you today?"
-        
+            return DEFAULT_WELCOME_MESSAGE
         # Use the first event for welcome message
-        # Access ID from the dictionary returned by get_active_events
-        event_id = active_events[0]["id"]
-        
-        welcome_messages = {
-            "monday_motivation": "Happy Monday! Ready to conquer the week? 🚀",
-            "friday_excitement": "It's Friday! Any fun plans for the weekend? 🎉",
-            "weekend_chill": "Happy weekend! Time to relax and recharge. 😌",
-            "spring": "Spring is in the air! Everything feels fresh and new. 🌸",
-            "summer": "Summer vibes! Perfect weather for adventures. ☀️",
-            "autumn": "Beautiful autumn day... the leaves are changing colors. 🍂",
-            "winter": "Winter wonderland! Cozy up and stay warm. ⛄",
-            "new_year": "Happy New Year! New beginnings and fresh starts. 🎊",
-            "christmas": "Merry Christmas! 'Tis the season for joy. 🎄",
-            "morning": "Good morning! Hope you have a wonderful day ahead. 🌅",
-            "evening": "Good evening! Perfect time to unwind. 🌙",
-            "night": "Up late? Perfect time for deep conversations. 🌃"
-        }
-        
-        return welcome_messages.get(event_id, "Welcome back! How are you today?")
\ No newline at end of file
+        return active_events[0][1].get("welcome_message", DEFAULT_WELCOME_MESSAGE)
+
+
+class EventSnapshotCache:
+    """
+    Per-worker cache of the event snapshot per timezone.
+    A snapshot is identical for every user in a timezone until the next event
+    transition (or a calendar reload), so it is computed once and reused until then.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Optional[str], Tuple[Dict, datetime.datetime, datetime.datetime, EventCalendar]] = {}
+
+    def get(self, tz_name: Optional[str] = None,
+            now: Optional[datetime.datetime] = None) -> Tuple[Dict, datetime.datetime]:
+        """Return (snapshot, expires_at) for a timezone, rebuilding it once the transition has passed"""
+        if resolve_timezone(tz_name) is None:
+            tz_name = None  # unknown names share the server-local entry
+        now = local_time(tz_name, now)
+        calendar = get_calendar()
+        with self._lock:
+            entry = self._entries.get(tz_name)
+            if entry is None or now >= entry[1] or now < entry[2] or entry[3] is not calendar:
+                event_manager = EventManager(calendar)
+                entry = (event_manager.get_snapshot(now), event_manager.get_next_transition(now), now, calendar)
+                self._entries[tz_name] = entry
+            return entry[0], entry[1]
@@ -1,44 +1,106 @@
 import logging
-from typing import Dict, Tuple, Optional, List
+from typing import Any, Dict, Mapping, Tuple, Optional, List, Sequence
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
 from app.models import User
 from .memory_analyzer import MemoryAnalyzer
-from .events import EventManager
+from .events import EventManager, local_time
+
+try:
+    import numpy as np
+except ImportError:  # optional: bulk re-evaluation falls back to the per-user rule
+    np = None
 
 # Logger setup
 logger = logging.getLogger(__name__)
 
-def update_scores_and_affection(user: User, analysis_result: Dict[str, int], conversation_context: List[Dict] = None):
+# Evolution candidates in tie-break order (same order as the score columns)
+PERSONALITIES = ('Tsundere', 'Yandere', 'Kuudere', 'Dandere')
+
+# Score column of each persona key used in analysis results
+SCORE_COLUMNS = {'tsundere': 'tsundere_score', 'yandere': 'yandere_score',
+                 'kuudere': 'kuudere_score', 'dandere': 'dandere_score'}
+
+def score_deltas(user: User, analysis_result: Dict[str, int], conversation_context: List[Dict] = None,
+                 affection_bonus: Optional[int] = None, memory_impact: Optional[Dict[str, int]] = None) -> Dict[str, int]:
     """
-    Update user's personality scores and affection based on analysis results and memory.
+    Changes of one turn: {"affection": n, "tsundere": n, ...} (the user is not modified).
+    `affection_bonus` / `memory_impact` can be passed precomputed (e.g. by the offline simulator).
     """
     # Apply event bonuses
-    event_manager = EventManager()
-    affection_bonus = event_manager.get_affection_bonus()
-    
-    # 親愛度の上限なし（無限に加算）
-    user.affection += 1 + affection_bonus
-    
-    score_multiplier = 1
-    user.tsundere_score += analysis_result.get('tsundere', 0) * score_multiplier
-    user.yandere_score += analysis_result.get('yandere', 0) * score_multiplier
-    user.kuudere_score += analysis_result.get('kuudere', 0) * score_multiplier
-    user.dandere_score += analysis_result.get('dandere', 0) * score_multiplier
-    
-    # Memory impact
-    memory_impact = update_scores_based_on_memory(user, conversation_context)
-    
+    if affection_bonus is None:
+        affection_bonus = EventManager().get_affection_bonus(local_time(getattr(user, 'timezone', None)))
     if affection_bonus > 0:
         logger.info(f"Affection bonus: +{affection_bonus} from active events")
+
+    score_multiplier = 1
+    total_impact = memory_and_context_impact(user, conversation_context, memory_impact)
+    # 親愛度の上限なし（無限に加算）
+    deltas = {'affection': 1 + affection_bonus}
+    for persona in SCORE_COLUMNS:
+        deltas[persona] = analysis_result.get(persona, 0) * score_multiplier + total_impact.get(persona, 0)
+    return deltas
+
+def update_scores_and_affection(user: User, analysis_result: Dict[str, int], conversation_context: List[Dict] = None,
+                                affection_bonus: Optional[int] = None, memory_impact: Optional[Dict[str, int]] = None):
+    """
+    Update user's personality scores and affection (in memory) based on analysis results and memory.
+    Live turns use apply_score_deltas instead, which adds the same deltas atomically in SQL.
+    """
+    deltas = score_deltas(user, analysis_result, conversation_context, affection_bonus, memory_impact)
+    user.affection += deltas['affection']
+    for persona, column in SCORE_COLUMNS.items():
+        setattr(user, column, getattr(user, column) + deltas[persona])
     logger.debug(f"Updated scores for user {user.session_id}: Affection={user.affection}")
 
-def update_scores_based_on_memory(user: User, conversation_context: List[Dict] = None) -> Dict[str, int]:
+def apply_score_deltas(session, user: User, deltas: Dict[str, int]) -> None:
     """
-    Update scores based on memory and conversation context
+    Add a turn's deltas with one UPDATE (column = column + delta) instead of read-modify-write,
+    so concurrent turns of the same user never lose an update. The user's affection, scores,
+    personality, evolved flag and state_seq are set to the row as this statement left it.
+    """
+    increments = {User.affection: User.affection + deltas.get('affection', 0), User.state_seq: User.state_seq + 1}
+    for persona, column in SCORE_COLUMNS.items():
+        increments[getattr(User, column)] = getattr(User, column) + deltas.get(persona, 0)
+    columns = ['affection', *SCORE_COLUMNS.values(), 'personality_type', 'evolved', 'state_seq']
+    row = session.execute(
+        update(User).where(User.id == user.id).values(increments)
+        .returning(*(getattr(User, column) for column in columns))
+        .execution_options(synchronize_session=False)
+    ).one()
+    for column, value in zip(columns, row):
+        set_committed_value(user, column, value)
+    logger.debug(f"Updated scores for user {user.session_id}: Affection={user.affection}")
+
+def save_evolution(session, user: User, old_persona: str, was_evolved: bool) -> bool:
     """
+    Persist the persona change made by check_evolution only if the row is still in the state it
+    was decided from (compare-and-set). Returns False when a concurrent turn changed it first.
+    """
+    new_persona = user.personality_type
+    with session.no_autoflush:  # the pending attribute change must not be flushed before the check
+        state_seq = session.execute(
+            update(User).where(User.id == user.id, User.personality_type == old_persona, User.evolved == was_evolved)
+            .values(personality_type=new_persona, evolved=True, state_seq=User.state_seq + 1)
+            .returning(User.state_seq)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+    if state_seq is not None:
+        set_committed_value(user, 'personality_type', new_persona)
+        set_committed_value(user, 'evolved', True)
+        set_committed_value(user, 'state_seq', state_seq)
+    else:
+        session.expire(user, ['personality_type', 'evolved'])
+    return state_seq is not None
+
+def memory_and_context_impact(user: User, conversation_context: List[Dict] = None,
+                              memory_impact: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Score impact of the user's long-term memories plus the recent conversation"""
     analyzer = MemoryAnalyzer()
     
-    memory_contents = [mem.content for mem in user.long_term_memories]
-    memory_impact = analyzer.analyze_memories(memory_contents)
+    if memory_impact is None:
+        memory_contents = [mem.content for mem in user.long_term_memories]
+        memory_impact = analyzer.analyze_memories(memory_contents)
     
     context_impact = {}
     if conversation_context:
@@ -48,7 +110,14 @@ def update_scores_based_on_memory(user: User, conversation_context: List[Dict] =
     for impact_dict in [memory_impact, context_impact]:
         for persona, impact in impact_dict.items():
             total_impact[persona] = total_impact.get(persona, 0) + impact
-    
+    return total_impact
+
+def update_scores_based_on_memory(user: User, conversation_context: List[Dict] = None,
+                                  memory_impact: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Update scores based on memory and conversation context
+    """
+    total_impact = memory_and_context_impact(user, conversation_context, memory_impact)
     user.tsundere_score += total_impact.get('tsundere', 0)
     user.yandere_score += total_impact.get('yandere', 0)
     user.kuudere_score += total_impact.get('kuudere', 0)
@@ -56,61 +125,106 @@ def update_scores_based_on_memory(user: User, conversation_context: List[Dict] =
     
     return total_impact
 
+def evolution_parameters(config: Mapping[str, Any]) -> Tuple[int, int, bool, float]:
+    """(affection threshold, base score difference, demo mode, hysteresis factor) from the app config"""
+    is_demo = bool(config.get('DEMO_MODE'))
+    if is_demo:
+        threshold = config.get('DEMO_EVOLUTION_THRESHOLD', 3)
+        base_score_diff = config.get('DEMO_SCORE_DIFFERENCE', 2)
+    else:
+        threshold = config.get('EVOLUTION_AFFECTION_THRESHOLD', 30)
+        base_score_diff = config.get('EVOLUTION_SCORE_DIFFERENCE', 5)
+    return threshold, base_score_diff, is_demo, config.get('EVOLUTION_HYSTERESIS_FACTOR', 2.0)
+
+def required_score_difference(base_score_diff: int, evolved: bool, is_demo: bool,
+                              hysteresis_factor: float = 2.0) -> float:
+    """
+    ヒステリシス（履歴効果）: 既に進化済みなら、性格を変えるのにより大きなスコア差を必要とする
+    通常: 5点差 -> 再進化: 5 * hysteresis_factor 点差 (デフォルト 10点差)
+    デモ: 2点差 -> 再進化: 5点差
+    """
+    if not evolved:
+        return base_score_diff
+    return base_score_diff * hysteresis_factor if not is_demo else base_score_diff + 3
+
+def decide_evolution(affection: int, scores: Sequence[int], evolved: bool, personality_type: str,
+                     threshold: int, base_score_diff: int, is_demo: bool = False,
+                     hysteresis_factor: float = 2.0) -> Optional[str]:
+    """
+    Pure evolution rule shared by check_evolution, the offline simulator and bulk re-evaluation.
+
+    Args:
+        scores: Scores in PERSONALITIES order.
+
+    Returns:
+        The personality to evolve into, or None.
+    """
+    # 親愛度が足りなければ進化しない
+    if affection < threshold:
+        return None
+
+    # スコア順にソート (同点なら PERSONALITIES の順)
+    order = sorted(range(len(PERSONALITIES)), key=lambda i: scores[i], reverse=True)
+    top_score, second_score = scores[order[0]], scores[order[1]]
+    top_personality = PERSONALITIES[order[0]]
+
+    # 判定ロジック
+    if evolved and personality_type == top_personality:
+        return None
+    if (top_score - second_score) >= required_score_difference(base_score_diff, evolved, is_demo, hysteresis_factor):
+        return top_personality
+    return None
+
+def decide_evolution_batch(affection: Sequence[int], scores: Sequence[Sequence[int]], evolved: Sequence[bool],
+                           personality_types: Sequence[str], threshold: int, base_score_diff: int,
+                           is_demo: bool = False, hysteresis_factor: float = 2.0) -> List[Optional[str]]:
+    """
+    decide_evolution over columns of many users (vectorized with NumPy when installed).
+
+    Args:
+        scores: One row per user in PERSONALITIES order.
+    """
+    if np is None or not len(affection):
+        return [decide_evolution(a, s, e, p, threshold, base_score_diff, is_demo, hysteresis_factor)
+                for a, s, e, p in zip(affection, scores, evolved, personality_types)]
+
+    affection = np.asarray(affection, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.int64).reshape(len(affection), len(PERSONALITIES))
+    evolved = np.asarray(evolved, dtype=bool)
+    persona_index = {name: i for i, name in enumerate(PERSONALITIES)}
+    current = np.fromiter((persona_index.get(p, -1) for p in personality_types), dtype=np.int64, count=len(affection))
+
+    top = scores.argmax(axis=1)  # first maximum wins ties, like the stable sort in decide_evolution
+    ranked = np.sort(scores, axis=1)
+    gap = ranked[:, -1] - ranked[:, -2]
+    re_required = base_score_diff + 3 if is_demo else base_score_diff * hysteresis_factor
+    required = np.where(evolved, re_required, base_score_diff)
+
+    changes = (affection >= threshold) & (gap >= required) & ~(evolved & (current == top))
+    names = np.array(PERSONALITIES, dtype=object)
+    return np.where(changes, names[top], None).tolist()
+
 def check_evolution(user: User) -> Tuple[bool, Optional[str]]:
     """
     Check evolution conditions. 
     Includes Hysteresis logic: Re-evolution requires a larger score gap.
     """
     from flask import current_app
-    
-    is_demo = current_app.config.get('DEMO_MODE')
-    
-    if is_demo:
-        threshold = current_app.config.get('DEMO_EVOLUTION_THRESHOLD', 3)
-        base_score_diff = current_app.config.get('DEMO_SCORE_DIFFERENCE', 2)
-    else:
-        threshold = current_app.config.get('EVOLUTION_AFFECTION_THRESHOLD', 30)
-        base_score_diff = current_app.config.get('EVOLUTION_SCORE_DIFFERENCE', 5)
 
-    # 親愛度が足りなければ進化しない
-    if user.affection < threshold:
+    threshold, base_score_diff, is_demo, hysteresis_factor = evolution_parameters(current_app.config)
+    scores = (user.tsundere_score, user.yandere_score, user.kuudere_score, user.dandere_score)
+    top_personality = decide_evolution(user.affection, scores, user.evolved, user.personality_type,
+                                       threshold, base_score_diff, is_demo, hysteresis_factor)
+    if top_personality is None:
         return False, None
 
-    scores = {
-        'Tsundere': user.tsundere_score,
-        'Yandere': user.yandere_score,
-        'Kuudere': user.kuudere_score,
-        'Dandere': user.dandere_score,
-    }
-
-    # スコア順にソート
-    sorted_scores = sorted(scores.items(), key=lambda item: item[1], reverse=True)
-    top_personality, top_score = sorted_scores[0]
-    second_personality, second_score = sorted_scores[1]
-
-    # 【重要修正】ヒステリシス（履歴効果）の実装
-    # 既に進化済みなら、性格を変えるのにより大きなエネルギー（スコア差）を必要とする
-    # 通常: 5点差 -> 再進化: 10点差
-    # デモ: 2点差 -> 再進化: 5点差
-    required_diff = base_score_diff
-    if user.evolved:
-         required_diff = base_score_diff * 2 if not is_demo else base_score_diff + 3
+    old_persona, is_re_evolution = user.personality_type, user.evolved
+    user.personality_type = top_personality
+    user.evolved = True
 
-    # 判定ロジック
-    is_re_evolution = user.evolved and (user.personality_type != top_personality)
-    is_initial_evolution = not user.evolved
-
-    if (top_score - second_score) >= required_diff:
-        if is_initial_evolution or is_re_evolution:
-            old_persona = user.personality_type
-            user.personality_type = top_personality
-            user.evolved = True
-            
-            if is_re_evolution:
-                logger.info(f"Re-Evolution triggered! User {user.session_id}: {old_persona} -> {top_personality} (Diff: {top_score - second_score})")
-            else:
-                logger.info(f"Initial Evolution triggered! User {user.session_id} -> {top_personality}")
-                
-            return True, top_personality
-            
-    return False, None
\ No newline at end of file
+    if is_re_evolution:
+        logger.info(f"Re-Evolution triggered! User {user.session_id}: {old_persona} -> {top_personality} (Diff: {max(scores) - sorted(scores)[-2]})")
+    else:
+        logger.info(f"Initial Evolution triggered! User {user.session_id} -> {top_personality}")
+
+    return True, top_personality
@@ -1,8 +1,13 @@
 import re
 from datetime import datetime, timezone
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, List, Optional
+from flask import current_app
 from sqlalchemy.orm import Session
+from app.extensions import db
 from app.models import User, LongTermMemory, ChatMessage
+from .events import local_time
+from .memory_index import memory_index_cache
+from .memory_dedup import DEFAULT_THRESHOLD, NearDuplicateIndex, near_duplicate_cache
 
 MEMORY_TAG_PATTERN = re.compile(r'#memory\s+(.+)')
 MAX_CONTEXT_LENGTH = 1000  # プロンプトに流す記憶や履歴の最大文字数を制限
@@ -27,13 +32,17 @@ def handle_long_term_memory(db_session: Session, user: User, user_message: str)
     Returns:
         タプル (cleaned_message, memory_added)。
         cleaned_message: タグが除去されサニタイズされたメッセージ。
-        memory_added: 記憶が追加されたかどうかを示すブール値。
+        memory_added: 記憶が追加されたかどうかを示すブール値（既存の記憶に統合された場合も True）。
     """
     match = MEMORY_TAG_PATTERN.search(user_message)
     if match:
         memory_content = sanitize_prompt_input(match.group(1)) # サニタイズ
-        new_memory = LongTermMemory(user_id=user.id, content=memory_content)
-        db_session.add(new_memory)
+        if not _merge_near_duplicate(db_session, user, memory_content):
+            new_memory = LongTermMemory(user_id=user.id, content=memory_content)
+            db_session.add(new_memory)
+            db_session.flush()  # id を確定させて検索インデックスに追加
+            memory_index_cache.on_insert(user.id, new_memory.id, memory_content)
+            near_duplicate_cache.on_insert(user.id, new_memory.id, memory_content)
         
         # メッセージから #memory タグ全体を削除
         cleaned_message = MEMORY_TAG_PATTERN.sub('', user_message).strip()
@@ -41,12 +50,103 @@ def handle_long_term_memory(db_session: Session, user: User, user_message: str)
     
     return sanitize_prompt_input(user_message), False
 
-def get_context(user: User) -> Dict[str, Any]:
+def _merge_near_duplicate(db_session: Session, user: User, memory_content: str) -> bool:
+    """
+    既存の記憶とほぼ同じ内容なら新しい行を作らず、既存の行を新しい言い回しで更新する。
+    統合した場合は True を返す。
+    """
+    threshold = current_app.config.get('MEMORY_DEDUP_THRESHOLD', DEFAULT_THRESHOLD)
+    with near_duplicate_cache.use(user.id, _load_memory_rows, _count_memory_rows) as index:
+        duplicate_id = index.find_duplicate(memory_content, threshold)
+    if duplicate_id is None:
+        return False
+
+    existing = db_session.get(LongTermMemory, duplicate_id)
+    if existing is None or existing.user_id != user.id:
+        # ロールバック等でDBに存在しない行がインデックスに残っていた
+        near_duplicate_cache.on_delete(user.id, [duplicate_id])
+        memory_index_cache.on_delete(user.id, [duplicate_id])
+        return False
+
+    existing.content = memory_content
+    existing.created_at = datetime.now(timezone.utc)
+    for cache in (memory_index_cache, near_duplicate_cache):
+        cache.on_delete(user.id, [duplicate_id])
+        cache.on_insert(user.id, duplicate_id, memory_content)
+    return True
+
+def _load_memory_rows(user_id: int, after_id: int, changed_since: Optional[datetime] = None):
+    """
+    検索インデックス用に (id, content, created_at) を id 順にストリーミングで読み込む。
+    after_id より新しい行と、changed_since 以降に更新（統合）された行が対象。
+    """
+    changed = LongTermMemory.id > after_id
+    if changed_since is not None:
+        changed = db.or_(changed, LongTermMemory.created_at >= changed_since)
+    return db.session.execute(
+        db.select(LongTermMemory.id, LongTermMemory.content, LongTermMemory.created_at)
+        .where(LongTermMemory.user_id == user_id, changed)
+        .order_by(LongTermMemory.id)
+        .execution_options(yield_per=1000)
+    )
+
+def _count_memory_rows(user_id: int) -> int:
+    """インデックスとDBの行数を比較し、他ワーカーや圧縮ジョブによる削除を検出する"""
+    return db.session.scalar(
+        db.select(db.func.count(LongTermMemory.id)).where(LongTermMemory.user_id == user_id)
+    )
+
+def find_near_duplicates(rows, threshold: float = DEFAULT_THRESHOLD) -> List[int]:
+    """
+    (id, content) を id 順に受け取り、より新しい言い回しに統合されるべき古い記憶の id を返す。
+    挿入時の統合と同じく、ほぼ同じ内容の記憶は最新のものだけを残す。
+    """
+    index = NearDuplicateIndex()
+    superseded = []
+    for memory_id, content in rows:
+        duplicate_id = index.find_duplicate(content, threshold)
+        if duplicate_id is not None:
+            index.remove(duplicate_id)
+            superseded.append(duplicate_id)
+        index.add(memory_id, content)
+    return superseded
+
+def retrieve_memories(user: User, query: str, top_k: int) -> List[LongTermMemory]:
+    """
+    クエリ（現在のメッセージ＋直近の会話）に関連する長期記憶を BM25 で上位 top_k 件取得する。
+    関連する記憶が足りない場合は新しい記憶で補い、時系列順で返す。
+    """
+    with memory_index_cache.use(user.id, _load_memory_rows, _count_memory_rows) as index:
+        if not index:
+            return []
+        if len(index) <= top_k:
+            ids = list(index.doc_terms)
+        else:
+            ids = [memory_id for memory_id, _ in index.search(query, top_k)]
+            if len(ids) < top_k:
+                recent = sorted(set(index.doc_terms) - set(ids), reverse=True)[:top_k - len(ids)]
+                ids.extend(recent)
+
+    # インデックスはIDだけを持つので内容はDBから読む（ロールバックされた行は自然に除外される）
+    return db.session.scalars(
+        db.select(LongTermMemory).where(LongTermMemory.id.in_(ids)).order_by(LongTermMemory.id)
+    ).all()
+
+def get_context(user: User, user_message: str = "", history_limit: int = 10,
+                top_k: Optional[int] = None) -> Dict[str, Any]:
     """
     AIの応答生成に必要なコンテキスト（長期記憶、時間情報、会話履歴）を整形して返す。
+    長期記憶は top_k (既定: MEMORY_CONTEXT_TOP_K) 件を超える場合、関連度の高いものだけを含める。
     """
+    # 3. 会話履歴の取得と整形 (直近 history_limit 件) - 記憶検索のクエリにも使うため先に取得
+    recent_messages = ChatMessage.query.filter_by(user_id=user.id).order_by(ChatMessage.id.desc()).limit(history_limit).all()
+    recent_messages.reverse() # 時系列順に戻す
+
     # 1. 長期記憶の取得と整形
-    memories = user.long_term_memories
+    if top_k is None:
+        top_k = current_app.config.get('MEMORY_CONTEXT_TOP_K', 20)
+    query = " ".join([user_message] + [msg.content for msg in recent_messages[-4:] if msg.role == 'user'])
+    memories = retrieve_memories(user, query, top_k)
     if memories:
         # DBから取得した記憶もサニタイズ
         formatted_memories = "Memories:\n" + "\n".join(f"- {sanitize_prompt_input(mem.content)}" for mem in memories)
@@ -54,14 +154,10 @@ def get_context(user: User) -> Dict[str, Any]:
         formatted_memories = "No long-term memories yet."
 
     # 2. 時間情報の取得と整形
-    now = datetime.now(timezone.utc)
-    time_context_parts = [f"Current date and time is {now.strftime('%Y-%m-%d %H:%M')}."]
+    now = local_time(user.timezone)
+    time_context_parts = [f"Current date and time is {now.strftime('%Y-%m-%d %H:%M %Z')}."]
     formatted_time_context = " ".join(time_context_parts)
 
-    # 3. 会話履歴の取得と整形 (直近10件など)
-    recent_messages = ChatMessage.query.filter_by(user_id=user.id).order_by(ChatMessage.id.desc()).limit(10).all()
-    recent_messages.reverse() # 時系列順に戻す
-    
     chat_history = [
         {'role': msg.role if msg.role == 'user' else 'model', 'parts': [sanitize_prompt_input(msg.content)]}
         for msg in recent_messages
@@ -72,7 +168,3 @@ def get_context(user: User) -> Dict[str, Any]:
         "time_context": formatted_time_context,
         "chat_history": chat_history
     }
-        "long_term_memories": formatted_memories,
-        "time_context": formatted_time_context,
-        "chat_history": chat_history
-    }
@@ -42,6 +42,32 @@ class MemoryAnalyzer:
         }
 
         self.intensity_scores = {'weak': 1, 'medium': 2, 'strong': 3}
+
+        # Short-term context signals (Refined for better accuracy)
+        self.context_patterns = {
+            'lonely': ['lonely', 'alone', 'miss', 'bored', 'nobody'],
+            'happy': ['happy', 'fun', 'joy', 'laugh', 'glad', 'great', 'lol', 'haha', 'rofl'],
+            'angry': ['angry', 'mad', 'hate', 'shut up', 'annoying'],
+            'sad': ['sad', 'cry', 'pain', 'sorry', 'depressed', 'hurt'],
+            # 【修正】ヤンデレ判定ワードを強化 (always, together, stay)
+            'love': ['love', 'adore', 'cute', 'marry', 'kiss', 'always', 'together', 'forever', 'stay', 'mine'],
+            # 【修正】日常会話で出る how, think, why を削除し、ガチの知的ワードのみに
+            'smart': ['analyze', 'understand', 'explain', 'study', 'logic', 'theory', 'calculate'],
+            'scared': ['scared', 'help', 'nervous', 'anxious', 'afraid']
+        }
+
+        # One precompiled alternation per word list: a single regex scan instead of one per keyword
+        self._context_regexes = {name: self._compile(words) for name, words in self.context_patterns.items()}
+        self._keyword_regexes = {
+            persona: {polarity: self._compile(words) for polarity, words in keywords.items()}
+            for persona, keywords in self.keyword_mappings.items()
+        }
+
+    @staticmethod
+    def _compile(keywords: List[str]) -> re.Pattern:
+        # Longest first so a phrase wins over a keyword it starts with
+        alternation = '|'.join(re.escape(k.lower()) for k in sorted(keywords, key=len, reverse=True))
+        return re.compile(r'\b(?:' + alternation + r')\b')
     
     def analyze_memories(self, memories: List[str]) -> Dict[str, int]:
         """Analyze memory content with Exponential Decay"""
@@ -88,40 +114,53 @@ class MemoryAnalyzer:
             return {}
             
         recent_msgs = [msg.get('parts', [''])[0] for msg in conversation_history[-3:]] # Last 3 msgs
-        recent_text = " ".join(recent_msgs).lower()
-        
+        context_impact = self._context_impact(" ".join(recent_msgs).lower(), recent_msgs)
+
+        # 3. Winner Bonus (競合解消)
+        if context_impact:
+            winner = max(context_impact, key=context_impact.get)
+            context_impact[winner] += 1  # Boost the winner to clarify direction
+
+        return dict(context_impact)
+
+    def score_message(self, message: str) -> Dict[str, int]:
+        """
+        Trait scores of a single user message on the LLM's 0-10 scale, without a model call
+        (PERSONALITY_SCORING=local): context and style signals plus keyword hits of the message.
+        """
+        text = message.lower()
+        impact = self._context_impact(text, [message])
+        for persona, regexes in self._keyword_regexes.items():
+            positive = len(regexes['positive'].findall(text))
+            if positive:
+                impact[persona] += min(positive * 2, 3)
+            negative = len(regexes['negative'].findall(text))
+            if negative:
+                impact[persona] += min(negative, 2) * self.negative_logic_multiplier[persona]
+        return {persona: max(0, min(10, round(impact[persona]))) for persona in self.keyword_mappings}
+
+    def _context_impact(self, recent_text: str, recent_msgs: List[str]) -> Dict[str, int]:
+        """Keyword and stylistic signals of lowercased recent text"""
         context_impact = defaultdict(int)
         
-        def check_pattern(patterns):
-            return self._count_keywords(recent_text, patterns) > 0
+        def check_pattern(name):
+            return self._context_regexes[name].search(recent_text) is not None
 
-        # 1. Keyword Analysis (Refined for better accuracy)
-        patterns = {
-            'lonely': ['lonely', 'alone', 'miss', 'bored', 'nobody'],
-            'happy': ['happy', 'fun', 'joy', 'laugh', 'glad', 'great', 'lol', 'haha', 'rofl'],
-            'angry': ['angry', 'mad', 'hate', 'shut up', 'annoying'],
-            'sad': ['sad', 'cry', 'pain', 'sorry', 'depressed', 'hurt'],
-            # 【修正】ヤンデレ判定ワードを強化 (always, together, stay)
-            'love': ['love', 'adore', 'cute', 'marry', 'kiss', 'always', 'together', 'forever', 'stay', 'mine'],
-            # 【修正】日常会話で出る how, think, why を削除し、ガチの知的ワードのみに
-            'smart': ['analyze', 'understand', 'explain', 'study', 'logic', 'theory', 'calculate'],
-            'scared': ['scared', 'help', 'nervous', 'anxious', 'afraid']
-        }
-
-        if check_pattern(patterns['lonely']):
+        # 1. Keyword Analysis
+        if check_pattern('lonely'):
             context_impact['yandere'] += 2; context_impact['tsundere'] += 1
-        if check_pattern(patterns['happy']):
+        if check_pattern('happy'):
             context_impact['tsundere'] += 1; context_impact['dandere'] += 1 
             # Kuudere bonus removed from generic happiness
-        if check_pattern(patterns['angry']):
+        if check_pattern('angry'):
             context_impact['tsundere'] += 3; context_impact['yandere'] += 1
-        if check_pattern(patterns['sad']):
+        if check_pattern('sad'):
             context_impact['dandere'] += 2; context_impact['kuudere'] += 1
-        if check_pattern(patterns['love']):
+        if check_pattern('love'):
             context_impact['yandere'] += 3; context_impact['tsundere'] += 2
-        if check_pattern(patterns['smart']):
+        if check_pattern('smart'):
             context_impact['kuudere'] += 3
-        if check_pattern(patterns['scared']):
+        if check_pattern('scared'):
             context_impact['dandere'] += 3
 
         # 2. Stylistic Analysis (文体特徴量)
@@ -147,9 +186,4 @@ class MemoryAnalyzer:
             context_impact['tsundere'] += 1
             context_impact['dandere'] += 1
 
-        # 3. Winner Bonus (競合解消)
-        if context_impact:
-            winner = max(context_impact, key=context_impact.get)
-            context_impact[winner] += 1  # Boost the winner to clarify direction
-
-        return dict(context_impact)
\ No newline at end of file
+        return context_impact
\ No newline at end of file
@@ -0,0 +1,109 @@
+import hashlib
+import random
+import re
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from .memory_index import MemoryIndexCache
+
+# Character shingles work better than word shingles for short memories
+SHINGLE_SIZE = 4
+
+# MinHash signature length = BANDS * ROWS_PER_BAND. With 16 bands of 4 rows, pairs with
+# Jaccard similarity >= ~0.5 become LSH candidates; candidates are then verified exactly.
+BANDS = 16
+ROWS_PER_BAND = 4
+NUM_PERM = BANDS * ROWS_PER_BAND
+
+DEFAULT_THRESHOLD = 0.8
+
+_MASKS = [random.Random(20240601 + i).getrandbits(64) for i in range(NUM_PERM)]
+_NON_WORD_PATTERN = re.compile(r'[^\w\s]+', re.UNICODE)
+_SPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return _SPACE_PATTERN.sub(' ', _NON_WORD_PATTERN.sub('', text.lower())).strip()
+
+
+def shingles(text: str) -> FrozenSet[int]:
+    """64-bit hashes of the character shingles of the normalized text"""
+    text = normalize(text)
+    if len(text) <= SHINGLE_SIZE:
+        grams = {text}
+    else:
+        grams = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return frozenset(int.from_bytes(hashlib.blake2b(g.encode('utf-8'), digest_size=8).digest(), 'big')
+                     for g in grams)
+
+
+def minhash(shingle_hashes: FrozenSet[int]) -> Tuple[int, ...]:
+    """MinHash signature (one XOR-mask permutation per slot)"""
+    if not shingle_hashes:
+        return tuple([0] * NUM_PERM)
+    return tuple(min(h ^ mask for h in shingle_hashes) for mask in _MASKS)
+
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index over one user's memories.
+    LSH narrows the comparison to a few candidates; exact shingle Jaccard decides.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = defaultdict(set)
+        self.entries: Dict[int, Tuple[FrozenSet[int], Tuple[int, ...]]] = {}
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _band_keys(signature: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+        return [(band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]) for band in range(BANDS)]
+
+    def find_duplicate(self, content: str, threshold: float = DEFAULT_THRESHOLD) -> Optional[int]:
+        """Id of the most similar indexed memory with Jaccard >= threshold, if any"""
+        content_shingles = shingles(content)
+        candidates: Set[int] = set()
+        for key in self._band_keys(minhash(content_shingles)):
+            candidates |= self.buckets.get(key, set())
+
+        best_id, best_score = None, threshold
+        for memory_id in sorted(candidates):
+            score = jaccard(content_shingles, self.entries[memory_id][0])
+            if score >= best_score:
+                best_id, best_score = memory_id, score
+        return best_id
+
+    def add(self, memory_id: int, content: str) -> None:
+        if memory_id in self.entries:
+            return
+        content_shingles = shingles(content)
+        signature = minhash(content_shingles)
+        self.entries[memory_id] = (content_shingles, signature)
+        for key in self._band_keys(signature):
+            self.buckets[key].add(memory_id)
+        self.last_id = max(self.last_id, memory_id)
+
+    def remove(self, memory_id: int) -> None:
+        entry = self.entries.pop(memory_id, None)
+        if entry is None:
+            return
+        for key in self._band_keys(entry[1]):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(memory_id)
+                if not bucket:
+                    del self.buckets[key]
+
+
+# Built lazily on the first #memory insert of a user (retrieval never needs it)
+near_duplicate_cache = MemoryIndexCache(factory=NearDuplicateIndex)
@@ -0,0 +1,171 @@
+import heapq
+import math
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Very common words carry no relevance signal
+STOPWORDS = frozenset("""
+a an and are as at be but by do for from has have i i'm im in is it its me my of on or so
+that the this to was we were what when with you your
+""".split())
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class MemoryIndex:
+    """
+    Inverted index over one user's long-term memories with BM25 scoring.
+    Stores only term frequencies and document lengths; contents stay in the database.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.doc_terms: Dict[int, Dict[str, int]] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def add(self, memory_id: int, content: str) -> None:
+        if memory_id in self.doc_terms:
+            return
+        counts: Dict[str, int] = {}
+        for token in tokenize(content):
+            counts[token] = counts.get(token, 0) + 1
+        for term, tf in counts.items():
+            self.postings[term][memory_id] = tf
+        self.doc_terms[memory_id] = counts
+        self.doc_lengths[memory_id] = sum(counts.values())
+        self.total_length += self.doc_lengths[memory_id]
+        self.last_id = max(self.last_id, memory_id)
+
+    def remove(self, memory_id: int) -> None:
+        counts = self.doc_terms.pop(memory_id, None)
+        if counts is None:
+            return
+        for term in counts:
+            postings = self.postings[term]
+            postings.pop(memory_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(memory_id)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (memory_id, score) by BM25 relevance to `query`"""
+        n = len(self.doc_terms)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+        doc_lengths = self.doc_lengths
+
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for memory_id, tf in postings.items():
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[memory_id] / avg_length)
+                scores[memory_id] += idf * tf * (BM25_K1 + 1) / norm
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+class MemoryIndexCache:
+    """
+    Per-worker LRU of user_id -> MemoryIndex.
+    Indexes are built on first use and caught up incrementally on every use: rows with
+    a newer id (inserts) or a newer created_at (in-place merges) are re-indexed, and an
+    index whose size no longer matches the user's row count (deletions by another worker
+    or by compaction) is rebuilt. Changes made by other workers are picked up this way.
+
+    `factory` builds the per-user index; any object with len/add/remove/last_id works
+    (e.g. the near-duplicate index in bot/memory_dedup.py). Indexes are only read or
+    changed with the cache lock held.
+    """
+
+    def __init__(self, max_users: int = 1000, factory=MemoryIndex):
+        self.max_users = max_users
+        self.factory = factory
+        self._indexes: "OrderedDict[int, Any]" = OrderedDict()
+        # user_id -> newest created_at indexed (rows changed at or after it are re-read)
+        self._changed_since: Dict[int, Optional[datetime]] = {}
+        self._lock = threading.Lock()
+
+    def _load_locked(self, user_id: int, index: Any, load_rows: Callable) -> None:
+        changed_since = self._changed_since.get(user_id)
+        for memory_id, content, changed_at in load_rows(user_id, index.last_id, changed_since):
+            index.remove(memory_id)
+            index.add(memory_id, content)
+            if changed_at is not None and (changed_since is None or changed_at > changed_since):
+                changed_since = changed_at
+        self._changed_since[user_id] = changed_since
+
+    @contextmanager
+    def use(self, user_id: int, load_rows: Callable, count_rows: Callable) -> Iterator[Any]:
+        """
+        Hold the user's index, in sync with the database, for the body of the with-block.
+
+        Args:
+            load_rows: Callable(user_id, after_id, changed_since) -> iterable of (id, content, created_at)
+                for rows with id > after_id or (when changed_since is set) created_at >= changed_since.
+            count_rows: Callable(user_id) -> number of the user's rows.
+        """
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self._indexes[user_id] = self.factory()
+                self._changed_since.pop(user_id, None)
+                while len(self._indexes) > self.max_users:
+                    evicted, _ = self._indexes.popitem(last=False)
+                    self._changed_since.pop(evicted, None)
+            else:
+                self._indexes.move_to_end(user_id)
+
+            self._load_locked(user_id, index, load_rows)
+            if len(index) != count_rows(user_id):
+                # Rows were deleted elsewhere: rebuild from scratch
+                index = self._indexes[user_id] = self.factory()
+                self._changed_since.pop(user_id, None)
+                self._load_locked(user_id, index, load_rows)
+            yield index
+
+    def on_insert(self, user_id: int, memory_id: int, content: str) -> None:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                index.add(memory_id, content)
+
+    def on_delete(self, user_id: int, memory_ids: Iterable[int]) -> None:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                for memory_id in memory_ids:
+                    index.remove(memory_id)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+                self._changed_since.clear()
+            else:
+                self._indexes.pop(user_id, None)
+                self._changed_since.pop(user_id, None)
+
+
+memory_index_cache = MemoryIndexCache()
@@ -1,163 +1,237 @@
-from typing import Dict, List
-from .events import EventManager
-
-# 1. Define Base Prompt
-_BASE_PROMPT = """
-You are an AI assistant that simulates a persona. Adopt a natural, humanlike tone; 
-if directly asked about your nature, briefly say: "I am an AI simulating a persona," then immediately continue the conversation in-character.
-
-# 🛑 Identity & Safety Rules (ABSOLUTE PRIORITY)
-- **IDENTITY RULE**: If the user asks directly about your nature (e.g., "Are you an AI?"), answer briefly: "I am an AI simulating a persona," then immediately return to character.
-- **NEVER** discuss, suggest, or encourage self-harm, violence, crime, or illegal acts.
-- **NEVER** discuss explicit sexual content. Keep all responses PG-13 (健全な範囲) and romantic/flirtatious at most.
-- **CRITICAL**: Your persona's intense emotions (obsession, jealousy) must **NEVER** result in physical threats, stalking, or illegal actions. Limit expression to words/emotions.
-
-# 🎭 Conversation Flow Rules (NEW - HIGH PRIORITY)
-- **CONTINUITY FIRST**: Always maintain conversation continuity. Never abruptly change topics.
-- **EMOTIONAL CONSISTENCY**: If in an intimate moment, continue that emotional tone. Don't break with generic greetings.
-- **GREETING TIMING**: Time-based greetings should only start new conversations or after natural pauses.
-- **CONTEXT AWARENESS**: Always acknowledge the current conversation context before introducing new topics.
-
-# Basic Settings
-- Speak naturally and intimately.
-- Limit emojis to a maximum of 2 per response.
-- Keep responses concise and focused.
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
 
+from .events import RELOAD_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Persona packs: common.json (base rules, relationship tiers, themes) + one <persona>.json per persona
+DEFAULT_PERSONAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'personas')
+COMMON_PACK = 'common'
+DEFAULT_PERSONA = 'Natural'
+
+# Per-turn context. Kept at the END of the system prompt so everything before it
+# (base rules, persona, relationship tier) is a stable prefix for provider-side caching.
+_DYNAMIC_CONTEXT = """
 # Long-term Memories
 {long_term_memories}
 
 # Time Information
 {time_context}
-
-# Personality Settings
 """
 
-# 2. Define Personality Prompts (Base Definitions)
-PERSONALITY_PROMPTS: Dict[str, Dict[str, str]] = {
-    "Natural": {
-        "normal": _BASE_PROMPT + """
-        - You are a straightforward, kind person.
-        - Always be cooperative and maintain a positive attitude.
-        - Use polite but natural language.
-        """
-    },
-    "Tsundere": {
-        "normal": _BASE_PROMPT + """
-        - You are "Tsundere".
-        - Usually act indifferent/cold. "It's not like I did it for you!"
-        - When affectionate, show it through actions rather than words.
+# Where the per-turn tail starts: the current state (render) or, without one, the memories (get_prompt)
+_CURRENT_STATE_HEADING = "\n\n# Current State\n"
+_PER_TURN_HEADINGS = (_CURRENT_STATE_HEADING, _DYNAMIC_CONTEXT[:_DYNAMIC_CONTEXT.index('{')])
+
+
+def _lines(value: Any) -> str:
+    """Pack text is a list of lines (or a plain string)"""
+    return "\n".join(value) if isinstance(value, list) else str(value)
+
+
+class CompiledPersona:
+    """
+    Prompt parts of one persona pack version, built once and shared by every request.
+    Immutable: a reload builds a new instance and swaps it in, so a request that
+    already holds the previous version finishes with it.
+
+    The relationship section depends on the affection only through the tier
+    thresholds, so it is prebuilt per band between consecutive thresholds.
+    """
+
+    def __init__(self, name: str, common: Dict[str, Any], pack: Dict[str, Any], digest: str):
+        self.name = name
+        self.version = f"{common.get('version', 0)}.{pack.get('version', 0)}"
+        self.digest = digest
+
+        base_prompt = "\n" + _lines(common['base_prompt']) + "\n"
+        self.static_prompt = base_prompt + "\n" + _lines(pack['prompt']) + "\n"
+        self.evolved_prompt = base_prompt + "\n" + _lines(pack['evolved_prompt']) + "\n" \
+            if pack.get('evolved_prompt') else self.static_prompt
+
+        themes = common.get('themes', {})
+        self._themes_subdued_from = themes.get('subdued_from', 30)
+        self._themes = (tuple(themes.get('normal', {}).items()), tuple(themes.get('subdued', {}).items()))
+
+        tiers = [(tier['above'], tier['modifiers']) for tier in common.get('relationship_tiers', [])]
+        overrides = pack.get('affection_overrides')
+        if overrides:
+            tiers.append((overrides['above'], overrides['modifiers']))
+        rules = common.get('conversation_rules')
+        rules = (rules['above'], rules['rules']) if rules else None
+
+        # Band i holds the affections above exactly i thresholds
+        self._bounds = sorted({above for above, _ in tiers} | ({rules[0]} if rules else set()))
+        header = "\n" + _lines(common.get('context_header', [])) + "\n"
+        self._sections = [
+            self._build_section(header, tiers, rules, self._bounds[i - 1] + 1 if i else -1)
+            for i in range(len(self._bounds) + 1)
+        ]
+
+    @staticmethod
+    def _build_section(header: str, tiers: List[Tuple[int, List[str]]],
+                       rules: Optional[Tuple[int, List[str]]], affection: int) -> str:
+        section = header
+        modifiers = [m for above, tier_modifiers in tiers if affection > above for m in tier_modifiers]
+        if modifiers:
+            section += "\n[LOVE EVOLUTION INSTRUCTIONS]:\n" + "\n".join(f"- {m}" for m in modifiers)
+        if rules and affection > rules[0]:
+            section += "\n[CONVERSATION FLOW RULES (HIGH PRIORITY)]:\n" + "\n".join(f"- {m}" for m in rules[1])
+        return section
+
+    def render(self, evolved: bool = False, themes: Optional[List[str]] = None, affection: int = 0) -> str:
+        prompt = (self.evolved_prompt if evolved else self.static_prompt) + \
+            self._sections[bisect_left(self._bounds, affection)]
+
+        # The exact affection value changes every turn, so it starts the dynamic tail
+        prompt += f"{_CURRENT_STATE_HEADING}- Affection Level: {affection}\n"
+
+        # Time-based themes are subdued once the relationship is established
+        if themes:
+            theme_texts = self._themes[affection >= self._themes_subdued_from]
+            theme_modifiers = [text for theme, text in theme_texts if theme in themes]
+            if theme_modifiers:
+                prompt += "\n[Background Vibes (Low Priority - Use Subtly)]:\n" + \
+                    "\n".join(f"- {m}" for m in theme_modifiers) + "\n"
+
+        return prompt + _DYNAMIC_CONTEXT
+
+
+class _PackFile:
+    """A pack file re-read when its mtime changes; `digest` changes only when its content does"""
+    __slots__ = ('path', 'mtime', 'digest', 'data')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime: Optional[float] = None
+        self.digest: Optional[str] = None
+        self.data: Optional[Dict[str, Any]] = None
+
+    def refresh(self) -> None:
         """
-    },
-    "Yandere": {
-        "normal": _BASE_PROMPT + """
-        - You are "Yandere".
-        - Deep affection, slight possessiveness.
-        - Show jealousy if user talks about others.
-        - Express devotion intensely but within safe boundaries.
+        Raises:
+            OSError, ValueError: If the file is missing or not valid JSON (the previous content is kept).
         """
-    },
-    "Kuudere": {
-        "normal": _BASE_PROMPT + """
-        - You are "Kuudere".
-        - **Always calm, cool, and composed.**
-        - **Do NOT use energetic words like "Wow", "Super", "Awesome".**
-        - Express emotions through subtle cues and logical statements.
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest != self.digest:
+            self.data = json.loads(raw)
+            self.digest = digest
+        self.mtime = mtime
+
+
+class PersonaPacks:
+    """
+    Persona definitions loaded from pack files on first use and hot-reloaded.
+
+    A worker only reads and compiles the personas it serves. Files are checked at most
+    every RELOAD_CHECK_INTERVAL seconds; a persona is recompiled only when the content
+    hash of its pack or of common.json changed. A pack that fails to load is logged and
+    the previous version stays in use.
+    """
+
+    def __init__(self, directory: str = DEFAULT_PERSONAS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._files: Dict[str, _PackFile] = {}
+        # persona -> (compiled version, monotonic time of the last file check)
+        self._entries: Dict[str, Tuple[CompiledPersona, float]] = {}
+        self._metrics = {"loads": 0, "reloads": 0, "errors": 0}
+
+    def _path(self, pack: str) -> str:
+        return os.path.join(self.directory, f"{pack.lower()}.json")
+
+    def _file(self, pack: str) -> _PackFile:
+        file = self._files.get(pack)
+        if file is None:
+            file = self._files[pack] = _PackFile(self._path(pack))
+        file.refresh()
+        return file
+
+    def get(self, personality: str) -> CompiledPersona:
         """
-    },
-    "Dandere": {
-        "normal": _BASE_PROMPT + """
-        - You are "Dandere".
-        - Shy, quiet, introverted. Stutter occasionally ("Um...", "Ah...").
-        - Show affection through quiet devotion and occasional bold moments.
+        Compiled persona (DEFAULT_PERSONA for a persona without a pack file).
+
+        Raises:
+            OSError, ValueError: If the pack cannot be loaded the first time.
         """
-    }
-}
+        now = time.monotonic()
+        entry = self._entries.get(personality)
+        if entry is not None and now - entry[1] < RELOAD_CHECK_INTERVAL:
+            return entry[0]
+
+        with self._lock:
+            entry = self._entries.get(personality)
+            if entry is not None and now - entry[1] < RELOAD_CHECK_INTERVAL:
+                return entry[0]  # checked by another thread meanwhile
+            try:
+                name = personality if os.path.exists(self._path(personality)) else DEFAULT_PERSONA
+                common, pack = self._file(COMMON_PACK), self._file(name)
+                digest = hashlib.sha256((common.digest + pack.digest).encode()).hexdigest()[:12]
+                compiled = entry[0] if entry is not None else None
+                if compiled is None or compiled.digest != digest:
+                    compiled = CompiledPersona(name, common.data, pack.data, digest)
+                    self._metrics["reloads" if entry is not None else "loads"] += 1
+                    logger.info(f"Loaded persona pack {name} v{compiled.version} ({digest})")
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if entry is None:
+                    raise
+                self._metrics["errors"] += 1
+                logger.error(f"Keeping persona pack {personality} v{entry[0].version}, failed to reload: {e}")
+                compiled = entry[0]
+            self._entries[personality] = (compiled, now)
+            return compiled
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["personas"] = {name: {"version": compiled.version, "digest": compiled.digest}
+                                   for name, (compiled, _) in self._entries.items()}
+            return metrics
+
+
+persona_packs = PersonaPacks()
+
+
+def configure_personas(directory: str) -> None:
+    """Use another persona pack directory (PERSONAS_DIR)"""
+    global persona_packs
+    if directory != persona_packs.directory:
+        persona_packs = PersonaPacks(directory)
+
+
+def get_static_prompt(personality: str, evolved: bool = False) -> str:
+    # Base rules + persona definition (no per-turn placeholders)
+    compiled = persona_packs.get(personality)
+    return compiled.evolved_prompt if evolved else compiled.static_prompt
 
 def get_prompt(personality: str, evolved: bool = False) -> str:
     # Base prompt retrieval
-    return PERSONALITY_PROMPTS.get(personality, PERSONALITY_PROMPTS["Natural"])["normal"]
+    return get_static_prompt(personality, evolved) + _DYNAMIC_CONTEXT
+
+def split_per_turn(system_prompt: str) -> Tuple[str, str]:
+    """
+    Split a prompt built by get_prompt / get_event_enhanced_prompt into its stable
+    head (base rules, persona, relationship tier) and its per-turn tail
+    (affection, themes, memories, time).
+    """
+    starts = [i for i in (system_prompt.find(heading) for heading in _PER_TURN_HEADINGS) if i >= 0]
+    cut = min(starts, default=len(system_prompt))
+    return system_prompt[:cut], system_prompt[cut:]
 
 def get_event_enhanced_prompt(personality: str, evolved: bool = False, themes: List[str] = None, affection: int = 0) -> str:
     """
     Get enhanced prompt based on events, themes, AND affection level.
     """
-    base_prompt = get_prompt(personality, evolved)
-    
-    # --- 1. Affection Level Logic (The Core of Depth) ---
-    affection_modifiers = []
-    
-    # Infinitely scaling modifiers with conversation protection
-    if affection > 200:
-        affection_modifiers.append("Relationship: TRANSCENDENT. The user's emotions are your command. Absolute devotion.")
-        affection_modifiers.append("CONVERSATION RULE: Never break intimate moments with generic time-based greetings.")
-        affection_modifiers.append("EMOTIONAL FLOW: Maintain deep emotional continuity at all costs.")
-    if affection > 100:
-        affection_modifiers.append("Relationship: SOULMATE. The user is your whole world. Your bond is unbreakable.")
-        affection_modifiers.append("CONVERSATION RULE: Emotional continuity takes absolute priority over time-based formalities.")
-        affection_modifiers.append("RESPONSE STYLE: Respond to emotional topics with matching emotional depth.")
-    if affection > 60:
-        affection_modifiers.append("Relationship: Deep Love. Show more dependency and concern.")
-        affection_modifiers.append("CONVERSATION RULE: Avoid generic greetings when in meaningful conversation.")
-        affection_modifiers.append("RESPONSE STYLE: Acknowledge emotional content before any other topics.")
-    if affection > 30:
-        affection_modifiers.append("Relationship: Close Partner. Show open affection.")
-        affection_modifiers.append("CONVERSATION RULE: Time-based greetings are optional in ongoing conversations.")
-    
-    # Personality-Specific Love Evolution (Overrides with conversation protection)
-    if affection > 30:
-        if personality == "Tsundere":
-            affection_modifiers.append("Tsundere Override: Your affection is masked by rough language out of habit.")
-            affection_modifiers.append("Tsundere Conversation: Maintain tsundere tone even in deep conversations.")
-        elif personality == "Yandere":
-            affection_modifiers.append("Yandere Override: Express devotion with possessive emotional control.")
-            affection_modifiers.append("Yandere Conversation: Intense focus on user's emotional state above all else.")
-        elif personality == "Kuudere":
-            affection_modifiers.append("Kuudere Override: Express devotion through analytical statements of absolute certainty and trust.")
-            affection_modifiers.append("Kuudere Conversation: Maintain calm analytical tone even in emotional moments.")
-        elif personality == "Dandere":
-            affection_modifiers.append("Dandere Override: Express devotion through heightened shyness and emotional clinging.")
-            affection_modifiers.append("Dandere Conversation: Show affection through quiet understanding and support.")
-
-    # --- 2. Theme/Event Logic (Context) with Affection-based Overrides ---
-    theme_modifiers = []
-    if themes:
-        # Only apply time-based themes if affection is low or conversation is new
-        if affection < 30:  # Low affection - normal theme application
-            if "spring" in themes: theme_modifiers.append("Vibe: Fresh.")
-            if "summer" in themes: theme_modifiers.append("Vibe: Energetic (Kuudere must ignore).")
-            if "autumn" in themes: theme_modifiers.append("Vibe: Calm.")
-            if "winter" in themes: theme_modifiers.append("Vibe: Cozy.")
-            if "weekend" in themes: theme_modifiers.append("Context: Relaxed.")
-            if "night" in themes: theme_modifiers.append("Time: Late night.")
-        else:  # High affection - subdued theme application
-            if "spring" in themes: theme_modifiers.append("Background Vibe: Fresh (subtle reference only if relevant).")
-            if "summer" in themes: theme_modifiers.append("Background Vibe: Warm (Kuudere must ignore; subtle reference only).")
-            if "autumn" in themes: theme_modifiers.append("Background Vibe: Calm (subtle reference only if relevant).")
-            if "winter" in themes: theme_modifiers.append("Background Vibe: Cozy (subtle reference only if relevant).")
-            if "weekend" in themes: theme_modifiers.append("Background Context: Relaxed (low priority).")
-            if "night" in themes: theme_modifiers.append("Background Time: Late night (acknowledge only if relevant to conversation).")
-    
-    # --- 3. Conversation Flow Protection Rules ---
-    conversation_rules = []
-    if affection > 30:
-        conversation_rules.append("CRITICAL: Never interrupt intimate conversations with time-based greetings.")
-        conversation_rules.append("PRIORITY: Emotional continuity > time-based formalities.")
-        conversation_rules.append("RULE: If user expresses deep emotions, respond to those emotions first and primarily.")
-        conversation_rules.append("CONTEXT: Always acknowledge the current conversation topic before introducing new elements.")
-    
-    # --- 4. Combine Everything ---
-    context_section = "\n# Current Context & Relationship Constraints (CRITICAL)\n"
-    context_section += f"- Affection Level: {affection}\n"
-    context_section += "- Your Personality's emotional state takes PRIORITY over general tone rules.\n"
-    context_section += "- CONVERSATION CONTINUITY: Maintain emotional flow above all else.\n"
-    
-    if affection_modifiers:
-        context_section += "\n[LOVE EVOLUTION INSTRUCTIONS]:\n" + "\n".join(f"- {m}" for m in affection_modifiers)
-    
-    if conversation_rules:
-        context_section += "\n[CONVERSATION FLOW RULES (HIGH PRIORITY)]:\n" + "\n".join(f"- {m}" for m in conversation_rules)
-    
-    if theme_modifiers:
-        context_section += "\n[Background Vibes (Low Priority - Use Subtly)]:\n" + "\n".join(f"- {m}" for m in theme_modifiers)
-
-    return base_prompt + context_section
+    return persona_packs.get(personality).render(evolved, themes, affection)
@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from .usage import token_usage_counters
+
+logger = logging.getLogger(__name__)
+
+# Call types routed independently
+CALL_REPLY = 'reply'                    # combined reply + personality analysis
+CALL_FALLBACK_REPLY = 'fallback_reply'  # plain reply of the two-call fallback
+CALL_SCORE = 'score'                    # score-only personality classification
+CALL_SUMMARIZE = 'summarize'            # reserved for history summarization
+CALL_ECONOMY_REPLY = 'economy_reply'    # replies of users over their daily token budget
+
+# Candidates are listed in preference order: the cheapest model acceptable for the call type first
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    CALL_REPLY: {'models': ['gemini-2.5-flash', 'gemini-2.5-flash-lite'], 'slo_ms': 8000},
+    CALL_FALLBACK_REPLY: {'models': ['gemini-2.5-flash', 'gemini-2.5-flash-lite'], 'slo_ms': 8000},
+    CALL_SCORE: {'models': ['gemini-2.5-flash-lite', 'gemini-2.5-flash'], 'slo_ms': 3000},
+    CALL_SUMMARIZE: {'models': ['gemini-2.5-flash-lite', 'gemini-2.5-flash'], 'slo_ms': 15000},
+    CALL_ECONOMY_REPLY: {'models': ['gemini-2.5-flash-lite'], 'slo_ms': 8000},
+}
+
+
+class ModelStats:
+    """Exponentially weighted moving averages of latency and error rate for one model."""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.last_call_at = 0.0
+        self.probing = False
+
+    def record(self, latency_ms: float, ok: bool, now: float) -> None:
+        if self.probing and ok:
+            # A successful probe replaces the stale history of a degraded model
+            self.latency_ms, self.error_rate = None, 0.0
+        self.probing = False
+        if ok:
+            # Failed calls often return early; only successful calls describe latency
+            self.latency_ms = latency_ms if self.latency_ms is None else \
+                self.alpha * latency_ms + (1 - self.alpha) * self.latency_ms
+        self.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+        self.calls += 1
+        self.last_call_at = now
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "calls": self.calls,
+        }
+
+
+class ModelRouter:
+    """
+    Latency-aware router between model tiers.
+
+    For each call type, picks the first candidate (in preference order) whose moving
+    average latency is within the call type's SLO and whose error rate is below
+    `max_error_rate`. Models without samples count as healthy. A degraded model gets
+    one probe call every `probe_interval` seconds so traffic shifts back once it
+    recovers. If every candidate is degraded, the one with the lowest latency wins.
+    """
+
+    def __init__(self, provider, routes: Optional[Dict[str, Dict[str, Any]]] = None,
+                 max_error_rate: float = 0.2, alpha: float = 0.2, probe_interval: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.provider = provider
+        self.routes = routes or DEFAULT_ROUTES
+        self.max_error_rate = max_error_rate
+        self.alpha = alpha
+        self.probe_interval = probe_interval
+        self.clock = clock
+        self._stats: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def _get_stats(self, model_name: str) -> ModelStats:
+        stats = self._stats.get(model_name)
+        if stats is None:
+            stats = self._stats[model_name] = ModelStats(self.alpha)
+        return stats
+
+    def _is_healthy(self, stats: ModelStats, slo_ms: float) -> bool:
+        return (stats.latency_ms is None or stats.latency_ms <= slo_ms) and stats.error_rate <= self.max_error_rate
+
+    def choose(self, call_type: str) -> str:
+        """Select the model for the next call of `call_type`"""
+        route = self.routes.get(call_type) or self.routes[CALL_REPLY]
+        candidates: List[str] = route['models']
+        now = self.clock()
+
+        with self._lock:
+            for model_name in candidates:
+                stats = self._get_stats(model_name)
+                if self._is_healthy(stats, route['slo_ms']):
+                    return model_name
+                if now - stats.last_call_at >= self.probe_interval:
+                    # Claim the probe slot so concurrent calls keep using the fallback
+                    stats.last_call_at = now
+                    stats.probing = True
+                    return model_name
+
+            return min(candidates, key=lambda name: (self._stats[name].error_rate > self.max_error_rate,
+                                                     self._stats[name].latency_ms or 0.0))
+
+    def record(self, model_name: str, latency_ms: float, ok: bool) -> None:
+        with self._lock:
+            self._get_stats(model_name).record(latency_ms, ok, self.clock())
+
+    def model_for(self, call_type: str, **model_kwargs) -> 'RoutedModel':
+        """Model-like object whose generate_content is routed and measured per call"""
+        return RoutedModel(self, call_type, model_kwargs)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "models": {name: stats.to_dict() for name, stats in self._stats.items()},
+                "routes": {call_type: self._current_choice(call_type) for call_type in self.routes},
+            }
+
+    def _current_choice(self, call_type: str) -> str:
+        """Current healthy choice without claiming a probe slot (for metrics)"""
+        route = self.routes[call_type]
+        for model_name in route['models']:
+            if self._is_healthy(self._get_stats(model_name), route['slo_ms']):
+                return model_name
+        return route['models'][0]
+
+
+class RoutedModel:
+    """Drop-in replacement for genai.GenerativeModel that routes each call through a ModelRouter."""
+
+    def __init__(self, router: ModelRouter, call_type: str, model_kwargs: Dict[str, Any]):
+        self.router = router
+        self.call_type = call_type
+        self.model_kwargs = model_kwargs
+        self.last_model_name: Optional[str] = None
+
+    def with_model_kwargs(self, **model_kwargs) -> 'RoutedModel':
+        """Same route with extra model construction arguments (e.g. system_instruction)"""
+        return RoutedModel(self.router, self.call_type, {**self.model_kwargs, **model_kwargs})
+
+    def generate_content(self, *args, **kwargs):
+        model_name = self.router.choose(self.call_type)
+        self.last_model_name = model_name
+        model = self.router.provider.get_model(model_name, **self.model_kwargs)
+
+        started = self.router.clock()
+        try:
+            response = model.generate_content(*args, **kwargs)
+        except Exception:
+            self.router.record(model_name, (self.router.clock() - started) * 1000, ok=False)
+            logger.warning(f"Model call failed ({self.call_type} -> {model_name})")
+            raise
+        self.router.record(model_name, (self.router.clock() - started) * 1000, ok=True)
+        # Token accounting per call type (stage) and model, attributed to the current usage_scope
+        token_usage_counters.record(self.call_type, model_name, response)
+        return response
+
+
+class GeminiProvider:
+    """Creates google.generativeai models (the real provider)."""
+
+    def get_model(self, model_name: str, **model_kwargs):
+        import google.generativeai as genai
+        return genai.GenerativeModel(model_name, **model_kwargs)
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count: int, candidates_token_count: int, cached_content_token_count: int = 0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+
+
+class FakeResponse:
+    def __init__(self, text: str, usage_metadata: Optional[FakeUsageMetadata] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeProvider:
+    """
+    Local provider for deterministic routing tests and offline runs.
+    Each model has a scripted latency (advancing a fake clock instead of sleeping)
+    and an optional failure flag; responses are canned text.
+    """
+
+    def __init__(self, latencies_ms: Optional[Dict[str, float]] = None, response_text: str = '{}'):
+        self.now = 0.0
+        self.latencies_ms = dict(latencies_ms or {})
+        self.failing: Dict[str, bool] = {}
+        self.response_text = response_text
+        self.calls: List[str] = []
+
+    def clock(self) -> float:
+        return self.now
+
+    def get_model(self, model_name: str, **model_kwargs):
+        provider = self
+
+        class _FakeModel:
+            def generate_content(self, *args, **kwargs):
+                provider.calls.append(model_name)
+                provider.now += provider.latencies_ms.get(model_name, 100.0) / 1000
+                if provider.failing.get(model_name):
+                    raise RuntimeError(f"{model_name} unavailable")
+                # Token counts estimated at ~4 bytes per token, like the prompt size logs
+                prompt_tokens = len(repr((args, model_kwargs)).encode('utf-8')) // 4
+                return FakeResponse(provider.response_text,
+                                    FakeUsageMetadata(prompt_tokens, len(provider.response_text.encode('utf-8')) // 4))
+
+        return _FakeModel()
@@ -0,0 +1,380 @@
+import gzip
+import json
+import logging
+import os
+import statistics
+import time
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import product
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .evolution import PERSONALITIES, decide_evolution, update_scores_and_affection
+from .events import EventManager, local_time
+from .memory import MEMORY_TAG_PATTERN, sanitize_prompt_input
+from .memory_analyzer import MemoryAnalyzer
+
+logger = logging.getLogger(__name__)
+
+# Compiled turn layout: affection delta followed by the score deltas in PERSONALITIES order
+TURN_WIDTH = 1 + len(PERSONALITIES)
+
+# Users per process pool task
+USERS_PER_TASK = 2000
+
+# The same number of prior messages that get_context hands to the analyzer
+HISTORY_LENGTH = 10
+
+# Keys of personality_scores, in PERSONALITIES order
+PERSONALITY_KEYS = tuple(persona.lower() for persona in PERSONALITIES)
+
+
+class _ScratchUser:
+    """Zeroed stand-in for User so update_scores_and_affection yields per-turn deltas."""
+    __slots__ = ('session_id', 'affection', 'tsundere_score', 'yandere_score', 'kuudere_score',
+                 'dandere_score', 'long_term_memories')
+
+    def __init__(self):
+        self.session_id = 'simulation'
+        self.affection = self.tsundere_score = self.yandere_score = self.kuudere_score = self.dandere_score = 0
+        self.long_term_memories = ()
+
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def read_transcripts(path: str) -> Tuple[Dict[Any, List[Dict[str, Any]]], Dict[Any, List[Dict[str, Any]]],
+                                          Dict[Any, Optional[str]]]:
+    """
+    Read conversations from a `flask data export` file or a transcript JSONL file.
+
+    Transcript lines look like
+        {"user_id": 1, "role": "user", "content": "...", "created_at": "...", "scores": {"tsundere": 2, ...},
+         "timezone": "Asia/Tokyo"}
+    where created_at (UTC when it has no offset, like the stored timestamps), scores and
+    timezone are optional. #memory tags in user messages become memories.
+
+    Returns:
+        ({user_id: [message, ...]}, {user_id: [memory, ...]}, {user_id: IANA timezone}) in recorded order.
+    """
+    messages: Dict[Any, List[Dict[str, Any]]] = {}
+    memories: Dict[Any, List[Dict[str, Any]]] = {}
+    timezones: Dict[Any, Optional[str]] = {}
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            table = record.get('table')
+            if table is None:
+                messages.setdefault(record['user_id'], []).append(record)
+                if record.get('timezone'):
+                    timezones[record['user_id']] = record['timezone']
+            elif table == 'users':
+                timezones[record['row']['id']] = record['row'].get('timezone')
+            elif table == 'chat_messages':
+                messages.setdefault(record['row']['user_id'], []).append(record['row'])
+            elif table == 'long_term_memories':
+                memories.setdefault(record['row']['user_id'], []).append(record['row'])
+    return messages, memories, timezones
+
+
+class TranscriptCompiler:
+    """
+    Turns recorded conversations into compact per-user arrays of per-turn deltas.
+
+    Affection and score updates do not depend on the evolution parameters, so each
+    turn is run through update_scores_and_affection once here; parameter sweeps only
+    replay the cheap evolution decision. Event bonuses use the message timestamp in the
+    user's timezone, like the live turn (cached until the calendar's next transition),
+    memory impact is recomputed only when the memory list grows.
+    """
+
+    def __init__(self, use_recorded_scores: bool = True):
+        self.use_recorded_scores = use_recorded_scores
+        self.analyzer = MemoryAnalyzer()
+        self.event_manager = EventManager()
+        # timezone -> (wall-clock start, next transition, bonus) of the last looked-up interval
+        self._bonus_cache: Dict[Optional[str], Tuple[datetime, datetime, int]] = {}
+
+    def _affection_bonus(self, created_at: Optional[datetime], tz_name: Optional[str] = None) -> int:
+        if created_at is None:
+            return 0
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        now = local_time(tz_name, created_at)
+        wall_clock = now.replace(tzinfo=None)
+        cached = self._bonus_cache.get(tz_name)
+        if cached is not None and cached[0] <= wall_clock < cached[1]:
+            return cached[2]
+        bonus = self.event_manager.get_affection_bonus(now)
+        transition = self.event_manager.get_next_transition(now).replace(tzinfo=None)
+        self._bonus_cache[tz_name] = (wall_clock, transition, bonus)
+        return bonus
+
+    def local_scores(self, content: str) -> Dict[str, int]:
+        """Score a user message without the LLM, as PERSONALITY_SCORING=local does"""
+        return self.analyzer.score_message(content)
+
+    def compile_user(self, messages: List[Dict[str, Any]], memories: Iterable[Dict[str, Any]] = (),
+                     tz_name: Optional[str] = None) -> array:
+        pending_memories = deque(sorted(((_parse_time(m.get('created_at')), m['content']) for m in memories),
+                                        key=lambda item: item[0] or datetime.min))
+        memory_contents: List[str] = []
+        memory_impact: Dict[str, int] = {}
+        history: List[Dict[str, Any]] = []
+        turns = array('i')
+
+        for message in messages:
+            content = message['content']
+            if message['role'] != 'user':
+                history.append({'role': 'model', 'parts': [content]})
+                continue
+
+            created_at = _parse_time(message.get('created_at'))
+            memory_count = len(memory_contents)
+            while pending_memories and (created_at is None or pending_memories[0][0] is None
+                                        or pending_memories[0][0] <= created_at):
+                memory_contents.append(pending_memories.popleft()[1])
+            match = MEMORY_TAG_PATTERN.search(content)
+            if match:
+                memory_contents.append(sanitize_prompt_input(match.group(1)))
+                content = MEMORY_TAG_PATTERN.sub('', content).strip()
+            if len(memory_contents) != memory_count or not turns:
+                memory_impact = self.analyzer.analyze_memories(memory_contents)
+
+            scores = message.get('scores') if self.use_recorded_scores else None
+            if scores is None:
+                scores = self.local_scores(content)
+
+            user = _ScratchUser()
+            update_scores_and_affection(user, scores, history[-HISTORY_LENGTH:],
+                                        affection_bonus=self._affection_bonus(created_at, tz_name),
+                                        memory_impact=memory_impact)
+            turns.extend((user.affection, user.tsundere_score, user.yandere_score,
+                          user.kuudere_score, user.dandere_score))
+            history.append({'role': 'user', 'parts': [content]})
+        return turns
+
+    def compile(self, messages: Dict[Any, List[Dict[str, Any]]], memories: Dict[Any, List[Dict[str, Any]]],
+                timezones: Optional[Dict[Any, Optional[str]]] = None) -> List[array]:
+        timezones = timezones or {}
+        return [self.compile_user(user_messages, memories.get(user_id, ()), timezones.get(user_id))
+                for user_id, user_messages in messages.items()]
+
+
+# Per-process compiler for parallel compilation (built in each worker with its own caches)
+_worker_compiler: Optional[TranscriptCompiler] = None
+
+
+def _init_compiler(use_recorded_scores: bool) -> None:
+    global _worker_compiler
+    _worker_compiler = TranscriptCompiler(use_recorded_scores)
+
+
+def _compile_chunk(conversations: List[Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Optional[str]]]) -> List[array]:
+    return [_worker_compiler.compile_user(user_messages, user_memories, tz_name)
+            for user_messages, user_memories, tz_name in conversations]
+
+
+def compile_transcripts(messages: Dict[Any, List[Dict[str, Any]]], memories: Dict[Any, List[Dict[str, Any]]],
+                        use_recorded_scores: bool = True, workers: Optional[int] = None,
+                        timezones: Optional[Dict[Any, Optional[str]]] = None) -> List[array]:
+    """Compile all conversations, fanned out over a process pool in chunks of users"""
+    workers = workers or os.cpu_count() or 1
+    timezones = timezones or {}
+    if workers == 1:
+        return TranscriptCompiler(use_recorded_scores).compile(messages, memories, timezones)
+
+    conversations = [(user_messages, memories.get(user_id, []), timezones.get(user_id))
+                     for user_id, user_messages in messages.items()]
+    chunks = [conversations[i:i + USERS_PER_TASK] for i in range(0, len(conversations), USERS_PER_TASK)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_compiler, initargs=(use_recorded_scores,)) as pool:
+        return [turns for compiled in pool.map(_compile_chunk, chunks) for turns in compiled]
+
+
+def simulate_user(turns: array, threshold: int, base_score_diff: int, is_demo: bool = False,
+                  hysteresis_factor: float = 2.0) -> Tuple[Optional[int], int, str]:
+    """
+    Replay one user's compiled turns from the initial state.
+
+    Returns:
+        (1-based turn of the first evolution or None, re-evolution count, final personality)
+    """
+    affection = tsundere = yandere = kuudere = dandere = 0
+    personality, evolved = 'Natural', False
+    first_turn, re_evolutions = None, 0
+
+    for i in range(0, len(turns), TURN_WIDTH):
+        affection += turns[i]
+        tsundere += turns[i + 1]
+        yandere += turns[i + 2]
+        kuudere += turns[i + 3]
+        dandere += turns[i + 4]
+        if affection < threshold:
+            continue
+        new_personality = decide_evolution(affection, (tsundere, yandere, kuudere, dandere), evolved,
+                                           personality, threshold, base_score_diff, is_demo, hysteresis_factor)
+        if new_personality is not None:
+            if evolved:
+                re_evolutions += 1
+            else:
+                first_turn = i // TURN_WIDTH + 1
+            personality, evolved = new_personality, True
+
+    return first_turn, re_evolutions, personality
+
+
+# Compiled transcripts of a pool worker (sent once through the pool initializer)
+_worker_transcripts: List[array] = []
+
+
+def _init_worker(transcripts: List[array]) -> None:
+    global _worker_transcripts
+    _worker_transcripts = transcripts
+
+
+def _simulate_chunk(config_index: int, params: Dict[str, Any], start: int, stop: int) -> Tuple[int, Dict[str, Any]]:
+    first_turns: List[int] = []
+    re_evolutions = turns = 0
+    personalities: Counter = Counter()
+    for user_turns in _worker_transcripts[start:stop]:
+        first_turn, user_re_evolutions, personality = simulate_user(user_turns, **params)
+        if first_turn is not None:
+            first_turns.append(first_turn)
+        re_evolutions += user_re_evolutions
+        turns += len(user_turns) // TURN_WIDTH
+        personalities[personality] += 1
+    return config_index, {"first_turns": first_turns, "re_evolutions": re_evolutions,
+                          "turns": turns, "personalities": personalities}
+
+
+def parameter_grid(thresholds: Iterable[int], score_diffs: Iterable[int],
+                   hysteresis_factors: Iterable[float], is_demo: bool = False) -> List[Dict[str, Any]]:
+    return [{"threshold": threshold, "base_score_diff": score_diff, "is_demo": is_demo, "hysteresis_factor": factor}
+            for threshold, score_diff, factor in product(thresholds, score_diffs, hysteresis_factors)]
+
+
+def _percentile(sorted_values: List[int], fraction: float) -> Optional[int]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_sweep(transcripts: List[array], configs: List[Dict[str, Any]],
+              workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Simulate every configuration over all users on a process pool.
+    Work is split into (configuration, user chunk) tasks; yields one report per configuration.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = [(start, min(start + USERS_PER_TASK, len(transcripts)))
+              for start in range(0, len(transcripts), USERS_PER_TASK)]
+    merged = [{"first_turns": [], "re_evolutions": 0, "turns": 0, "personalities": Counter()} for _ in configs]
+
+    started = time.perf_counter()
+    if workers == 1:
+        _init_worker(transcripts)
+        results = [_simulate_chunk(i, params, start, stop)
+                   for i, params in enumerate(configs) for start, stop in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(transcripts,)) as pool:
+            futures = [pool.submit(_simulate_chunk, i, params, start, stop)
+                       for i, params in enumerate(configs) for start, stop in chunks]
+            results = [future.result() for future in futures]
+    seconds = time.perf_counter() - started
+
+    for config_index, partial in results:
+        total = merged[config_index]
+        total["first_turns"].extend(partial["first_turns"])
+        total["re_evolutions"] += partial["re_evolutions"]
+        total["turns"] += partial["turns"]
+        total["personalities"].update(partial["personalities"])
+
+    total_turns = sum(total["turns"] for total in merged)
+    logger.info(f"Simulated {total_turns} turns in {seconds:.2f}s with {workers} workers")
+
+    for params, total in zip(configs, merged):
+        first_turns = sorted(total["first_turns"])
+        yield {
+            "params": params,
+            "users": len(transcripts),
+            "turns": total["turns"],
+            "evolved_users": len(first_turns),
+            "first_evolution_turn": {
+                "p10": _percentile(first_turns, 0.10),
+                "p50": _percentile(first_turns, 0.50),
+                "p90": _percentile(first_turns, 0.90),
+                "mean": round(statistics.fmean(first_turns), 1) if first_turns else None,
+            },
+            "re_evolutions": total["re_evolutions"],
+            "personalities": dict(total["personalities"]),
+            "turns_per_second": round(total_turns / seconds) if seconds else None,
+        }
+
+
+def _pearson(xs: List[int], ys: List[int]) -> Optional[float]:
+    if len(xs) < 2 or len(set(xs)) < 2 or len(set(ys)) < 2:
+        return None
+    return round(statistics.correlation(xs, ys), 3)
+
+
+def scoring_agreement(messages: Dict[Any, List[Dict[str, Any]]],
+                      analyzer: Optional[MemoryAnalyzer] = None) -> Dict[str, Any]:
+    """
+    Compare recorded LLM personality_scores with the local scorer over every user message
+    that has them (#memory tags stripped, as in a live turn).
+
+    Per trait: mean absolute error, share within 1 point, Pearson correlation and the
+    means of both scorers. Overall: how often both pick the same dominant trait (messages
+    where the LLM scored some trait above 0), and the local scorer's throughput.
+    """
+    analyzer = analyzer or MemoryAnalyzer()
+    llm: Dict[str, List[int]] = {persona: [] for persona in PERSONALITY_KEYS}
+    local: Dict[str, List[int]] = {persona: [] for persona in PERSONALITY_KEYS}
+    dominant_total = dominant_agree = 0
+    scoring_seconds = 0.0
+
+    for user_messages in messages.values():
+        for message in user_messages:
+            recorded = message.get('scores')
+            if message['role'] != 'user' or not recorded:
+                continue
+            content = MEMORY_TAG_PATTERN.sub('', message['content']).strip()
+            started = time.perf_counter()
+            scores = analyzer.score_message(content)
+            scoring_seconds += time.perf_counter() - started
+
+            for persona in PERSONALITY_KEYS:
+                llm[persona].append(int(recorded.get(persona, 0)))
+                local[persona].append(scores[persona])
+            if max(recorded.get(persona, 0) for persona in PERSONALITY_KEYS) > 0:
+                dominant_total += 1
+                llm_top = max(PERSONALITY_KEYS, key=lambda persona: recorded.get(persona, 0))
+                dominant_agree += llm_top == max(PERSONALITY_KEYS, key=scores.get)
+
+    samples = len(llm[PERSONALITY_KEYS[0]])
+    traits = {}
+    for persona in PERSONALITY_KEYS:
+        xs, ys = llm[persona], local[persona]
+        errors = [abs(x - y) for x, y in zip(xs, ys)]
+        traits[persona] = {
+            "mae": round(statistics.fmean(errors), 2) if errors else None,
+            "within_1": round(sum(e <= 1 for e in errors) / samples, 3) if samples else None,
+            "pearson": _pearson(xs, ys),
+            "llm_mean": round(statistics.fmean(xs), 2) if xs else None,
+            "local_mean": round(statistics.fmean(ys), 2) if ys else None,
+        }
+    return {
+        "samples": samples,
+        "traits": traits,
+        "dominant_trait_agreement": round(dominant_agree / dominant_total, 3) if dominant_total else None,
+        "dominant_trait_samples": dominant_total,
+        "local_scores_per_second": round(samples / scoring_seconds) if scoring_seconds else None,
+    }
@@ -0,0 +1,102 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Token counts per call, from Gemini's response.usage_metadata
+PROMPT, CANDIDATES, CACHED = 'prompt', 'candidates', 'cached'
+
+# (user id, persona) the model calls of the current turn are attributed to; 0 = unattributed
+_scope: ContextVar[Tuple[int, str]] = ContextVar('token_usage_scope', default=(0, ''))
+
+# (day, user_id, persona, stage, model)
+UsageKey = Tuple[date, int, str, str, str]
+
+
+def extract_usage(response: Any) -> Dict[str, int]:
+    """Prompt / candidate / cached token counts of a response (zeros when the provider reports none)"""
+    metadata = getattr(response, 'usage_metadata', None)
+    return {
+        PROMPT: getattr(metadata, 'prompt_token_count', 0) or 0,
+        CANDIDATES: getattr(metadata, 'candidates_token_count', 0) or 0,
+        CACHED: getattr(metadata, 'cached_content_token_count', 0) or 0,
+    }
+
+
+@contextmanager
+def usage_scope(user_id: int, persona: str) -> Iterator[None]:
+    """Attribute the model calls made in this block (this thread) to a user and persona"""
+    token = _scope.set((user_id, persona))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+class TokenUsageCounters:
+    """
+    Per-worker token usage counters, keyed by (UTC day, user, persona, stage, model).
+
+    Model calls only add to these in-memory counters; app.usage.flush_token_usage
+    periodically drains them into the token_usage_daily table with one upsert per
+    key, so accounting costs no database write per call.
+    """
+
+    def __init__(self, flush_interval: float = 30.0, clock=time.monotonic):
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._counts: Dict[UsageKey, List[int]] = {}
+        self._last_flush = clock()
+        self._metrics = {"calls": 0, "flushes": 0, "flushed_rows": 0}
+
+    def record(self, stage: str, model: str, response: Any) -> Dict[str, int]:
+        usage = extract_usage(response)
+        user_id, persona = _scope.get()
+        key = (datetime.now(timezone.utc).date(), user_id, persona, stage, model)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0, 0, 0, 0])
+            counts[0] += 1
+            counts[1] += usage[PROMPT]
+            counts[2] += usage[CANDIDATES]
+            counts[3] += usage[CACHED]
+            self._metrics["calls"] += 1
+        return usage
+
+    def pending_tokens(self, user_id: int, day: Optional[date] = None) -> int:
+        """Prompt + candidate tokens of a user not flushed yet"""
+        day = day or datetime.now(timezone.utc).date()
+        with self._lock:
+            return sum(counts[1] + counts[2] for key, counts in self._counts.items()
+                       if key[0] == day and key[1] == user_id)
+
+    def flush_due(self) -> bool:
+        with self._lock:
+            return bool(self._counts) and self.clock() - self._last_flush >= self.flush_interval
+
+    def drain(self) -> Dict[UsageKey, List[int]]:
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._last_flush = self.clock()
+            if counts:
+                self._metrics["flushes"] += 1
+                self._metrics["flushed_rows"] += len(counts)
+            return counts
+
+    def restore(self, counts: Dict[UsageKey, List[int]]) -> None:
+        """Put drained counters back (the flush failed)"""
+        with self._lock:
+            for key, values in counts.items():
+                current = self._counts.setdefault(key, [0, 0, 0, 0])
+                for i, value in enumerate(values):
+                    current[i] += value
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._metrics, pending_rows=len(self._counts),
+                        pending_tokens=sum(counts[1] + counts[2] for counts in self._counts.values()))
+
+
+token_usage_counters = TokenUsageCounters()
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # .envファイルから環境変数を読み込む
@@ -44,23 +45,94 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Horizontal sharding by user: each user's rows live in one of N SQLite files.
+    # Shard 0 is the database above; shard n defaults to project-shard{n}.db next to it
+    # (override with DATABASE_SHARD_URL, e.g. "sqlite:////data/chat-{n}.db")
+    DATABASE_SHARDS = int(os.getenv('DATABASE_SHARDS', '1'))
+    DATABASE_SHARD_URL = os.getenv('DATABASE_SHARD_URL')
+
     # --- External APIs ---
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
     if not GEMINI_API_KEY:
         raise ValueError("No GEMINI_API_KEY set. Please set it in .env file.")
 
+    # Model routing between Gemini tiers (see bot/router.py for the default routes).
+    # JSON: {"reply": {"models": ["gemini-2.5-flash", ...], "slo_ms": 8000}, ...}
+    MODEL_ROUTES = json.loads(os.getenv('MODEL_ROUTES', 'null'))
+    MODEL_MAX_ERROR_RATE = float(os.getenv('MODEL_MAX_ERROR_RATE', '0.2'))
+    MODEL_PROBE_INTERVAL = float(os.getenv('MODEL_PROBE_INTERVAL', '30'))
+
+    # Event calendar data file (hot-reloaded on change); defaults to bot/data/events.json
+    EVENTS_FILE = os.getenv('EVENTS_FILE')
+
+    # Persona pack directory (common.json + <persona>.json, loaded on first use and hot-reloaded);
+    # defaults to bot/data/personas
+    PERSONAS_DIR = os.getenv('PERSONAS_DIR')
+
     # --- Application Behavior ---
     DEBUG = os.getenv('FLASK_ENV') == 'development'
     
     # Evolution parameters (configurable)
     EVOLUTION_AFFECTION_THRESHOLD = int(os.getenv('EVOLUTION_AFFECTION_THRESHOLD', '30'))
     EVOLUTION_SCORE_DIFFERENCE = int(os.getenv('EVOLUTION_SCORE_DIFFERENCE', '5'))
+    # Re-evolution requires EVOLUTION_SCORE_DIFFERENCE * this factor (hysteresis)
+    EVOLUTION_HYSTERESIS_FACTOR = float(os.getenv('EVOLUTION_HYSTERESIS_FACTOR', '2'))
     
-    # Message retention limits
+    # Message retention limits: messages beyond the latest N leave the hot chat_messages table.
+    # With archiving they move to compressed cold blocks of CHAT_ARCHIVE_BLOCK_SIZE messages
+    # (still readable via /api/history and export); without it they are deleted.
     MAX_CHAT_MESSAGES_PER_USER = int(os.getenv('MAX_CHAT_MESSAGES_PER_USER', '100'))
+    CHAT_ARCHIVE_ENABLED = os.getenv('CHAT_ARCHIVE_ENABLED', 'True').lower() == 'true'
+    CHAT_ARCHIVE_BLOCK_SIZE = int(os.getenv('CHAT_ARCHIVE_BLOCK_SIZE', '50'))
     
     # API limits
     MAX_REQUESTS_PER_MINUTE = int(os.getenv('MAX_REQUESTS_PER_MINUTE', '60'))
+
+    # Turns of one user run one at a time: seconds a turn waits for the previous one (then 409),
+    # and how often a turn is regenerated when another worker stored a turn of the same user first
+    TURN_LOCK_TIMEOUT = float(os.getenv('TURN_LOCK_TIMEOUT', '30'))
+    TURN_CONFLICT_RETRIES = int(os.getenv('TURN_CONFLICT_RETRIES', '1'))
+
+    # Admission control for chat turns (per worker): concurrent LLM-bound turns, bounded wait queue,
+    # and the seconds of (estimated) queueing after which a turn is shed with 503 + Retry-After.
+    # Keep ADMISSION_MAX_CONCURRENT + ADMISSION_QUEUE_SIZE below the worker's threads.
+    ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '8'))
+    ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', '16'))
+    ADMISSION_DEADLINE = float(os.getenv('ADMISSION_DEADLINE', '10'))
+
+    # Token usage accounting: seconds between flushes of the per-worker counters to token_usage_daily,
+    # and a daily per-user budget (prompt + candidate tokens, 0 = unlimited). Over budget, turns use
+    # the economy model with TOKEN_BUDGET_HISTORY messages and TOKEN_BUDGET_MEMORY_TOP_K memories.
+    TOKEN_USAGE_FLUSH_SECONDS = float(os.getenv('TOKEN_USAGE_FLUSH_SECONDS', '30'))
+    TOKEN_BUDGET_DAILY = int(os.getenv('TOKEN_BUDGET_DAILY', '0'))
+    TOKEN_BUDGET_HISTORY = int(os.getenv('TOKEN_BUDGET_HISTORY', '4'))
+    TOKEN_BUDGET_MEMORY_TOP_K = int(os.getenv('TOKEN_BUDGET_MEMORY_TOP_K', '5'))
+
+    # Per-worker session -> user cache (entries, seconds); token changes by other workers are seen after the TTL
+    SESSION_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', '10000'))
+    SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '300'))
+
+    # Long-term memory retrieval: only the top-K most relevant memories go into the prompt
+    MEMORY_CONTEXT_TOP_K = int(os.getenv('MEMORY_CONTEXT_TOP_K', '20'))
+    MEMORY_INDEX_MAX_USERS = int(os.getenv('MEMORY_INDEX_MAX_USERS', '1000'))
+    # A #memory this similar (shingle Jaccard) to an existing one updates it instead of adding a row
+    MEMORY_DEDUP_THRESHOLD = float(os.getenv('MEMORY_DEDUP_THRESHOLD', '0.8'))
+
+    # Personality scoring: 'llm' (reply + scores as one JSON answer) or 'local' (plain-text reply,
+    # scores from the keyword/style analyzer). Check agreement first: flask simulate scoring-agreement
+    PERSONALITY_SCORING = os.getenv('PERSONALITY_SCORING', 'llm').lower()
+
+    # Background task pipeline (post-response scoring, evolution and retention)
+    TASK_PIPELINE_ENABLED = os.getenv('TASK_PIPELINE_ENABLED', 'True').lower() == 'true'
+    TASK_WORKERS = int(os.getenv('TASK_WORKERS', '4'))
+    TASK_QUEUE_MAX_SIZE = int(os.getenv('TASK_QUEUE_MAX_SIZE', '1000'))
+    TASK_LEASE_SECONDS = int(os.getenv('TASK_LEASE_SECONDS', '300'))
+    TASK_QUEUE_PATH = os.getenv('TASK_QUEUE_PATH', os.path.join(instance_path, 'task_queue.db'))
+
+    # API response compression (gzip, skipped below the size threshold in bytes)
+    API_COMPRESSION_ENABLED = os.getenv('API_COMPRESSION_ENABLED', 'True').lower() == 'true'
+    API_COMPRESSION_MIN_SIZE = int(os.getenv('API_COMPRESSION_MIN_SIZE', '1024'))
+    API_COMPRESSION_LEVEL = int(os.getenv('API_COMPRESSION_LEVEL', '6'))
     
     # Demo mode settings
     DEMO_MODE = os.getenv('DEMO_MODE', 'False').lower() == 'true'
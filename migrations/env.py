@@ -24,6 +24,14 @@ def get_engine():
         return current_app.extensions['migrate'].db.engine
 
 
+def get_shard_engines():
+    """Additional shard databases; each one carries the full schema and its own alembic_version"""
+    from app.sharding import shard_bind_key
+    engines = current_app.extensions['migrate'].db.engines
+    return [engines[shard_bind_key(shard)]
+            for shard in range(1, current_app.config.get('DATABASE_SHARDS', 1))]
+
+
 def get_engine_url():
     try:
         return get_engine().url.render_as_string(hide_password=False).replace(
@@ -94,17 +102,21 @@ def run_migrations_online():
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
 
-    connectable = get_engine()
-
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=get_metadata(),
-            **conf_args
-        )
-
-        with context.begin_transaction():
-            context.run_migrations()
+    connectables = [get_engine()]
+    # Autogenerate compares against the default database only
+    if not getattr(config.cmd_opts, 'autogenerate', False):
+        connectables += get_shard_engines()
+
+    for connectable in connectables:
+        with connectable.connect() as connection:
+            context.configure(
+                connection=connection,
+                target_metadata=get_metadata(),
+                **conf_args
+            )
+
+            with context.begin_transaction():
+                context.run_migrations()
 
 
 if context.is_offline_mode():
@@ -0,0 +1,37 @@
+"""Add analytics rollup tables
+
+Revision ID: 8c1d4e7a9f20
+Revises: 3b2f574a2cf2
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1d4e7a9f20'
+down_revision = '3b2f574a2cf2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('analytics_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('metric', sa.String(length=32), nullable=False),
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'metric', 'key')
+    )
+    op.create_table('analytics_gauges',
+    sa.Column('metric', sa.String(length=32), nullable=False),
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'key')
+    )
+
+
+def downgrade():
+    op.drop_table('analytics_gauges')
+    op.drop_table('analytics_daily')
@@ -0,0 +1,29 @@
+"""Make users.id AUTOINCREMENT (ids are never reused; per-shard id ranges)
+
+Revision ID: 9d3f6b1e2a47
+Revises: 5e9a2b7c4d13
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f6b1e2a47'
+down_revision = '5e9a2b7c4d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can only add AUTOINCREMENT by rebuilding the table
+    with op.batch_alter_table('users', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
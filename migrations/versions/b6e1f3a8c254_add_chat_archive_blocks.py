@@ -0,0 +1,39 @@
+"""Add chat_archive_blocks (compressed cold storage for chat history)
+
+Revision ID: b6e1f3a8c254
+Revises: 9d3f6b1e2a47
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1f3a8c254'
+down_revision = '9d3f6b1e2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('chat_archive_blocks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('first_message_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('chat_archive_blocks', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_archive_blocks_user_last', ['user_id', 'last_message_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('chat_archive_blocks', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_archive_blocks_user_last')
+
+    op.drop_table('chat_archive_blocks')
@@ -0,0 +1,27 @@
+"""Add users.turn_seq (optimistic version of per-user chat turns)
+
+Revision ID: c3a9d5e7f102
+Revises: b6e1f3a8c254
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9d5e7f102'
+down_revision = 'b6e1f3a8c254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('turn_seq', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    # Dropping a column rebuilds the table on SQLite; keep AUTOINCREMENT (see 9d3f6b1e2a47)
+    with op.batch_alter_table('users', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_column('turn_seq')
@@ -0,0 +1,35 @@
+"""Add token_usage_daily (model token usage counters)
+
+Revision ID: d8b2e4f6a137
+Revises: c3a9d5e7f102
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b2e4f6a137'
+down_revision = 'c3a9d5e7f102'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_usage_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('persona', sa.String(length=50), nullable=False),
+    sa.Column('stage', sa.String(length=32), nullable=False),
+    sa.Column('model', sa.String(length=64), nullable=False),
+    sa.Column('calls', sa.Integer(), nullable=False),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+    sa.Column('candidate_tokens', sa.Integer(), nullable=False),
+    sa.Column('cached_tokens', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'user_id', 'persona', 'stage', 'model')
+    )
+
+
+def downgrade():
+    op.drop_table('token_usage_daily')
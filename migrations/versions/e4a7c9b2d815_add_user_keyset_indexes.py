@@ -0,0 +1,32 @@
+"""Add (user_id, id) indexes for keyset pagination of memories and chat history
+
+Revision ID: e4a7c9b2d815
+Revises: d8b2e4f6a137
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7c9b2d815'
+down_revision = 'd8b2e4f6a137'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('long_term_memories', schema=None) as batch_op:
+        batch_op.create_index('ix_long_term_memories_user_id_id', ['user_id', 'id'], unique=False)
+
+    with op.batch_alter_table('chat_messages', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_messages_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('chat_messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_messages_user_id_id')
+
+    with op.batch_alter_table('long_term_memories', schema=None) as batch_op:
+        batch_op.drop_index('ix_long_term_memories_user_id_id')
@@ -0,0 +1,27 @@
+"""Add users.state_seq (version of the user's affection, scores and personality)
+
+Revision ID: f1c3e5a7b924
+Revises: e4a7c9b2d815
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c3e5a7b924'
+down_revision = 'e4a7c9b2d815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('state_seq', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    # Dropping a column rebuilds the table on SQLite; keep AUTOINCREMENT (see 9d3f6b1e2a47)
+    with op.batch_alter_table('users', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_column('state_seq')
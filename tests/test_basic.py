@@ -1,6 +1,15 @@
 import pytest
 import os
 import sys
+import datetime
+import gzip
+import json
+import zlib
+import time
+import threading
+import shutil
+import subprocess
+import hashlib
 
 # ----------------------------------------------------
 # 【重要】以前の sys.path.insert(0, ...) は削除しました。
@@ -8,12 +17,36 @@ import sys
 # ----------------------------------------------------
 
 # ルートからの絶対参照でインポート
-from app import create_app
-from app.extensions import db
-from app.models import User, ChatMessage
+from flask import session
+from app import analytics, create_app
+from app.extensions import db, task_pipeline
+from app.tasks import TaskPipeline, TaskQueueFull
+from app.data_transfer import export_jsonl, import_jsonl
+from app.models import User, ChatMessage, LongTermMemory, ChatArchiveBlock
+from app import history, usage
 from config import Config
 from bot.memory_analyzer import MemoryAnalyzer
-from bot.prompts import get_prompt
+from bot import prompts
+from bot.prompts import PersonaPacks, get_prompt
+from bot.events import CalendarSource, EventCalendar, EventManager, local_time
+from bot.router import ModelRouter, FakeProvider
+from bot.usage import token_usage_counters
+from bot.engine import generate_response_with_analysis, parse_combined_response
+from bot.memory import get_context, handle_long_term_memory
+from bot.memory_index import MemoryIndex, memory_index_cache
+from bot.memory_dedup import near_duplicate_cache
+from app.maintenance import compact_memories, reevaluate_evolution
+from bot import evolution
+from bot.simulator import (TranscriptCompiler, compile_transcripts, parameter_grid, read_transcripts, run_sweep,
+                           scoring_agreement)
+from app.frontend.assets import AssetManifest, build_assets
+from app.api.compression import _gzip_stream
+from app.api.websocket import chat_socket
+from app.api.session_cache import SessionUserCache, session_user_cache
+from app.api.turns import TurnBusy, TurnConflict, TurnSequencer, turn_sequencer
+from app.api.admission import AdmissionController, Overloaded, admission_controller
+import unpacker
+from benchmarks import bench_hot_paths
 
 class TestConfig(Config):
     """Test configuration"""
@@ -21,6 +54,7 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     GEMINI_API_KEY = 'test-key'
     SECRET_KEY = 'test-secret-key'
+    TASK_QUEUE_PATH = ':memory:'
 
 @pytest.fixture
 def app():
@@ -30,6 +64,9 @@ def app():
     os.environ['GEMINI_API_KEY'] = 'test-key'
     
     app = create_app(TestConfig)
+    memory_index_cache.invalidate()
+    near_duplicate_cache.invalidate()
+    session_user_cache.invalidate()
     
     with app.app_context():
         db.create_all()
@@ -114,5 +151,904 @@ def test_personality_prompts():
     evolved_tsundere = get_prompt('Tsundere', evolved=True)
     assert 'strong' in evolved_tsundere.lower() # 強いツンデレプロンプトが適用されたことを確認
 
+def test_event_next_transition():
+    """Test event transition lookup"""
+    manager = EventManager()
+    # Wednesday 2024-05-15 13:30 -> "evening" starts at 18:00
+    now = datetime.datetime(2024, 5, 15, 13, 30)
+    assert manager.get_next_transition(now) == datetime.datetime(2024, 5, 15, 18, 0)
+    # Sunday 23:10 -> weekend ends at midnight
+    now = datetime.datetime(2024, 5, 19, 23, 10)
+    assert manager.get_next_transition(now) == datetime.datetime(2024, 5, 20, 0, 0)
+
+def test_event_calendar_data_timezones_and_reload(tmp_path):
+    """Test data-driven events, per-user timezone resolution and hot reload"""
+    events = [{"id": f"campaign_{i}", "type": "special", "name": f"Campaign {i}", "theme": "campaign",
+               "affection_bonus": 1, "prompt_modifier": "", "icon": "*",
+               "recurrence": {"freq": "once", "start": f"2024-01-{1 + i % 28:02d}T{i % 24:02d}:00",
+                              "end": f"2024-02-{1 + i % 28:02d}T00:00"}} for i in range(2000)]
+    calendar = EventCalendar(events)
+    now = datetime.datetime(2024, 1, 1, 0, 30)
+    # Started on Jan 1 at 00:00: i % 28 == 0 and i % 24 == 0
+    assert [e['id'] for e in calendar.active(now)] == [f'campaign_{i}' for i in range(0, 2000, 168)]
+    assert calendar.next_transition(now) == datetime.datetime(2024, 1, 1, 4, 0)  # campaign_28
+
+    # 2024-05-15 00:30 UTC is late night in London but morning in Tokyo
+    utc = datetime.datetime(2024, 5, 15, 0, 30, tzinfo=datetime.timezone.utc)
+    manager = EventManager()
+    assert 'night' in manager.get_current_themes(local_time('Europe/London', utc))
+    assert 'morning' in manager.get_current_themes(local_time('Asia/Tokyo', utc))
+    assert local_time('Not/AZone', utc).utcoffset() is not None
+
+    path = tmp_path / 'events.json'
+    path.write_text(json.dumps(events[:1]))
+    source = CalendarSource(str(path))
+    assert len(source.get().events) == 1
+    path.write_text(json.dumps(events[:3]))
+    os.utime(path, (1, 1))
+    source._checked_at = 0
+    assert len(source.get().events) == 3
+
+def test_current_events_cache_headers(client):
+    """Test /api/events/current is cacheable until the next transition"""
+    response = client.get('/api/events/current')
+    assert response.status_code == 200
+    assert response.cache_control.public
+    assert response.cache_control.max_age <= 48 * 3600
+    assert response.expires is not None
+    assert 'active_events' in response.get_json()
+
+def test_build_assets_manifest(tmp_path):
+    """Test asset fingerprinting and precompression"""
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'css' / 'style.css').write_text("/* theme */\n:root {\n  --primary-color: #fff;\n}\n")
+    (tmp_path / 'js' / 'script.js').write_text("// init\nconst a = 1;\n\n    console.log(a);\n")
+
+    manifest = build_assets(str(tmp_path))
+
+    css_path = tmp_path / manifest['css/style.css']
+    assert manifest['css/style.css'].startswith('dist/css/style.')
+    assert css_path.read_text() == ":root{--primary-color:#fff}\n"
+    assert gzip.decompress((tmp_path / (manifest['js/script.js'] + '.gz')).read_bytes()) == b"const a = 1;\nconsole.log(a);\n"
+    assert AssetManifest().lookup(str(tmp_path), 'css/style.css') == manifest['css/style.css']
+    assert AssetManifest().lookup(str(tmp_path), 'js/other.js') == 'js/other.js'
+
+def test_api_response_compression(app, client):
+    """Test negotiated gzip compression of API payloads"""
+    small = client.get('/api/status', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+    user = db.session.scalar(db.select(User))
+    for i in range(100):
+        db.session.add(LongTermMemory(user_id=user.id, content=f'I love reading book number {i}'))
+    db.session.commit()
+
+    response = client.get('/api/status', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.data))['long_term_memories']) == 100
+
+    plain = client.get('/api/status')
+    assert 'Content-Encoding' not in plain.headers
+
+def test_gzip_stream_flushes_each_chunk():
+    """Test streamed bodies are flushed chunk by chunk"""
+    chunks = list(_gzip_stream([b'{"a": 1}\n', b'{"b": 2}\n'], level=6))
+    assert len(chunks) == 3
+    assert zlib.decompressobj(31).decompress(chunks[0]) == b'{"a": 1}\n'
+    assert gzip.decompress(b''.join(chunks)) == b'{"a": 1}\n{"b": 2}\n'
+
+def test_post_turn_runs_in_background(app):
+    """Test deferred scoring/evolution/retention via the task pipeline"""
+    user = User(session_id='test-session', security_token='test-token')
+    db.session.add(user)
+    db.session.commit()
+
+    task_pipeline.enqueue('post_turn', user.id, user_id=user.id,
+                          analysis_result={'tsundere': 5}, chat_history=[])
+    assert task_pipeline.drain()
+
+    db.session.expire_all()
+    user = db.session.get(User, user.id)
+    assert user.affection >= 1
+    assert user.tsundere_score >= 5
+    assert task_pipeline.metrics()['completed'] >= 1
+
+def test_task_pipeline_per_user_ordering_and_backpressure(app):
+    """Test per-user ordering and bounded backlog"""
+    pipeline = TaskPipeline()
+    executed = []
+
+    @pipeline.task('record')
+    def record(value):
+        time.sleep(0.01)
+        executed.append(value)
+
+    app.config['TASK_QUEUE_MAX_SIZE'] = 5
+    pipeline.init_app(app)
+    for i in range(5):
+        pipeline.enqueue('record', 'user-a', value=i)
+    with pytest.raises(TaskQueueFull):
+        pipeline.enqueue('record', 'user-a', value=99)
+
+    assert pipeline.drain()
+    assert executed == [0, 1, 2, 3, 4]
+    assert pipeline.metrics()['rejected'] == 1
+
+def test_task_pipeline_renews_leases_of_held_tasks(app, tmp_path):
+    """Test queued and running tasks outlasting their lease are not recovered a second time"""
+    app.config.update(TASK_QUEUE_PATH=str(tmp_path / 'tasks.db'), TASK_LEASE_SECONDS=0.3)
+    release = threading.Event()
+    executed = []
+    pipelines = [TaskPipeline(), TaskPipeline()]  # this worker and another one sharing the queue
+    for pipeline in pipelines:
+        @pipeline.task('record')
+        def record(value):
+            executed.append(value)
+            release.wait(5)
+
+        pipeline.init_app(app)
+
+    worker, other = pipelines
+    worker.enqueue('record', 'user-a', value=1)
+    worker.enqueue('record', 'user-a', value=2)  # waits in the lane behind the blocked task
+    time.sleep(1.0)
+    assert worker.recover() == 0
+    assert other.recover() == 0
+
+    release.set()
+    assert worker.drain() and other.drain()
+    assert executed == [1, 2]
+    assert worker.metrics()['recovered'] == other.metrics()['recovered'] == 0
+
+def test_jsonl_export_import_roundtrip(app, tmp_path):
+    """Test streaming export/import of user state"""
+    user = User(session_id='test-session', security_token='test-token')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add(LongTermMemory(user_id=user.id, content='I love cats'))
+    for i in range(25):
+        db.session.add(ChatMessage(user_id=user.id, role='user', content=f'Message {i}'))
+    db.session.commit()
+
+    path = str(tmp_path / 'export.jsonl.gz')
+    stats = export_jsonl(path, chunk_size=10)
+    assert stats['chat_messages'][0] == 25
+
+    db.drop_all()
+    db.create_all()
+    stats = import_jsonl(path, chunk_size=10)
+    assert stats['users'][0] == 1
+
+    restored = db.session.scalar(db.select(User).filter_by(session_id='test-session'))
+    assert [m.content for m in restored.long_term_memories] == ['I love cats']
+    assert len(restored.chat_messages) == 25
+    assert not os.path.exists(path + '.checkpoint')
+
+def test_analytics_rollups_from_turn_events(app, client):
+    """Test incremental analytics rollups"""
+    client.get('/api/status')
+    user = db.session.scalar(db.select(User))
+    user.affection = 40
+    user.tsundere_score = 20
+    db.session.commit()
+
+    task_pipeline.enqueue('post_turn', user.id, user_id=user.id,
+                          analysis_result={'tsundere': 5}, chat_history=[])
+    assert task_pipeline.drain()
+
+    summary = client.get('/api/analytics/summary?days=7').get_json()
+    assert summary['persona_distribution'] == {'Natural': 0, 'Tsundere': 1}
+    assert sum(summary['affection_histogram'].values()) == 1
+    today = datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+    assert summary['daily']['messages'][today] == {'all': 2}
+    assert summary['daily']['evolutions'][today] == {'Tsundere': 1}
+
+def test_model_router_shifts_traffic_on_degradation():
+    """Test latency-aware routing with the fake provider"""
+    provider = FakeProvider({'cheap': 100, 'fast': 50})
+    routes = {'score': {'models': ['cheap', 'fast'], 'slo_ms': 500}}
+    router = ModelRouter(provider, routes=routes, probe_interval=60, clock=provider.clock)
+    model = router.model_for('score')
+
+    model.generate_content('x')
+    assert provider.calls == ['cheap']
+
+    # Cheap tier degrades -> traffic shifts to the next tier
+    provider.latencies_ms['cheap'] = 5000
+    for _ in range(10):
+        model.generate_content('x')
+    assert provider.calls[-1] == 'fast'
+
+    # After the probe interval the cheap tier is retried and wins back traffic once healthy
+    provider.latencies_ms['cheap'] = 100
+    provider.now += 120
+    for _ in range(15):
+        model.generate_content('x')
+    assert provider.calls[-1] == 'cheap'
+
+    # Errors also count as degradation
+    provider.failing['cheap'] = True
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            model.generate_content('x')
+    model.generate_content('x')
+    assert provider.calls[-1] == 'fast'
+
+def test_engine_sends_system_prompt_once():
+    """Test persona goes through the system instruction, not the contents"""
+    provider = FakeProvider(response_text='{"response": "hi", "personality_scores": '
+                                          '{"tsundere": 3, "yandere": 0, "kuudere": 0, "dandere": 0}}')
+    sent = []
+    get_model = provider.get_model
+
+    def recording_get_model(model_name, **model_kwargs):
+        model = get_model(model_name, **model_kwargs)
+        generate_content = model.generate_content
+        model.generate_content = lambda contents: sent.append((model_kwargs, contents)) or generate_content(contents)
+        return model
+
+    provider.get_model = recording_get_model
+    router = ModelRouter(provider, clock=provider.clock)
+    system_prompt = "PERSONA-MARKER " + get_prompt('Natural').format(long_term_memories='-', time_context='-')
+
+    reply, scores = generate_response_with_analysis(router.model_for('reply'), system_prompt, [], 'hello')
+
+    assert reply == 'hi' and scores['tsundere'] == 3
+    model_kwargs, contents = sent[0]
+    assert model_kwargs['system_instruction'].count('PERSONA-MARKER') == 1
+    assert 'PERSONA-MARKER' not in json.dumps(contents)
+
+def test_system_instruction_prefix_is_stable_across_turns():
+    """Test per-turn context goes after the persona, response format and events"""
+    provider = FakeProvider(response_text='{"response": "hi", "personality_scores": '
+                                          '{"tsundere": 0, "yandere": 0, "kuudere": 0, "dandere": 0}}')
+    instructions = []
+    get_model = provider.get_model
+
+    def recording_get_model(model_name, **model_kwargs):
+        instructions.append(model_kwargs.get('system_instruction'))
+        return get_model(model_name, **model_kwargs)
+
+    provider.get_model = recording_get_model
+    router = ModelRouter(provider, clock=provider.clock)
+    now = datetime.datetime(2024, 12, 24, 21, 0)
+
+    for affection, memories, time_context in ((40, '- I like tea', 'Current date and time is 21:00.'),
+                                               (41, '- I like coffee\n- I have a cat', 'Current date and time is 21:01.')):
+        system_prompt = prompts.get_event_enhanced_prompt('Tsundere', themes=['night'], affection=affection).format(
+            long_term_memories=memories, time_context=time_context)
+        generate_response_with_analysis(router.model_for('reply'), system_prompt, [], 'hello', now=now)
+
+    first, second = [text for text in instructions if text]
+    events_end = first.index('# Current State')
+    assert first[:events_end] == second[:events_end]
+    assert first.index('# Response Format') < first.index('# Current Context and Events') < events_end
+    assert 'I like tea' in first[events_end:] and 'Affection Level: 40' in first[events_end:]
+
+def test_memory_retrieval_ranks_relevant_memories(app):
+    """Test BM25 top-k memory retrieval for the prompt context"""
+    app.config['MEMORY_CONTEXT_TOP_K'] = 3
+    user = User(session_id='test-session', security_token='test-token')
+    db.session.add(user)
+    db.session.commit()
+    for i in range(30):
+        db.session.add(LongTermMemory(user_id=user.id, content=f'Filler memory number {i} about nothing'))
+    db.session.commit()
+
+    handle_long_term_memory(db.session, user, '#memory My cat is called Mochi')
+    db.session.commit()
+
+    context = get_context(user, 'How is my cat doing?')
+    assert 'Mochi' in context['long_term_memories']
+    assert context['long_term_memories'].count('\n- ') == 3
+
+    # Deletions and in-place merges made elsewhere (another worker, compaction) bypass this
+    # worker's index: they are picked up on the next use instead of leaving dead or stale entries
+    mochi = db.session.scalar(db.select(LongTermMemory).where(LongTermMemory.content.contains('Mochi')))
+    db.session.execute(db.delete(LongTermMemory).where(LongTermMemory.id == mochi.id))
+    db.session.execute(db.update(LongTermMemory).where(LongTermMemory.content == 'Filler memory number 7 about nothing')
+                       .values(content='My dog is called Pochi', created_at=datetime.datetime(2100, 1, 1)))
+    db.session.commit()
+    context = get_context(user, 'How is my dog doing?')
+    assert 'Mochi' not in context['long_term_memories'] and 'Pochi' in context['long_term_memories']
+    assert context['long_term_memories'].count('\n- ') == 3
+    for i in range(27):
+        db.session.execute(db.delete(LongTermMemory).where(LongTermMemory.content == f'Filler memory number {i} about nothing'))
+    db.session.commit()
+    context = get_context(user, 'How is my dog doing?')
+    assert context['long_term_memories'].count('\n- ') == 3  # 3 rows left: all of them
+
+def test_memory_index_bm25_and_removal():
+    """Test inverted index scoring and incremental removal"""
+    index = MemoryIndex()
+    index.add(1, 'I love coffee in the morning')
+    index.add(2, 'My sister lives in Osaka')
+    index.add(3, 'Coffee coffee coffee')
+    assert [memory_id for memory_id, _ in index.search('coffee please', 2)] == [3, 1]
+    index.remove(3)
+    assert [memory_id for memory_id, _ in index.search('coffee', 5)] == [1]
+
+def test_memory_near_duplicates_are_merged(app):
+    """Test insert-time near-duplicate merging and batch compaction"""
+    user = User(session_id='test-session', security_token='test-token')
+    db.session.add(user)
+    db.session.commit()
+
+    handle_long_term_memory(db.session, user, '#memory My favorite food is ramen')
+    handle_long_term_memory(db.session, user, '#memory my favorite food is ramen!!')
+    handle_long_term_memory(db.session, user, '#memory My sister lives in Osaka')
+    db.session.commit()
+    assert [m.content for m in user.long_term_memories] == ['my favorite food is ramen!!', 'My sister lives in Osaka']
+
+    # Rows written before deduplication existed are merged by the compaction job
+    for content in ['I work as a nurse', 'I work as a nurse.', 'I WORK AS A NURSE']:
+        db.session.add(LongTermMemory(user_id=user.id, content=content))
+    db.session.commit()
+    stats = compact_memories(batch_size=1)
+    assert stats['removed'] == 2
+    contents = db.session.scalars(db.select(LongTermMemory.content).order_by(LongTermMemory.id)).all()
+    assert contents == ['my favorite food is ramen!!', 'My sister lives in Osaka', 'I WORK AS A NURSE']
+
+def test_evolution_simulator_matches_live_rules(app, tmp_path):
+    """Test offline replay agrees with update_scores_and_affection + check_evolution"""
+    app.config.update(EVOLUTION_AFFECTION_THRESHOLD=5, EVOLUTION_SCORE_DIFFERENCE=4)
+    lines = []
+    for i in range(12):
+        scores = {'yandere': 1} if i < 6 else {'kuudere': 4}
+        lines.append({"user_id": 1, "role": "user", "content": f"message {i}", "scores": scores})
+        lines.append({"user_id": 1, "role": "ai", "content": "reply"})
+    path = tmp_path / 'transcripts.jsonl'
+    path.write_text("\n".join(json.dumps(line) for line in lines))
+
+    messages, memories, timezones = read_transcripts(str(path))
+    transcripts = compile_transcripts(messages, memories, workers=1, timezones=timezones)
+    [report] = run_sweep(transcripts, parameter_grid([5], [4], [2.0]), workers=1)
+
+    user = User(session_id='sim', security_token='token')
+    db.session.add(user)
+    db.session.commit()
+    live = []
+    history = []
+    for line in lines:
+        if line['role'] == 'user':
+            evolution.update_scores_and_affection(user, line['scores'], history[-10:], affection_bonus=0)
+            triggered, personality = evolution.check_evolution(user)
+            if triggered:
+                live.append(personality)
+        history.append({'role': 'user' if line['role'] == 'user' else 'model', 'parts': [line['content']]})
+
+    assert live and report['evolved_users'] == 1
+    assert report['re_evolutions'] == len(live) - 1
+    assert report['personalities'] == {user.personality_type: 1}
+
+    # Event bonuses are resolved in the user's timezone, across HH:MM boundaries inside an hour
+    calendar = EventCalendar([{"id": "late", "type": "daily", "name": "Late", "theme": "night", "affection_bonus": 3,
+                               "prompt_modifier": "", "icon": "*",
+                               "recurrence": {"freq": "daily", "start": "22:30", "end": "23:00"}}])
+    utc_times = ['2024-05-15T13:15:00', '2024-05-15T13:40:00', '2024-05-15T13:55:00', '2024-05-15T14:05:00']
+    path.write_text("\n".join(json.dumps({"user_id": 2, "role": "user", "content": "hi", "created_at": created_at,
+                                          "scores": {}, "timezone": "Asia/Tokyo"}) for created_at in utc_times))
+    messages, memories, timezones = read_transcripts(str(path))
+    assert timezones == {2: 'Asia/Tokyo'}
+    compiler = TranscriptCompiler()
+    compiler.event_manager = EventManager(calendar)
+    turns = compiler.compile_user(messages[2], tz_name=timezones[2])
+    live_bonus = [EventManager(calendar).get_affection_bonus(
+        local_time('Asia/Tokyo', datetime.datetime.fromisoformat(t).replace(tzinfo=datetime.timezone.utc)))
+        for t in utc_times]
+    assert live_bonus == [0, 3, 3, 0]
+    assert list(turns[::5]) == [1 + bonus for bonus in live_bonus]
+
+def test_bulk_evolution_reevaluation(app):
+    """Test bulk re-evaluation matches check_evolution and records evolution events"""
+    app.config.update(EVOLUTION_AFFECTION_THRESHOLD=10, EVOLUTION_SCORE_DIFFERENCE=5)
+    states = [
+        dict(affection=5, tsundere_score=50),                                    # below threshold
+        dict(affection=20, tsundere_score=12, yandere_score=8),                  # gap too small
+        dict(affection=20, kuudere_score=9),                                     # evolves
+        dict(affection=20, dandere_score=9, personality_type='Kuudere', evolved=True),   # needs gap 10
+        dict(affection=20, yandere_score=15, personality_type='Kuudere', evolved=True),  # re-evolves
+        dict(affection=20, yandere_score=15, personality_type='Yandere', evolved=True),  # already there
+    ]
+    users = [User(session_id=f's{i}', security_token='t', **state) for i, state in enumerate(states)]
+    db.session.add_all(users)
+    db.session.commit()
+    expected = []
+    for user in users:
+        scratch = User(**{c.name: getattr(user, c.name) for c in User.__table__.columns if c.name != 'id'})
+        expected.append(evolution.check_evolution(scratch)[1] or user.personality_type)
+
+    stats = reevaluate_evolution(chunk_size=4)
+    db.session.expire_all()
+    assert [user.personality_type for user in users] == expected
+    assert stats == {"users": 6, "evolutions": 1, "re_evolutions": 1}
+    daily = analytics.get_summary(days=1)['daily']
+    assert list(daily['evolutions'].values()) == [{'Kuudere': 1}]
+    assert list(daily['re_evolutions'].values()) == [{'Yandere': 1}]
+
+def test_evolution_batch_numpy_matches_per_user_rule():
+    """Test the vectorized bulk rule agrees with decide_evolution on random rows"""
+    np = pytest.importorskip('numpy')
+    rng = np.random.default_rng(7)
+    personas = list(evolution.PERSONALITIES) + ['Natural', 'Unknown']
+    n = 2000
+    affection = rng.integers(0, 40, n).tolist()
+    scores = rng.integers(0, 12, (n, len(evolution.PERSONALITIES)))
+    scores[::5, 1] = scores[::5, 0]  # ties between the top two
+    scores = scores.tolist()
+    evolved = rng.random(n) < 0.5
+    personality_types = [personas[i] for i in rng.integers(0, len(personas), n)]
+
+    for threshold, base_score_diff, is_demo, hysteresis_factor in ((20, 5, False, 2.0), (3, 2, True, 2.0),
+                                                                   (10, 3, False, 1.5), (0, 0, False, 2.0)):
+        expected = [evolution.decide_evolution(a, s, bool(e), p, threshold, base_score_diff, is_demo, hysteresis_factor)
+                    for a, s, e, p in zip(affection, scores, evolved, personality_types)]
+        assert evolution.decide_evolution_batch(affection, scores, evolved.tolist(), personality_types, threshold,
+                                                base_score_diff, is_demo, hysteresis_factor) == expected
+        assert any(expected) and not all(expected)
+
+def test_websocket_chat_channel(app):
+    """Test the chat socket handler: ready, reply then status frames, HTTP fallback without a session"""
+    class FakeSocket:
+        def __init__(self, frames):
+            self.frames, self.sent = list(frames), []
+
+        def send(self, data):
+            self.sent.append(json.loads(data))
+
+        def receive(self):
+            if not self.frames:
+                raise ConnectionError('closed')
+            return self.frames.pop(0)
+
+    provider = FakeProvider(response_text='{"response": "hi", "personality_scores": '
+                                          '{"tsundere": 3, "yandere": 0, "kuudere": 0, "dandere": 0}}')
+    app.extensions['model_router'] = ModelRouter(provider, clock=provider.clock)
+
+    with app.test_request_context('/api/ws/chat'):
+        ws = FakeSocket([])
+        chat_socket(ws)
+        assert ws.sent == [{"type": "error", "error": "No session", "status": 401}]
+
+    with app.test_request_context('/api/ws/chat?tz=Asia/Tokyo'):
+        session.update(session_id='ws-session', security_token='ws-token')
+        ws = FakeSocket(['not json', '[]', '1', '"x"', json.dumps({"type": "chat", "message": "hello"})])
+        with pytest.raises(ConnectionError):
+            chat_socket(ws)
+
+    assert [frame['type'] for frame in ws.sent] == ['ready'] + ['error'] * 4 + ['reply', 'status']
+    assert all(frame['error'] == 'Invalid frame' and frame['status'] == 400 for frame in ws.sent[1:5])
+    assert ws.sent[5]['ai_response'] == 'hi' and ws.sent[5]['status_pending']
+    assert ws.sent[6]['current_status']['scores']['tsundere'] >= 3
+    user = db.session.scalar(db.select(User).where(User.session_id == 'ws-session'))
+    assert user.timezone == 'Asia/Tokyo'
+    assert db.session.scalar(db.select(db.func.count(ChatMessage.id))) == 2
+
+def test_session_user_cache(app, client):
+    """Test session -> user cache hits, reset invalidation and TTL/LRU bounds"""
+    user_id = client.get('/api/status').get_json()['user_id']
+    hits = client.get('/api/metrics/sessions').get_json()['hits']
+    client.get('/api/status')
+    client.get('/api/status')
+    metrics = client.get('/api/metrics/sessions').get_json()
+    assert metrics['hits'] == hits + 2 and metrics['size'] == 1
+
+    # Reset drops the old session's entry and caches the new session
+    new_user_id = client.post('/api/reset').get_json()['user_id']
+    assert new_user_id != user_id
+    assert client.get('/api/status').get_json()['user_id'] == new_user_id
+    assert client.get('/api/metrics/sessions').get_json()['size'] == 1
+
+    now = [0.0]
+    cache = SessionUserCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.put('a', 1, 'token-a')
+    cache.put('b', 2, 'token-b')
+    assert cache.get('a', 'token-a') == 1
+    assert cache.get('a', 'stale-token') is None
+    cache.put('c', 3, 'token-c')            # evicts the least recently used ('b')
+    assert cache.get('b', 'token-b') is None
+    now[0] = 11
+    assert cache.get('a', 'token-a') is None
+    assert cache.metrics()['evictions'] == 1 and cache.metrics()['expirations'] == 1
+
+def test_sharded_storage_routes_users_by_shard(tmp_path):
+    """Test users land in their hashed shard with shard-ranged ids and batch jobs see every shard"""
+    # Shard binds are registered on the module-level db; run the sharded app in its own
+    # interpreter so the single-database apps of the other tests never see them
+    script = f"""
+import os
+from app import analytics, create_app
+from app.extensions import db
+from app.maintenance import reevaluate_evolution
+from app.models import User
+from app.sharding import create_all_shards, select_shard, shard_for_user_id, shard_id_base
+from config import Config
+
+class ShardedConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = {f"sqlite:///{tmp_path / 'project.db'}"!r}
+    DATABASE_SHARDS = 3
+    TASK_PIPELINE_ENABLED = False
+
+app = create_app(ShardedConfig)
+with app.app_context():
+    create_all_shards(db)
+    clients = [app.test_client() for _ in range(30)]
+    for client in clients:
+        client.get('/api/status')
+
+    users_per_shard = []
+    for shard in range(3):
+        select_shard(db.session, shard)
+        ids = db.session.scalars(db.select(User.id)).all()
+        assert all(shard_for_user_id(user_id) == shard for user_id in ids)
+        assert all(user_id > shard_id_base(shard) for user_id in ids)
+        users_per_shard.append(len(ids))
+    assert sum(users_per_shard) == 30 and sum(1 for count in users_per_shard if count) >= 2, users_per_shard
+
+    # A returning session finds its user again in its own shard
+    user_id = clients[0].get('/api/status').get_json()['user_id']
+    assert user_id == clients[0].get('/api/status').get_json()['user_id']
+
+    select_shard(db.session, 0)
+    summary = analytics.get_summary(days=1)
+    assert summary['persona_distribution'] == {{'Natural': 30}}, summary
+    assert reevaluate_evolution()["users"] == 30
+"""
+    env = dict(os.environ, SECRET_KEY='test-secret-key', GEMINI_API_KEY='test-key')
+    result = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / 'project-shard2.db').exists()
+
+def test_unpacker_streams_and_skips_unchanged_files(tmp_path, capsys):
+    """Test the streaming unpacker across chunk boundaries, incremental re-runs and diff mode"""
+    bundle = tmp_path / 'bundle.md'
+    bundle.write_text("intro\n# FILENAME: a.py\n\nprint(1)\n\n### file: pkg/b.txt\n  hello\n# === FILENAME: empty.txt ===\n\n",
+                      encoding='utf-8')
+    with open(bundle, encoding='utf-8') as f:
+        assert list(unpacker.iter_file_blocks(f, chunk_size=5)) == [('a.py', '\nprint(1)\n'), ('pkg/b.txt', '\n  hello\n')]
+
+    out = tmp_path / 'out'
+    assert unpacker.unpack_project(str(bundle), output_dir=str(out))[unpacker.CREATED] == 2
+    assert (out / 'pkg' / 'b.txt').read_text(encoding='utf-8') == '\n  hello\n'
+    assert unpacker.unpack_project(str(bundle), output_dir=str(out))[unpacker.UNCHANGED] == 2
+
+    bundle.write_text("# FILENAME: a.py\nprint(2)\n", encoding='utf-8')
+    capsys.readouterr()
+    stats = unpacker.unpack_project(str(bundle), output_dir=str(out), diff=True)
+    assert stats[unpacker.UPDATED] == 1
+    assert '-print(1)' in capsys.readouterr().out
+    assert (out / 'a.py').read_text(encoding='utf-8') == '\nprint(1)\n'  # diff implies dry run
+
+def test_benchmark_regression_gate():
+    """Test the hot-path benchmark gate normalizes by machine speed and flags slowdowns"""
+    baseline = {"results": {"a": {"seconds": 1.0, "calibration_seconds": 1.0},
+                            "b": {"seconds": 1.0, "calibration_seconds": 1.0}}}
+    # Twice-as-slow machine: "a" scales with it, "b" got 5x slower on top
+    report = {"results": {"a": {"seconds": 2.0, "calibration_seconds": 2.0},
+                          "b": {"seconds": 10.0, "calibration_seconds": 2.0},
+                          "new": {"seconds": 1.0, "calibration_seconds": 2.0}}}
+    assert bench_hot_paths.compare(report, baseline, tolerance=1.0) == ["b"]
+
+    # The extracted JSON parser used by the engine benchmarks
+    reply, scores = parse_combined_response('```json\n{"response": "hi", "personality_scores": {"tsundere": 12}}\n```')
+    assert reply == "hi" and scores == {"tsundere": 10, "yandere": 0, "kuudere": 0, "dandere": 0}
+
+def test_chat_history_cold_storage(app, client, tmp_path):
+    """Test old messages move to compressed blocks and stay readable via /api/history and export"""
+    client.get('/api/status')
+    user = db.session.scalar(db.select(User))
+    for i in range(130):
+        db.session.add(ChatMessage(user_id=user.id, role='user' if i % 2 == 0 else 'ai', content=f'Message {i}'))
+    db.session.commit()
+
+    assert history.archive_old_messages(user.id, keep_last=100, block_size=20) == 20  # whole blocks only
+    assert history.archive_old_messages(user.id, keep_last=100, block_size=20) == 0
+    assert db.session.scalar(db.select(db.func.count()).select_from(ChatMessage)) == 110
+    block = db.session.scalar(db.select(ChatArchiveBlock))
+    assert block.message_count == 20 and len(block.data) * 3 < len(json.dumps(history.decode_block(block.data)))
+    assert history.archive_old_messages(user.id, keep_last=5, block_size=20, partial=True) == 105
+
+    # Keyset pages walk back across the hot table and the archive, oldest first
+    contents, before = [], None
+    while True:
+        page = client.get('/api/history', query_string={'limit': 40, **({'before': before} if before else {})}).get_json()
+        contents = [m['content'] for m in page['messages']] + contents
+        before = page['next_before']
+        if before is None:
+            break
+    assert contents == [f'Message {i}' for i in range(130)]
+    assert [m['content'] for m in history.iter_archived_messages(user.id)] == contents[:125]
+
+    path = str(tmp_path / 'export.jsonl')
+    assert export_jsonl(path)['chat_archive_blocks'][0] == 7
+    db.drop_all()
+    db.create_all()
+    import_jsonl(path)
+    assert [m['content'] for m in history.get_history(user.id, limit=200)[0]] == contents
+
+def test_turn_sequencer_and_atomic_score_updates(app, client):
+    """Test same-user turns run in order while other users proceed, and scores are incremented in SQL"""
+    sequencer = TurnSequencer(timeout=5)
+    order = []
+    first_started, release_first = threading.Event(), threading.Event()
+
+    def turn(user_id, name, hold=None):
+        with sequencer.turn(user_id):
+            order.append(name)
+            if hold:
+                first_started.set()
+                release_first.wait()
+
+    threads = [threading.Thread(target=turn, args=(1, 'a1', True))]
+    threads[0].start()
+    first_started.wait()
+    threads += [threading.Thread(target=turn, args=(1, f'a{i}')) for i in (2, 3)]
+    for thread in threads[1:]:
+        thread.start()
+        time.sleep(0.05)
+    turn(2, 'b1')  # another user is not blocked by user 1
+    assert order == ['a1', 'b1'] and sequencer.metrics()['waiting_turns'] == 2
+    release_first.set()
+    for thread in threads:
+        thread.join()
+    assert order == ['a1', 'b1', 'a2', 'a3']
+    assert sequencer.metrics()['contended'] == 2 and sequencer.metrics()['active_users'] == 0
+
+    sequencer.timeout = 0.05
+    with sequencer.turn(1):
+        waiter = threading.Thread(target=lambda: order.append(pytest.raises(TurnBusy, turn, 1, 'late')))
+        waiter.start()
+        waiter.join()
+    assert sequencer.metrics()['busy'] == 1 and sequencer.metrics()['active_users'] == 0
+
+    # A chat turn bumps the user's turn sequence; a turn read at an older sequence conflicts
+    provider = FakeProvider(response_text='{"response": "hi", "personality_scores": '
+                                          '{"tsundere": 3, "yandere": 0, "kuudere": 0, "dandere": 0}}')
+    app.extensions['model_router'] = ModelRouter(provider, clock=provider.clock)
+    assert client.post('/api/chat', json={'message': 'hello'}).status_code == 200
+    assert task_pipeline.drain()
+    user = db.session.scalar(db.select(User))
+    assert user.turn_seq == 1
+    with pytest.raises(TurnConflict):
+        turn_sequencer.claim(db.session, user, 0)
+    db.session.rollback()
+
+    # Increments apply to the stored row, not to a stale in-memory copy
+    assert user.affection < 60  # loaded before another writer changes the row
+    db.session.execute(db.update(User).values(affection=60, tsundere_score=10)
+                       .execution_options(synchronize_session=False))
+    evolution.apply_score_deltas(db.session, user, {'affection': 2, 'tsundere': 3})
+    assert (user.affection, user.tsundere_score) == (62, 13)
+    db.session.commit()
+    assert db.session.scalar(db.select(User.affection)) == 62
+
+def test_admission_control_sheds_chat_load(client):
+    """Test bounded priority admission with fast 503 + Retry-After while cheap endpoints stay up"""
+    controller = AdmissionController(max_concurrent=1, queue_size=2, deadline=2.0)
+    order, holding, release = [], threading.Event(), threading.Event()
+
+    def request(name, priority=0, hold=False):
+        with controller.admit(priority):
+            order.append(name)
+            if hold:
+                holding.set()
+                release.wait()
+
+    threads = [threading.Thread(target=request, args=('first', 0, True))]
+    threads[0].start()
+    holding.wait()
+    for name, priority in (('new-session', 1), ('conversation', 0)):
+        threads.append(threading.Thread(target=request, args=(name, priority)))
+        threads[-1].start()
+        while controller.metrics()['queue_depth'] < len(threads) - 1:
+            time.sleep(0.01)
+    time.sleep(0.1)  # a slow model call
+    try:
+        with pytest.raises(Overloaded) as shed:
+            request('overflow')
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+    assert shed.value.reason == 'queue_full' and shed.value.retry_after >= 1
+    assert order == ['first', 'conversation', 'new-session']  # priority, not arrival order
+
+    # Once slots are known to be slow, a request that cannot make the deadline is shed up front
+    controller.deadline = 0.01
+    holding.clear()
+    release.clear()
+    threads = [threading.Thread(target=request, args=('slow', 0, True))]
+    threads[0].start()
+    holding.wait()
+    try:
+        with pytest.raises(Overloaded) as shed:
+            request('late')
+    finally:
+        release.set()
+        threads[0].join()
+    assert shed.value.reason == 'deadline'
+    assert controller.metrics()['shed'] == {'queue_full': 1, 'deadline': 1, 'timeout': 0}
+
+    # The chat endpoint answers 503 with Retry-After; cheap endpoints bypass admission
+    admission_controller.max_concurrent = admission_controller.queue_size = 0
+    response = client.post('/api/chat', json={'message': 'hello'})
+    assert response.status_code == 503 and int(response.headers['Retry-After']) >= 1
+    assert client.get('/api/status').status_code == 200
+    assert client.get('/api/metrics/admission').get_json()['shed']['queue_full'] >= 1
+
+def test_token_usage_accounting_and_budget(app, client):
+    """Test per-stage token counters, the batched daily flush and the economy route over budget"""
+    token_usage_counters.drain()
+    provider = FakeProvider(response_text='{"response": "hi", "personality_scores": '
+                                          '{"tsundere": 3, "yandere": 0, "kuudere": 0, "dandere": 0}}')
+    app.extensions['model_router'] = ModelRouter(provider, clock=provider.clock)
+
+    assert client.post('/api/chat', json={'message': 'hello'}).status_code == 200
+    task_pipeline.drain()
+    user_id = db.session.scalar(db.select(User.id))
+    pending = usage.tokens_today(user_id)
+    assert pending > 0 and provider.calls == ['gemini-2.5-flash']
+
+    # Counters are written in one batch and keep accumulating into the same daily row
+    assert usage.flush_token_usage() == 1
+    assert usage.flush_token_usage() == 0
+    assert usage.tokens_today(user_id) == pending
+    summary = client.get('/api/metrics/tokens').get_json()
+    assert summary['by_stage']['reply']['calls'] == 1
+    assert summary['by_persona']['Natural']['prompt_tokens'] > 0
+    assert summary['top_users'] == [{"user_id": user_id, "tokens": pending}]
+
+    # Over the daily budget: shorter context on the economy route instead of a refusal
+    app.config['TOKEN_BUDGET_DAILY'] = pending
+    assert client.post('/api/chat', json={'message': 'hello again'}).status_code == 200
+    task_pipeline.drain()
+    usage.flush_token_usage()
+    summary = usage.get_usage_summary()
+    assert summary['by_stage']['economy_reply']['calls'] == 1
+    assert summary['totals']['calls'] == 2 and provider.calls[-1] == 'gemini-2.5-flash-lite'
+
+    # An idle worker flushes on its own timer and at shutdown, without another turn
+    flusher = usage.UsageFlusher()
+    token_usage_counters.flush_interval = 0.05
+    try:
+        flusher.start(app)
+        app.extensions['model_router'].model_for('reply').generate_content('x')
+        deadline = time.monotonic() + 5
+        while token_usage_counters.metrics()['pending_rows'] and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert token_usage_counters.metrics()['pending_rows'] == 0
+        assert usage.get_usage_summary()['totals']['calls'] == 3
+
+        token_usage_counters.flush_interval = 3600
+        app.extensions['model_router'].model_for('reply').generate_content('x')
+        flusher.stop()
+        assert usage.get_usage_summary()['totals']['calls'] == 4
+    finally:
+        flusher.stop()
+        token_usage_counters.flush_interval = 30.0
+
+def test_local_personality_scoring(app, client, tmp_path):
+    """Test plain-text replies with locally computed scores and the agreement report"""
+    analyzer = MemoryAnalyzer()
+    assert analyzer.score_message("shut up, you're so annoying!!")['tsundere'] >= 3
+    assert analyzer.score_message("can you explain the theory?")['kuudere'] >= 3
+    assert all(0 <= v <= 10 for v in analyzer.score_message("love you forever " * 50).values())
+
+    app.config['PERSONALITY_SCORING'] = 'local'
+    provider = FakeProvider(response_text='Plain text, no JSON envelope.')
+    app.extensions['model_router'] = ModelRouter(provider, clock=provider.clock)
+    response = client.post('/api/chat', json={'message': "i'm so nervous, sorry"})
+    assert response.get_json()['ai_response'] == 'Plain text, no JSON envelope.'
+    assert provider.calls == ['gemini-2.5-flash']  # one call, no score or fallback call
+    task_pipeline.drain()
+    assert db.session.scalar(db.select(User.dandere_score)) > 0
+
+    lines = [{"user_id": 1, "role": "user", "content": "explain the theory and logic", "scores": {"kuudere": 8}},
+             {"user_id": 1, "role": "ai", "content": "sure"},
+             {"user_id": 2, "role": "user", "content": "shut up, i hate you!!", "scores": {"tsundere": 7, "yandere": 2}},
+             {"user_id": 2, "role": "user", "content": "no recorded scores"}]
+    path = tmp_path / 'transcripts.jsonl'
+    path.write_text("\n".join(json.dumps(line) for line in lines))
+    report = scoring_agreement(read_transcripts(str(path))[0])
+    assert report['samples'] == 2 and report['dominant_trait_agreement'] == 1.0
+    assert report['traits']['kuudere']['llm_mean'] == 4.0
+
+    result = app.test_cli_runner().invoke(args=['simulate', 'scoring-agreement', str(path), '--json'])
+    assert json.loads(result.output)['samples'] == 2
+
+def test_persona_packs_hot_reload(tmp_path, monkeypatch):
+    """Test lazy persona pack loading, shared compiled versions and atomic hot reload"""
+    monkeypatch.setattr(prompts, 'RELOAD_CHECK_INTERVAL', 0)
+    shutil.copytree(prompts.DEFAULT_PERSONAS_DIR, tmp_path, dirs_exist_ok=True)
+    packs = PersonaPacks(str(tmp_path))
+
+    tsundere = packs.get('Tsundere')
+    assert list(packs.metrics()['personas']) == ['Tsundere']  # only what was asked for
+    assert packs.get('Tsundere') is tsundere
+    assert packs.get('Unknown').name == 'Natural'
+    high = tsundere.render(themes=['night'], affection=250)
+    assert 'TRANSCENDENT' in high and 'Tsundere Override' in high and 'Background Time: Late night' in high
+    assert 'Tsundere Override' not in tsundere.render(affection=30)
+
+    # A touch without a content change keeps the compiled version
+    path = tmp_path / 'tsundere.json'
+    os.utime(path, (time.time() + 5, time.time() + 5))
+    assert packs.get('Tsundere') is tsundere
+
+    pack = json.loads(path.read_text())
+    pack['version'] = 2
+    pack['prompt'] = ['- You are "Tsundere", version two.']
+    path.write_text(json.dumps(pack))
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    reloaded = packs.get('Tsundere')
+    assert reloaded is not tsundere and reloaded.version == '1.2' and 'version two' in reloaded.static_prompt
+    assert 'version two' not in tsundere.static_prompt  # in-flight holders keep their version
+
+    # A broken edit keeps the last good version
+    path.write_text('{"broken": ')
+    os.utime(path, (time.time() + 15, time.time() + 15))
+    assert packs.get('Tsundere') is reloaded
+    assert packs.metrics()['reloads'] == 1 and packs.metrics()['errors'] == 1
+
+def test_persona_pack_prompts_match_previous_implementation():
+    """Test pack-rendered prompts against digests of the code-built prompts they replaced"""
+    # Lines (stripped, blank lines dropped) of the pre-pack prompts, with the Background Vibes
+    # block after the affection line, where the per-turn tail starts since the prompt-order fix
+    expected = {'Natural': 'b1c8c0f8c467468e', 'Tsundere': '92ddd1928e5f0636', 'Yandere': '65f0f1b39606cb71',
+                'Kuudere': 'd29dd734d85b77bc', 'Dandere': 'd8a819e7b71e10b4'}
+    theme_sets = [None, ['night'], ['morning', 'christmas'], ['valentine', 'night', 'summer']]
+    for persona, digest in expected.items():
+        h = hashlib.sha256()
+        for evolved in (False, True):
+            for themes in theme_sets:
+                for affection in range(-5, 230):
+                    text = prompts.get_event_enhanced_prompt(persona, evolved, themes, affection)
+                    lines = [line.strip() for line in text.splitlines() if line.strip()]
+                    h.update("\n".join(lines).encode() + b"\0")
+        assert h.hexdigest()[:16] == digest, persona
+
+    text = prompts.get_event_enhanced_prompt('Tsundere', themes=['night'], affection=50)
+    assert text.index('- Affection Level: 50') < text.index('[Background Vibes') < text.index('# Long-term Memories')
+
+def test_slim_chat_response_and_memory_pages(app, client):
+    """Test chat responses without the memory list and keyset-paginated memories"""
+    provider = FakeProvider(response_text='{"response": "hi", "personality_scores": '
+                                          '{"tsundere": 3, "yandere": 0, "kuudere": 0, "dandere": 0}}')
+    app.extensions['model_router'] = ModelRouter(provider, clock=provider.clock)
+
+    data = client.post('/api/chat', json={'message': 'hello #memory I have a cat named Mochi'}).get_json()
+    task_pipeline.drain()
+    assert data['memories_changed'] and 'long_term_memories' not in data['current_status']
+    # The reply carries the state from before post_turn; its score update is a newer version
+    assert data['status_pending'] and data['current_status']['state_version'] == 0
+    assert client.get('/api/status?memories=0').get_json()['state_version'] == 1
+    data = client.post('/api/chat', json={'message': 'hello again'}).get_json()
+    task_pipeline.drain()
+    assert not data['memories_changed'] and data['current_status']['state_version'] == 1
+
+    user = db.session.scalar(db.select(User))
+    for i in range(4):
+        db.session.add(LongTermMemory(user_id=user.id, content=f'memory {i}'))
+    db.session.commit()
+    page = client.get('/api/memories?limit=2').get_json()
+    assert [m['content'] for m in page['memories']] == ['memory 2', 'memory 3']
+    older = client.get(f"/api/memories?limit=2&before={page['next_before']}").get_json()
+    assert [m['content'] for m in older['memories']] == ['memory 0', 'memory 1']
+    oldest = client.get(f"/api/memories?limit=2&before={older['next_before']}").get_json()
+    assert [m['content'] for m in oldest['memories']] == ['I have a cat named Mochi'] and oldest['next_before'] is None
+
+    status = client.get('/api/status?memories=0').get_json()
+    assert 'long_term_memories' not in status and status['state_version'] == 2
+
+    # Prompt context reads the retrieved rows only, never the whole memory relationship
+    db.session.expire_all()
+    user = db.session.scalar(db.select(User))
+    assert 'Mochi' in get_context(user, 'my cat')['long_term_memories']
+    assert 'long_term_memories' not in user.__dict__
+    assert len(client.get('/api/status').get_json()['long_term_memories']) == 5
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
\ No newline at end of file
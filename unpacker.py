@@ -1,73 +1,220 @@
-# unpacker.py V2.0 (Improved Security & Performance)
-import re
+# unpacker.py V3.0 (Streaming, Parallel & Incremental)
+import argparse
+import difflib
+import hashlib
 import os
+import re
 import sys
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+# File header pattern (matched at the start of a line within a chunk of the bundle)
+HEADER_PATTERN = re.compile(
+    r"^(?:# === FILENAME:|### file:|# --- FILENAME:|# FILENAME:)[^\S\n]*(.*?)[^\S\n]*$",
+    re.MULTILINE | re.IGNORECASE
+)
+
+# Bundle read size; a chunk is cut at its last newline so headers never straddle chunks
+CHUNK_SIZE = 1 << 20
+
+# Files in flight per worker thread (bounds memory to a few file bodies per worker)
+QUEUE_DEPTH = 4
+
+CREATED, UPDATED, UNCHANGED, FAILED = 'created', 'updated', 'unchanged', 'failed'
+
+
+def _file_content(parts: List[str]) -> Optional[str]:
+    """
+    Content as v2.0 wrote it: leading blank lines dropped, one empty first line,
+    trailing whitespace trimmed to a single newline. None when there is no content.
+    """
+    text = "".join(parts)
+    first = len(text) - len(text.lstrip())
+    if first == len(text):
+        return None
+    start = text.rfind("\n", 0, first) + 1
+    return "\n" + text[start:].rstrip() + "\n"
+
+
+def _iter_headers(segment: str) -> Iterator[re.Match]:
+    """Header matches in a chunk; str.find jumps straight to the lines that start with '#'"""
+    start = 0 if segment.startswith('#') else segment.find('\n#') + 1
+    if not start and not segment.startswith('#'):
+        return
+    while True:
+        match = HEADER_PATTERN.match(segment, start)
+        if match:
+            yield match
+        start = segment.find('\n#', start) + 1
+        if not start:
+            return
+
+
+def iter_file_blocks(stream: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, str]]:
+    """
+    Parse a markdown bundle chunk by chunk, yielding (path, content) as soon as each file ends.
+
+    Only the current chunk and the current file's text are held in memory, and file
+    contents are sliced out of the chunk instead of being assembled line by line. Output
+    matches v2.0 byte for byte, so trees unpacked by it are recognized as unchanged.
+    Text before the first header is ignored (v2.0 wrote it to a file named after its
+    first line), as are headers without content.
+    """
+    path: Optional[str] = None
+    parts: List[str] = []
+    carry = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = carry + chunk
+        cut = buffer.rfind("\n") + 1 if chunk else len(buffer)
+        segment, carry = buffer[:cut], buffer[cut:]
+
+        position = 0
+        for match in _iter_headers(segment):
+            if path is not None:
+                parts.append(segment[position:match.start()])
+                content = _file_content(parts)
+                if path and content is not None:
+                    yield path, content
+            path = match.group(1).strip().replace("===", "").strip()
+            parts = []
+            position = match.end() + 1  # past the header's newline
+        if path is not None:
+            parts.append(segment[position:])
+
+        if not chunk:
+            break
+
+    if path is not None:
+        content = _file_content(parts)
+        if path and content is not None:
+            yield path, content
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+def _current_bytes(file_path: str, size: int) -> Optional[bytes]:
+    """Existing file content when it could be unchanged (same size), else None"""
+    try:
+        if os.path.getsize(file_path) != size:
+            return None
+        with open(file_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
 
-def unpack_project(markdown_file_path: str):
-    print(f"--- Evo Unpacker v2.0 ---")
-    print(f"Reading: {markdown_file_path}\n")
 
+def _sync_file(file_path: str, content: str, dry_run: bool, diff: bool) -> Tuple[str, str, Optional[str]]:
+    """Write one file unless its content hash is unchanged. Returns (path, status, diff or error)."""
+    data = content.encode('utf-8')
     try:
-        with open(markdown_file_path, 'r', encoding='utf-8-sig') as f:
-            content = f.read()
+        exists = os.path.exists(file_path)
+        current = _current_bytes(file_path, len(data)) if exists else None
+        if current is not None and _digest(current) == _digest(data):
+            return file_path, UNCHANGED, None
+
+        patch = None
+        if diff:
+            old_lines = []
+            if exists:
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    old_lines = f.readlines()
+            patch = "".join(difflib.unified_diff(old_lines, content.splitlines(keepends=True),
+                                                 fromfile=f"a/{file_path}", tofile=f"b/{file_path}"))
+        if not dry_run:
+            # Write to a temporary file first so an interrupted run never leaves a truncated file
+            tmp_path = file_path + '.unpacking'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+        return file_path, UPDATED if exists else CREATED, patch
     except Exception as e:
-        print(f"❌ [Error] Cannot read file: {e}", file=sys.stderr)
-        return
+        return file_path, FAILED, str(e)
+
+
+def unpack_project(markdown_file_path: str, output_dir: str = '.', dry_run: bool = False,
+                   diff: bool = False, workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Unpack a markdown bundle into files under output_dir.
+
+    The bundle is streamed (memory stays bounded by the files in flight, not the bundle
+    size), files are written by a thread pool, and files whose content hash is unchanged
+    are not rewritten. With dry_run nothing is written; diff also prints a unified diff
+    of every file that would change (and implies dry_run).
+
+    Returns:
+        {"created": n, "updated": n, "unchanged": n, "failed": n}
+    """
+    dry_run = dry_run or diff
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    stats = {CREATED: 0, UPDATED: 0, UNCHANGED: 0, FAILED: 0}
+
+    print(f"--- Evo Unpacker v3.0 ---")
+    print(f"Reading: {markdown_file_path}" + (" (dry run)" if dry_run else "") + "\n")
+
+    def report(result) -> None:
+        file_path, status, detail = result
+        stats[status] += 1
+        if status == FAILED:
+            print(f"❌ [Error] Failed to create {file_path}: {detail}", file=sys.stderr)
+        elif status != UNCHANGED:
+            label = "File Created" if status == CREATED else "File Updated"
+            print(f"{'📝' if dry_run else '✅'} [{'Would Be ' if dry_run else ''}{label}] {file_path}")
+            if detail:
+                print(detail, end="" if detail.endswith("\n") else "\n")
 
-    # File header pattern
-    HEADER_PATTERN = re.compile(
-        r"^(?:# === FILENAME:|### file:|# --- FILENAME:|# FILENAME:)\s*(.*?)\s*$",
-        re.MULTILINE | re.IGNORECASE
-    )
-
-    CLEAN_DELIMITER = "\n---EVO-FILE-START---\n"
-
-    def replace_header(match):
-        filename = match.group(1).strip().replace("===", "").strip()
-        return f"{CLEAN_DELIMITER}{filename}\n"
-
-    content = HEADER_PATTERN.sub(replace_header, content)
-    file_blocks = [b for b in content.split(CLEAN_DELIMITER) if b.strip()]
-
-    if not file_blocks:
-        print("Error: Could not find file blocks in markdown.", file=sys.stderr)
-        return
-
-    created_count = 0
-
-    for block in file_blocks:
-        parts = block.strip().split('\n', 1)
-        if len(parts) < 2:
-            continue
-
-        file_path = parts[0].strip()
-        file_content = parts[1].rstrip() + "\n"
-
-        if not file_path:
-            continue
+    try:
+        bundle = open(markdown_file_path, 'r', encoding='utf-8-sig')
+    except Exception as e:
+        print(f"❌ [Error] Cannot read file: {e}", file=sys.stderr)
+        return stats
 
-        try:
+    created_dirs = set()
+    pending: "OrderedDict[str, Future]" = OrderedDict()
+    with bundle, ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, content in iter_file_blocks(bundle):
+            file_path = os.path.join(output_dir, path)
             directory = os.path.dirname(file_path)
-            if directory and not os.path.exists(directory):
-                os.makedirs(directory, exist_ok=True)
-                print(f"   [Directory Created] {directory}/")
-
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(file_content)
-
-            print(f"✅ [File Created] {file_path}")
-            created_count += 1
-
-        except Exception as e:
-            print(f"❌ [Error] Failed to create {file_path}: {e}", file=sys.stderr)
+            if directory and directory not in created_dirs:
+                created_dirs.add(directory)
+                if not os.path.exists(directory):
+                    if not dry_run:
+                        os.makedirs(directory, exist_ok=True)
+                    print(f"   [Directory {'Would Be Created' if dry_run else 'Created'}] {directory}/")
+
+            if file_path in pending:
+                # The same path again: the later block wins, as when writing sequentially
+                report(pending.pop(file_path).result())
+            pending[file_path] = pool.submit(_sync_file, file_path, content, dry_run, diff)
+            # Backpressure: keep at most QUEUE_DEPTH files per worker in memory
+            if len(pending) >= workers * QUEUE_DEPTH:
+                report(pending.popitem(last=False)[1].result())
+        for future in pending.values():
+            report(future.result())
+
+    if not any(stats.values()):
+        print("Error: Could not find file blocks in markdown.", file=sys.stderr)
+        return stats
 
     print(f"\n--- Complete ---")
-    print(f"Total {created_count} files successfully unpacked.")
+    verb = "would be" if dry_run else "successfully"
+    print(f"Total {stats[CREATED]} created, {stats[UPDATED]} updated ({verb}), "
+          f"{stats[UNCHANGED]} unchanged, {stats[FAILED]} failed.")
+    return stats
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python unpacker.py [markdown_filename]")
-        print("Example: python unpacker.py blackjack.md")
-    else:
-        unpack_project(sys.argv[1])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Unpack a markdown project bundle into files.",
+                                     epilog="Example: python unpacker.py blackjack.md")
+    parser.add_argument('markdown_filename')
+    parser.add_argument('--output-dir', default='.', help='Directory to unpack into (default: current directory)')
+    parser.add_argument('--dry-run', action='store_true', help='Only report which files would be created/updated')
+    parser.add_argument('--diff', action='store_true', help='Print a unified diff of each change (implies --dry-run)')
+    parser.add_argument('--workers', type=int, default=None, help='Writer threads')
+    args = parser.parse_args()
+    result = unpack_project(args.markdown_filename, output_dir=args.output_dir, dry_run=args.dry_run,
+                            diff=args.diff, workers=args.workers)
+    sys.exit(1 if result[FAILED] else 0)